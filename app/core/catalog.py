@@ -0,0 +1,262 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+from app.core.image_store import decode_image, dtype_max
+from app.core.store_config import default_cache_dir
+from app.core.grid_engine import default_workers
+
+# Bump when the stored values change, the catalog is then rebuilt
+CATALOG_VERSION = 3
+
+# Histogram of the (r, g) chromaticity in SIGNATURE_BINS^2 bins, stored as float32
+SIGNATURE_BINS = 32
+# The signature is taken from a strided sample of about this many pixels
+SIGNATURE_PIXELS = 1024 * 1024
+
+# Rows written per transaction while indexing
+COMMIT_EVERY = 50
+
+# Images decoded at the same time per indexing thread; more are only
+# submitted as results come in, so a cancel takes effect right away
+IN_FLIGHT_PER_WORKER = 2
+
+# Means and stds are stored on the 0..255 scale of the sample type (65535
+# for 16-bit, 1.0 for float data), a fixed scale, so images of one type
+# sort and filter by their actual values whatever their brightest pixel
+COLUMNS = ('path', 'file_size', 'mtime', 'width', 'height', 'max_value',
+           'mean_r', 'mean_g', 'mean_b', 'std_r', 'std_g', 'std_b',
+           'brightness', 'norm_r', 'norm_b', 'signature')
+
+
+def color_signature(img_arr, bins=SIGNATURE_BINS):
+    """
+    Normalised histogram (bins^2 float32 values summing to 1) of the (r, g)
+    chromaticity, r = R / (R + G + B). It doesn't depend on the exposure
+    or the bit depth, so it compares the colour of any two images.
+    """
+    h, w = img_arr.shape[:2]
+    step = max(1, int(np.ceil(np.sqrt(h * w / SIGNATURE_PIXELS))))
+    pixels = img_arr[::step, ::step].reshape(-1, 3).astype(np.float32)
+    total = pixels.sum(axis=1)
+    keep = np.isfinite(total) & (total > 0)
+    pixels, total = pixels[keep], total[keep]
+
+    q = np.clip((pixels[:, :2] / total[:, None] * bins).astype(np.int32), 0, bins - 1)
+    hist = np.bincount(q[:, 0] * bins + q[:, 1], minlength=bins ** 2).astype(np.float32)
+    return hist / max(1.0, float(hist.sum()))
+
+
+def image_entry(image_path):
+    """
+    Catalog row of one image: metadata, global mean / std per channel on
+    the 0..255 scale of its sample type, G-normalised means and the colour
+    signature.
+    The file is decoded directly, indexing must not fill the decoded store.
+    """
+    st = os.stat(image_path)
+    img_arr = decode_image(image_path)
+    height, width = img_arr.shape[:2]
+    max_value = dtype_max(img_arr.dtype)
+
+    mean, std = cv2.meanStdDev(np.ascontiguousarray(img_arr))
+    scale = 255.0 / max_value
+    mean = mean.ravel() * scale
+    std = std.ravel() * scale
+    g = mean[1]
+
+    return {
+        'path': os.path.abspath(image_path),
+        'file_size': st.st_size,
+        'mtime': st.st_mtime_ns,
+        'width': width,
+        'height': height,
+        'max_value': float(max_value),
+        'mean_r': float(mean[0]), 'mean_g': float(mean[1]), 'mean_b': float(mean[2]),
+        'std_r': float(std[0]), 'std_g': float(std[1]), 'std_b': float(std[2]),
+        'brightness': float(mean.mean()),
+        'norm_r': float(mean[0] / g) if g != 0 else 0.0,
+        'norm_b': float(mean[2] / g) if g != 0 else 0.0,
+        'signature': color_signature(img_arr),
+    }
+
+
+def signature_distance(signature, signatures):
+    """
+    Hellinger distances (0 = same colours, 1 = no overlap) between one
+    signature and an (N, bins^2) array of signatures.
+    """
+    overlap = np.sqrt(signatures * signature[None, :]).sum(axis=1)
+    return np.sqrt(np.clip(1.0 - overlap, 0.0, 1.0))
+
+
+class ImageCatalog:
+    """
+    SQLite index of per-image colour values for sorting, filtering and
+    "find similar colour" over large image lists.
+    Rows are keyed by path and remember size and mtime, so update() only
+    analyses new and modified files.
+    """
+
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = os.path.join(os.path.dirname(default_cache_dir()), 'catalog.sqlite')
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS images")
+            self.conn.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "path TEXT PRIMARY KEY, file_size INTEGER, mtime INTEGER, width INTEGER, height INTEGER, "
+            "max_value REAL, mean_r REAL, mean_g REAL, mean_b REAL, std_r REAL, std_g REAL, std_b REAL, "
+            "brightness REAL, norm_r REAL, norm_b REAL, signature BLOB, indexed_at REAL)")
+        self.conn.commit()
+
+    def stale_paths(self, paths):
+        """ Paths that are not in the catalog or changed (size / mtime) since they were indexed """
+        with self.lock:
+            known = dict(((row[0], (row[1], row[2])) for row in
+                          self.conn.execute("SELECT path, file_size, mtime FROM images")))
+        stale = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if known.get(os.path.abspath(path)) != (st.st_size, st.st_mtime_ns):
+                stale.append(path)
+        return stale
+
+    def put(self, entries):
+        rows = []
+        for entry in entries:
+            row = [entry[c] for c in COLUMNS]
+            row[-1] = entry['signature'].astype(np.float32).tobytes()
+            rows.append(row + [time.time()])
+        placeholders = ", ".join("?" * (len(COLUMNS) + 1))
+        with self.lock:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO images ({', '.join(COLUMNS)}, indexed_at) VALUES ({placeholders})", rows)
+            self.conn.commit()
+
+    def update(self, paths, workers=None, progress=None, cancel=None):
+        """
+        Indexes the new and modified images of paths on a thread pool.
+        progress(done, total) after every image; cancel is a threading.Event.
+        Returns the number of images indexed.
+        """
+        stale = self.stale_paths(paths)
+        if not stale:
+            return 0
+
+        workers = workers or default_workers()
+        queue = iter(stale)
+        pending = deque()
+        done = 0
+        batch = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for path in queue:
+                pending.append((path, pool.submit(image_entry, path)))
+                if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                    break
+            while pending:
+                path, future = pending.popleft()
+                try:
+                    batch.append(future.result())
+                except Exception as e:
+                    print(f"Error indexing {path}: {e}")
+                done += 1
+                if len(batch) >= COMMIT_EVERY:
+                    self.put(batch)
+                    batch = []
+                if progress:
+                    progress(done, len(stale))
+                if cancel is not None and cancel.is_set():
+                    for _, f in pending:
+                        f.cancel()
+                    break
+                path = next(queue, None)
+                if path is not None:
+                    pending.append((path, pool.submit(image_entry, path)))
+        if batch:
+            self.put(batch)
+        return done
+
+    def entries(self, paths):
+        """ {path: row dict without the signature} of the indexed paths """
+        values = {}
+        columns = [c for c in COLUMNS if c != 'signature']
+        with self.lock:
+            for row in self.conn.execute(f"SELECT {', '.join(columns)} FROM images"):
+                values[row[0]] = dict(zip(columns, row))
+        result = {}
+        for path in paths:
+            entry = values.get(os.path.abspath(path))
+            if entry is not None:
+                result[path] = entry
+        return result
+
+    def signatures(self, paths):
+        """ (indexed paths, (N, bins^2) array of their signatures) """
+        wanted = {os.path.abspath(p): p for p in paths}
+        found, rows = [], []
+        with self.lock:
+            for path, blob in self.conn.execute("SELECT path, signature FROM images"):
+                if path in wanted:
+                    found.append(wanted[path])
+                    rows.append(np.frombuffer(blob, dtype=np.float32))
+        if not rows:
+            return [], np.zeros((0, SIGNATURE_BINS ** 2), dtype=np.float32)
+        return found, np.stack(rows)
+
+    def similar(self, image_path, paths, limit=None):
+        """
+        [(path, distance)] of the indexed paths nearest to the colours of
+        image_path (itself included, at distance 0), closest first.
+        """
+        found, signatures = self.signatures(paths)
+        if image_path not in found:
+            return []
+        distances = signature_distance(signatures[found.index(image_path)], signatures)
+        order = np.argsort(distances, kind='stable')
+        if limit:
+            order = order[:limit]
+        return [(found[i], float(distances[i])) for i in order]
+
+    def prune(self):
+        """ Removes rows of files that no longer exist, returns their number """
+        with self.lock:
+            paths = [row[0] for row in self.conn.execute("SELECT path FROM images")]
+        missing = [(p,) for p in paths if not os.path.exists(p)]
+        if missing:
+            with self.lock:
+                self.conn.executemany("DELETE FROM images WHERE path=?", missing)
+                self.conn.commit()
+        return len(missing)
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM images")
+            self.conn.commit()
+            self.conn.execute("VACUUM")
+
+
+_default_catalog = None
+
+
+def get_catalog():
+    """ Shared catalog instance, opened on first use """
+    global _default_catalog
+    if _default_catalog is None:
+        _default_catalog = ImageCatalog()
+    return _default_catalog
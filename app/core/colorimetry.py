@@ -0,0 +1,183 @@
+import numpy as np
+
+# sRGB (D65) -> CIE XYZ, IEC 61966-2-1
+RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+], dtype=np.float32)
+
+# D65 reference white
+WHITE_D65 = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+
+DELTA_E_METHODS = ('76', '2000')
+
+
+def srgb_to_linear_float(values):
+    """ sRGB companding inverse for float values in 0..1 """
+    values = np.asarray(values, dtype=np.float32)
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4).astype(np.float32)
+
+
+# 8-bit input is linearised through a lookup table
+SRGB_TO_LINEAR_LUT = srgb_to_linear_float(np.arange(256, dtype=np.float32) / 255.0)
+
+
+def srgb_to_linear(rgb, max_value=255.0):
+    """
+    Linear RGB (0..1, float32) from sRGB values.
+    uint8 input uses the lookup table, anything else is scaled by max_value.
+    """
+    rgb = np.asarray(rgb)
+    if rgb.dtype == np.uint8:
+        return SRGB_TO_LINEAR_LUT[rgb]
+    return srgb_to_linear_float(rgb.astype(np.float32) * np.float32(1.0 / max_value))
+
+
+def linear_to_xyz(linear):
+    """ (..., 3) linear RGB -> XYZ (Y of white = 1) """
+    return linear @ RGB_TO_XYZ.T
+
+
+def xyz_to_lab(xyz, white=WHITE_D65):
+    """ (..., 3) XYZ -> CIELAB (L 0..100) """
+    t = (xyz / white).astype(np.float32)
+    delta = 6.0 / 29.0
+
+    # Cube root everywhere, then the linear segment only where it applies
+    f = np.cbrt(t)
+    small = t <= np.float32(delta ** 3)
+    if small.any():
+        f[small] = t[small] * np.float32(1.0 / (3 * delta * delta)) + np.float32(4.0 / 29.0)
+
+    lab = np.empty(f.shape, dtype=np.float32)
+    fy = f[..., 1]
+    lab[..., 0] = 116.0 * fy - 16.0
+    lab[..., 1] = 500.0 * (f[..., 0] - fy)
+    lab[..., 2] = 200.0 * (fy - f[..., 2])
+    return lab
+
+
+def rgb_to_lab(rgb, max_value=255.0):
+    """ (..., 3) sRGB (uint8 or float up to max_value) -> float32 CIELAB """
+    return xyz_to_lab(linear_to_xyz(srgb_to_linear(rgb, max_value)))
+
+
+def delta_e76(lab1, lab2):
+    """ CIE76: Euclidean distance in LAB """
+    d = lab1 - lab2
+    return np.sqrt(np.sum(d * d, axis=-1))
+
+
+def delta_e2000(lab1, lab2):
+    """ CIEDE2000 (kL = kC = kH = 1), vectorised over leading dimensions """
+    lab1 = np.asarray(lab1, dtype=np.float32)
+    lab2 = np.asarray(lab2, dtype=np.float32)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    C1 = np.hypot(a1, b1)
+    C2 = np.hypot(a2, b2)
+    C_mean7 = ((C1 + C2) / 2) ** 7
+    G = 0.5 * (1 - np.sqrt(C_mean7 / (C_mean7 + np.float32(25.0 ** 7))))
+
+    a1p = (1 + G) * a1
+    a2p = (1 + G) * a2
+    C1p = np.hypot(a1p, b1)
+    C2p = np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+
+    dLp = L2 - L1
+    dCp = C2p - C1p
+
+    chroma_zero = (C1p * C2p) == 0
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180, dhp - 360, dhp)
+    dhp = np.where(dhp < -180, dhp + 360, dhp)
+    dhp = np.where(chroma_zero, 0, dhp)
+    dHp = 2 * np.sqrt(C1p * C2p) * np.sin(np.radians(dhp / 2))
+
+    Lp_mean = (L1 + L2) / 2
+    Cp_mean = (C1p + C2p) / 2
+
+    h_sum = h1p + h2p
+    hp_mean = np.where(np.abs(h1p - h2p) > 180,
+                       np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2),
+                       h_sum / 2)
+    hp_mean = np.where(chroma_zero, h_sum, hp_mean)
+
+    T = (1 - 0.17 * np.cos(np.radians(hp_mean - 30))
+         + 0.24 * np.cos(np.radians(2 * hp_mean))
+         + 0.32 * np.cos(np.radians(3 * hp_mean + 6))
+         - 0.20 * np.cos(np.radians(4 * hp_mean - 63)))
+
+    d_theta = 30 * np.exp(-(((hp_mean - 275) / 25) ** 2))
+    Cp_mean7 = Cp_mean ** 7
+    Rc = 2 * np.sqrt(Cp_mean7 / (Cp_mean7 + np.float32(25.0 ** 7)))
+    L50 = (Lp_mean - 50) ** 2
+    Sl = 1 + 0.015 * L50 / np.sqrt(20 + L50)
+    Sc = 1 + 0.045 * Cp_mean
+    Sh = 1 + 0.015 * Cp_mean * T
+    Rt = -np.sin(np.radians(2 * d_theta)) * Rc
+
+    tl, tc, th = dLp / Sl, dCp / Sc, dHp / Sh
+    return np.sqrt(np.maximum(tl * tl + tc * tc + th * th + Rt * tc * th, 0)).astype(np.float32)
+
+
+def delta_e(lab1, lab2, method='76'):
+    """ Per-pixel colour difference, method is one of DELTA_E_METHODS """
+    if method == '76':
+        return delta_e76(lab1, lab2)
+    if method == '2000':
+        return delta_e2000(lab1, lab2)
+    raise ValueError(f"Unknown Delta E method: {method}")
+
+
+def delta_e_summary(de, weights=None):
+    """
+    Mean, std, median, 95th percentile and max of Delta E values.
+    weights: number of pixels per value (e.g. counts of unique colours).
+    """
+    de = np.asarray(de, dtype=np.float64).ravel()
+    if weights is None:
+        weights = np.ones(len(de), dtype=np.float64)
+    else:
+        weights = np.asarray(weights, dtype=np.float64).ravel()
+
+    n = weights.sum()
+    if n == 0:
+        return {'count': 0, 'mean': 0.0, 'std': 0.0, 'median': 0.0, 'p95': 0.0, 'max': 0.0}
+
+    mean = float(np.dot(weights, de) / n)
+    var = float(np.dot(weights, (de - mean) ** 2) / n)
+
+    order = np.argsort(de)
+    cum = np.cumsum(weights[order])
+    sorted_de = de[order]
+    median = float(sorted_de[min(np.searchsorted(cum, 0.5 * n), len(de) - 1)])
+    p95 = float(sorted_de[min(np.searchsorted(cum, 0.95 * n), len(de) - 1)])
+
+    return {
+        'count': int(n),
+        'mean': mean,
+        'std': float(np.sqrt(var)),
+        'median': median,
+        'p95': p95,
+        'max': float(sorted_de[-1]),
+    }
+
+
+def delta_e_to_reference(colors, reference_rgb, method='2000', counts=None, max_value=255.0):
+    """
+    Delta E of every colour in an (N, 3) RGB array against one reference colour.
+    With counts (pixels per colour, e.g. unique colours of a selection) the
+    summary describes all pixels while each colour is converted only once.
+    max_value: full scale of the colours (65535 for 16-bit data), the
+    reference is always given in 8-bit units.
+    Returns (de, summary).
+    """
+    lab = rgb_to_lab(colors, max_value)
+    ref = rgb_to_lab(np.asarray(reference_rgb, dtype=np.float32).reshape(1, 3))
+    de = delta_e(lab, ref, method)
+    return de, delta_e_summary(de, counts)
@@ -0,0 +1,37 @@
+import numpy as np
+import cv2
+
+
+def value_range(values, low=1, high=99):
+    """ Robust display range of a map (percentiles, NaN ignored) """
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return 0.0, 1.0
+    vmin, vmax = np.percentile(finite, [low, high])
+    if vmax <= vmin:
+        vmax = vmin + 1e-6
+    return float(vmin), float(vmax)
+
+
+def apply_colormap(values, vmin=None, vmax=None, colormap=cv2.COLORMAP_TURBO):
+    """
+    Maps a 2D array of values to an (H, W, 4) uint8 RGBA image.
+    NaN values become fully transparent.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    if vmin is None or vmax is None:
+        auto_min, auto_max = value_range(values)
+        vmin = auto_min if vmin is None else vmin
+        vmax = auto_max if vmax is None else vmax
+
+    scale = 255.0 / max(vmax - vmin, 1e-6)
+    norm = np.nan_to_num((values - vmin) * scale, nan=0.0)
+    indices = np.clip(norm, 0, 255).astype(np.uint8)
+
+    bgr = cv2.applyColorMap(indices, colormap)
+    rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+    rgba[:, :, 0] = bgr[:, :, 2]
+    rgba[:, :, 1] = bgr[:, :, 1]
+    rgba[:, :, 2] = bgr[:, :, 0]
+    rgba[:, :, 3] = np.where(np.isfinite(values), 255, 0)
+    return rgba
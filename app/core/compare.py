@@ -0,0 +1,133 @@
+import numpy as np
+
+from app.core.image_store import load_image_array, dtype_max
+from app.core.grid_engine import block_sum
+from app.core.colorimetry import rgb_to_lab, delta_e
+
+# Pixels handled per tile of the comparison pass
+TILE_PIXELS = 4 * 1024 * 1024
+# Resolution of the streaming Delta E histogram used for percentiles
+DE_HIST_MAX = 200.0
+DE_HIST_BINS = 2000
+
+DELTA_MAPS = ('dr', 'dg', 'db', 'de')
+
+
+def overlap_region(base_shape, overlay_shape, offset):
+    """
+    Overlapping part of base and overlay.
+    offset: (dx, dy) integer position of the overlay's top-left corner in base coordinates.
+    Returns (x1, y1, x2, y2) in base coordinates or None.
+    """
+    bh, bw = base_shape[:2]
+    oh, ow = overlay_shape[:2]
+    dx, dy = offset
+    x1, y1 = max(0, dx), max(0, dy)
+    x2, y2 = min(bw, dx + ow), min(bh, dy + oh)
+    if x1 >= x2 or y1 >= y2:
+        return None
+    return x1, y1, x2, y2
+
+
+def compute_delta_maps(base_arr, overlay_arr, offset, cell_size=8, method='76'):
+    """
+    Compares base and overlay over their whole overlap in one tiled pass.
+    Delta = base - overlay per channel in the base image's units (an overlay
+    of another bit depth is rescaled), Delta E is CIE76 or CIEDE2000
+    (method '76' / '2000') in float CIELAB.
+
+    Returns a dict:
+        'origin': (x, y) of the maps in base coordinates,
+        'cell_size': size of one map cell in pixels (1 = per-pixel maps),
+        'maps': {'dr', 'dg', 'db', 'de'} -> (rows, cols) float32 cell means,
+        'summary': means, mean absolute differences, Delta E mean/std/max/p95.
+    or None if the images do not overlap.
+    """
+    dx, dy = int(round(offset[0])), int(round(offset[1]))
+    region = overlap_region(base_arr.shape, overlay_arr.shape, (dx, dy))
+    if region is None:
+        return None
+    x1, y1, x2, y2 = region
+    width, height = x2 - x1, y2 - y1
+
+    cs = max(1, int(cell_size))
+    cols, rows = width // cs, height // cs
+    maps = {k: np.zeros((rows, cols), dtype=np.float32) for k in DELTA_MAPS}
+
+    sum_d = np.zeros(3)
+    sum_abs = np.zeros(3)
+    sum_de = 0.0
+    sum_de2 = 0.0
+    max_de = 0.0
+    de_hist = np.zeros(DE_HIST_BINS, dtype=np.int64)
+
+    base_max = dtype_max(base_arr.dtype)
+    overlay_max = dtype_max(overlay_arr.dtype)
+    overlay_scale = np.float32(base_max / overlay_max)
+
+    # Tiles are whole cell rows, so the cell maps are filled tile by tile
+    tile_h = max(cs, (TILE_PIXELS // max(1, width)) // cs * cs)
+
+    for ty in range(0, height, tile_h):
+        th = min(tile_h, height - ty)
+        b_raw = base_arr[y1 + ty:y1 + ty + th, x1:x2]
+        o_raw = overlay_arr[y1 + ty - dy:y1 + ty - dy + th, x1 - dx:x2 - dx]
+
+        o = o_raw.astype(np.float32)
+        if overlay_scale != 1:
+            o *= overlay_scale
+        d = b_raw.astype(np.float32) - o
+        de = delta_e(rgb_to_lab(b_raw, base_max), rgb_to_lab(o_raw, overlay_max), method)
+
+        # Summary from the same pass
+        sum_d += d.sum(axis=(0, 1), dtype=np.float64)
+        sum_abs += np.abs(d).sum(axis=(0, 1), dtype=np.float64)
+        sum_de += float(de.sum(dtype=np.float64))
+        sum_de2 += float(np.square(de).sum(dtype=np.float64))
+        max_de = max(max_de, float(de.max()))
+        de_hist += np.histogram(de, bins=DE_HIST_BINS, range=(0, DE_HIST_MAX))[0]
+
+        # Cell maps for the full cell rows of this tile
+        cell_rows = th // cs
+        if cell_rows == 0 or cols == 0:
+            continue
+        r0 = ty // cs
+        hh, ww = cell_rows * cs, cols * cs
+        area = float(cs * cs)
+        for i, key in enumerate(('dr', 'dg', 'db')):
+            maps[key][r0:r0 + cell_rows] = block_sum(d[:hh, :ww, i], cs, cs, np.float64) / area
+        maps['de'][r0:r0 + cell_rows] = block_sum(de[:hh, :ww], cs, cs, np.float64) / area
+
+    n = float(width * height)
+    mean_de = sum_de / n
+
+    # 95th percentile from the streaming histogram (bin upper edge)
+    cum = np.cumsum(de_hist)
+    p95_bin = int(np.searchsorted(cum, 0.95 * cum[-1])) if cum[-1] > 0 else 0
+    p95_de = min(max_de, (p95_bin + 1) * DE_HIST_MAX / DE_HIST_BINS)
+
+    summary = {
+        'count': int(n),
+        'mean_dr': float(sum_d[0] / n), 'mean_dg': float(sum_d[1] / n), 'mean_db': float(sum_d[2] / n),
+        'mad_r': float(sum_abs[0] / n), 'mad_g': float(sum_abs[1] / n), 'mad_b': float(sum_abs[2] / n),
+        'mean_de': mean_de,
+        'std_de': float(np.sqrt(max(sum_de2 / n - mean_de * mean_de, 0))),
+        'max_de': max_de,
+        'p95_de': p95_de,
+    }
+
+    return {'origin': (x1, y1), 'cell_size': cs, 'maps': maps, 'summary': summary}
+
+
+def calculate_overlay_difference(base_path, overlay_path, offset, cell_size=8, method='76'):
+    """ compute_delta_maps for two image files """
+    if not base_path or not overlay_path:
+        return None
+
+    try:
+        base_arr = load_image_array(base_path)
+        overlay_arr = load_image_array(overlay_path)
+        return compute_delta_maps(base_arr, overlay_arr, offset, cell_size, method)
+    except Exception as e:
+        print(f"Error comparing images: {e}")
+        return None
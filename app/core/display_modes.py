@@ -0,0 +1,115 @@
+import numpy as np
+import cv2
+
+from app.core.image_store import dtype_max, to_display_uint8
+from app.core.colorimetry import rgb_to_lab
+from app.core.colormap import value_range
+
+# 'rgb' is the image itself; channel modes are grey, ratios and LAB a / b false colour
+DISPLAY_MODES = ('rgb', 'r', 'g', 'b', 'h', 's', 'v', 'l', 'lab_a', 'lab_b', 'rg', 'bg')
+
+# Pixels read from the whole image to fix the range of auto-ranged modes
+RANGE_SAMPLE = 256 * 1024
+
+
+def colormap_lut(colormap):
+    """ 256-entry RGB colour table of an OpenCV colormap """
+    bgr = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(-1, 1), colormap).reshape(256, 3)
+    return np.ascontiguousarray(bgr[:, ::-1])
+
+
+GRAY_LUT = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+TURBO_LUT = colormap_lut(cv2.COLORMAP_TURBO)
+HUE_LUT = colormap_lut(cv2.COLORMAP_HSV)
+
+# Colour table and fixed range (None: robust range of the image) per mode
+MODE_LUTS = {
+    'rgb': (None, (0.0, 255.0)),
+    'r': (GRAY_LUT, (0.0, 255.0)), 'g': (GRAY_LUT, (0.0, 255.0)), 'b': (GRAY_LUT, (0.0, 255.0)),
+    'h': (HUE_LUT, (0.0, 180.0)), 's': (GRAY_LUT, (0.0, 255.0)), 'v': (GRAY_LUT, (0.0, 255.0)),
+    'l': (GRAY_LUT, (0.0, 100.0)), 'lab_a': (TURBO_LUT, None), 'lab_b': (TURBO_LUT, None),
+    'rg': (TURBO_LUT, None), 'bg': (TURBO_LUT, None),
+}
+
+
+def mode_values(block, mode, max_value=None):
+    """
+    One value per pixel of an (H, W, 3) RGB block for a display mode:
+    a channel, HSV in the 8-bit convention (H 0..180, S/V 0..255), CIELAB
+    or a ratio to G. 8-bit channels come back as uint8, the rest as float32.
+    max_value: full scale of the image (default: of its sample type, see
+    image_store.display_max for high-depth data with fewer significant bits).
+    """
+    if max_value is None:
+        max_value = dtype_max(block.dtype)
+    if mode in ('r', 'g', 'b'):
+        values = block[:, :, 'rgb'.index(mode)]
+        if block.dtype == np.uint8:
+            return values
+        return values.astype(np.float32) * np.float32(255.0 / max_value)
+
+    if mode in ('h', 's', 'v'):
+        block = np.ascontiguousarray(block)
+        if block.dtype == np.uint8:
+            return cv2.cvtColor(block, cv2.COLOR_RGB2HSV)[:, :, 'hsv'.index(mode)]
+        unit = block.astype(np.float32) * np.float32(1.0 / max_value)
+        hsv = cv2.cvtColor(unit, cv2.COLOR_RGB2HSV)[:, :, 'hsv'.index(mode)]
+        return hsv * np.float32(0.5 if mode == 'h' else 255.0)
+
+    if mode in ('l', 'lab_a', 'lab_b'):
+        return rgb_to_lab(block, max_value)[:, :, ('l', 'lab_a', 'lab_b').index(mode)]
+
+    if mode in ('rg', 'bg'):
+        num = block[:, :, 0 if mode == 'rg' else 2].astype(np.float32)
+        den = block[:, :, 1].astype(np.float32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = num / den
+        ratio[den == 0] = np.nan
+        return ratio
+
+    raise ValueError(f"Unknown display mode: {mode}")
+
+
+def mode_range(img_arr, mode, max_value=None):
+    """
+    (vmin, vmax) that maps the values of a mode to the colour table, the
+    same for every tile: fixed for bounded channels, otherwise percentiles
+    of a strided sample of the whole image.
+    """
+    fixed = MODE_LUTS[mode][1]
+    if fixed is not None:
+        return fixed
+
+    h, w = img_arr.shape[:2]
+    step = max(1, int(np.sqrt(h * w / RANGE_SAMPLE)))
+    return value_range(mode_values(img_arr[::step, ::step], mode, max_value).astype(np.float32))
+
+
+def render_block(block, mode, vmin=None, vmax=None, max_value=None):
+    """
+    (H, W, 3) uint8 RGB display image of a block in a mode: the values are
+    quantised to 0..255 over (vmin, vmax) and looked up in the mode's
+    256-entry colour table. NaN (e.g. R/G where G = 0) is shown black.
+    max_value: full scale of the whole image, so every tile is scaled alike.
+    """
+    if mode == 'rgb':
+        return np.ascontiguousarray(to_display_uint8(block, max_value))
+
+    lut = MODE_LUTS[mode][0]
+    values = mode_values(block, mode, max_value)
+    if values.dtype == np.uint8 and (vmin, vmax) == (0.0, 255.0):
+        index = np.ascontiguousarray(values)
+    else:
+        scale = np.float32(255.0 / max(vmax - vmin, 1e-6))
+        norm = (values.astype(np.float32) - np.float32(vmin)) * scale
+        index = np.clip(np.nan_to_num(norm, nan=0.0), 0, 255).astype(np.uint8)
+
+    if lut is GRAY_LUT:
+        rgb = cv2.cvtColor(index, cv2.COLOR_GRAY2RGB)
+    else:
+        rgb = cv2.LUT(cv2.merge([index, index, index]), lut.reshape(256, 1, 3))
+    if values.dtype != np.uint8:
+        invalid = ~np.isfinite(values)
+        if invalid.any():
+            rgb[invalid] = 0
+    return rgb
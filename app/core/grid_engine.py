@@ -0,0 +1,369 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from math import gcd
+import numpy as np
+
+# Target amount of pixel data handled by one task
+BAND_TARGET_BYTES = 32 * 1024 * 1024
+
+GRID_COLUMNS = ('x', 'y', 'w', 'h', 'avg_r', 'avg_g', 'avg_b', 'std_r', 'std_g', 'std_b')
+
+# Smallest base cell size of a pyramid: below it the per-base moments cost
+# more than computing the sizes one by one
+MIN_PYRAMID_BASE = 5
+
+# Per-cell metrics available as 2D maps (heatmaps)
+GRID_METRICS = ('mean', 'std', 'norm_r', 'norm_b')
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def square_dtype(dtype):
+    """ Smallest dtype that holds exact squares of the pixel values """
+    if dtype == np.uint8:
+        return np.uint16
+    if dtype == np.uint16:
+        return np.uint32
+    # float32 squares stay float32, the block sums are accumulated in float64
+    if dtype == np.float32:
+        return np.float32
+    return np.float64
+
+
+def block_sum(arr, block_h, block_w, dtype):
+    """ Sums over non-overlapping block_h x block_w blocks (shape must be a multiple) """
+    h, w = arr.shape[:2]
+    acc = np.add.reduceat(arr, np.arange(0, w, block_w), axis=1, dtype=dtype)
+    return np.add.reduceat(acc, np.arange(0, h, block_h), axis=0, dtype=dtype)
+
+
+def band_moments(img_arr, cell_size, row_start, row_end, cols):
+    """
+    Per-cell sums and sums of squares for the cell rows [row_start, row_end).
+    Returns two (rows, cols, 3) float64 arrays.
+    """
+    band = img_arr[row_start * cell_size:row_end * cell_size, :cols * cell_size]
+
+    # Integer data is accumulated exactly, float data in float64
+    acc_dtype = np.uint64 if np.issubdtype(img_arr.dtype, np.integer) else np.float64
+
+    sums = block_sum(band, cell_size, cell_size, acc_dtype)
+    sq_sums = block_sum(np.square(band, dtype=square_dtype(img_arr.dtype)), cell_size, cell_size, acc_dtype)
+
+    return sums.astype(np.float64), sq_sums.astype(np.float64)
+
+
+def grid_moments(img_arr, cell_size, workers=None):
+    """
+    Sums and sums of squares of every full cell of the grid.
+    The image is split into horizontal bands of whole cell rows which are
+    reduced on a thread pool (NumPy releases the GIL inside the reductions)
+    and merged back in order.
+    """
+    h, w = img_arr.shape[:2]
+    rows = h // cell_size
+    cols = w // cell_size
+    if rows == 0 or cols == 0:
+        empty = np.zeros((rows, cols, 3), dtype=np.float64)
+        return empty, empty.copy()
+
+    row_bytes = cell_size * cols * cell_size * 3 * img_arr.itemsize
+    rows_per_band = max(1, BAND_TARGET_BYTES // max(1, row_bytes))
+    bands = [(r, min(r + rows_per_band, rows)) for r in range(0, rows, rows_per_band)]
+
+    workers = workers or default_workers()
+    if workers == 1 or len(bands) == 1:
+        parts = [band_moments(img_arr, cell_size, r0, r1, cols) for r0, r1 in bands]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(bands))) as pool:
+            parts = list(pool.map(lambda b: band_moments(img_arr, cell_size, b[0], b[1], cols), bands))
+
+    sums = np.concatenate([p[0] for p in parts], axis=0)
+    sq_sums = np.concatenate([p[1] for p in parts], axis=0)
+    return sums, sq_sums
+
+
+def moments_to_columns(sums, sq_sums, count, cell_w, cell_h, origin=(0, 0)):
+    """
+    Converts per-cell moments to columnar results in row-major order.
+    count: number of pixels in one cell.
+    """
+    rows, cols = sums.shape[:2]
+    mean = sums / count
+    var = np.maximum(sq_sums / count - mean * mean, 0)
+    std = np.sqrt(var)
+
+    ys, xs = np.meshgrid(np.arange(rows) * cell_h + origin[1],
+                         np.arange(cols) * cell_w + origin[0], indexing='ij')
+
+    return {
+        'x': xs.ravel(), 'y': ys.ravel(),
+        'w': np.full(rows * cols, cell_w), 'h': np.full(rows * cols, cell_h),
+        'avg_r': mean[:, :, 0].ravel(), 'avg_g': mean[:, :, 1].ravel(), 'avg_b': mean[:, :, 2].ravel(),
+        'std_r': std[:, :, 0].ravel(), 'std_g': std[:, :, 1].ravel(), 'std_b': std[:, :, 2].ravel(),
+    }
+
+
+def moments_to_metric(sums, sq_sums, count, metric):
+    """
+    2D (rows, cols) map of one per-cell metric:
+    'mean' / 'std' are averaged over R, G, B; 'norm_r' / 'norm_b' are R/G and B/G.
+    """
+    mean = sums / count
+    if metric == 'mean':
+        return mean.mean(axis=2)
+    if metric == 'std':
+        std = np.sqrt(np.maximum(sq_sums / count - mean * mean, 0))
+        return std.mean(axis=2)
+
+    g = mean[:, :, 1]
+    channel = 0 if metric == 'norm_r' else 2
+    if metric not in ('norm_r', 'norm_b'):
+        raise ValueError(f"Unknown grid metric: {metric}")
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(g != 0, mean[:, :, channel] / g, 0.0)
+
+
+def calculate_grid_columns(img_arr, cell_size, workers=None):
+    """
+    Grid statistics as a dict of 1D arrays (one entry per full cell).
+    Partial cells at the right and bottom edges are skipped.
+    """
+    sums, sq_sums = grid_moments(img_arr, cell_size, workers)
+    return moments_to_columns(sums, sq_sums, cell_size * cell_size, cell_size, cell_size)
+
+
+def columns_to_rows(columns):
+    """ Columnar grid results -> list of dicts used by the exporters """
+    keys = [k for k in GRID_COLUMNS if k in columns] + [k for k in columns if k not in GRID_COLUMNS]
+    lists = [columns[k].tolist() for k in keys]
+    return [dict(zip(keys, values)) for values in zip(*lists)]
+
+
+def pyramid_groups(cell_sizes, min_base=MIN_PYRAMID_BASE):
+    """
+    [(base, sizes)] covering cell_sizes with as few pyramids as possible:
+    every size joins the first group whose common divisor with it stays at
+    least min_base, otherwise it starts a group of its own.
+    """
+    groups = []
+    for size in sorted(set(cell_sizes)):
+        for group in groups:
+            common = gcd(group[0], size)
+            if common >= min_base:
+                group[0] = common
+                group[1].append(size)
+                break
+        else:
+            groups.append([size, [size]])
+    return [(base, sizes) for base, sizes in groups]
+
+
+class GridPyramid:
+    """
+    Moment sums of the grid at a base cell size.
+    Results for any multiple of the base size are aggregated from these sums,
+    so sweeping the cell size never touches the pixels again.
+    """
+
+    def __init__(self, img_arr, base_size, workers=None):
+        self.base_size = base_size
+        self.image_size = img_arr.shape[:2]
+        self.sums, self.sq_sums = grid_moments(img_arr, base_size, workers)
+
+    def supports(self, cell_size):
+        return cell_size > 0 and cell_size % self.base_size == 0
+
+    def moments(self, cell_size):
+        """ Sums and sums of squares of the full cells of the given size """
+        if not self.supports(cell_size):
+            raise ValueError(f"Cell size {cell_size} is not a multiple of {self.base_size}")
+
+        k = cell_size // self.base_size
+        if k == 1:
+            return self.sums, self.sq_sums
+
+        # floor(H / (k * base)) == floor(floor(H / base) / k), so the same
+        # cells are kept as with a direct computation
+        rows = self.sums.shape[0] // k
+        cols = self.sums.shape[1] // k
+        if rows == 0 or cols == 0:
+            empty = np.zeros((rows, cols, 3), dtype=np.float64)
+            return empty, empty.copy()
+
+        sums = block_sum(self.sums[:rows * k, :cols * k], k, k, np.float64)
+        sq_sums = block_sum(self.sq_sums[:rows * k, :cols * k], k, k, np.float64)
+        return sums, sq_sums
+
+    def columns(self, cell_size):
+        sums, sq_sums = self.moments(cell_size)
+        return moments_to_columns(sums, sq_sums, cell_size * cell_size, cell_size, cell_size)
+
+    def metric_map(self, cell_size, metric):
+        """ (rows, cols) map of a metric from GRID_METRICS """
+        sums, sq_sums = self.moments(cell_size)
+        return moments_to_metric(sums, sq_sums, cell_size * cell_size, metric)
+
+    def rows(self, cell_size):
+        return columns_to_rows(self.columns(cell_size))
+
+
+def window_starts(length, cell, stride, partial=False):
+    """
+    Offsets of the windows along one axis of a region of the given length.
+    Without partial only windows that fit are kept; with partial the windows
+    continue until the region is covered and the last ones are clipped.
+    """
+    if length <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if not partial:
+        if length < cell:
+            return np.zeros(0, dtype=np.int64)
+        return np.arange(0, length - cell + 1, stride, dtype=np.int64)
+    count = -(-max(length - cell, 0) // stride) + 1
+    starts = np.arange(count, dtype=np.int64) * stride
+    return starts[starts < length]
+
+
+def window_sums(block_sums, starts, cell, block, axis):
+    """
+    Sums of windows of cell pixels starting at starts along an axis of
+    per-block sums (blocks of block pixels; the last block may be shorter).
+    Uses the prefix sum over the blocks, so every window costs two lookups
+    whatever its size and overlap.
+    """
+    n = block_sums.shape[axis]
+    shape = list(block_sums.shape)
+    shape[axis] = 1
+    prefix = np.concatenate([np.zeros(shape, dtype=block_sums.dtype),
+                             np.cumsum(block_sums, axis=axis, dtype=block_sums.dtype)], axis=axis)
+    first = starts // block
+    last = np.minimum((starts + cell) // block, n)
+    return np.take(prefix, last, axis=axis) - np.take(prefix, first, axis=axis)
+
+
+def grid_geometry(image_shape, cell_w, cell_h=None, stride_x=None, stride_y=None, region=None, partial=False):
+    """
+    Placement of the windows of a grid (see WindowGrid): cell size, strides,
+    the region clipped to the image and per axis the window offsets inside
+    the region ('starts_x', 'starts_y') and sizes ('widths', 'heights').
+    """
+    cell_w = int(cell_w)
+    cell_h = int(cell_h or cell_w)
+    stride_x = int(stride_x or cell_w)
+    stride_y = int(stride_y or cell_h)
+    if min(cell_w, cell_h, stride_x, stride_y) <= 0:
+        raise ValueError("Cell size and stride must be positive")
+
+    img_h, img_w = image_shape[:2]
+    rx, ry, rw, rh = region if region is not None else (0, 0, img_w, img_h)
+    x1, y1 = max(0, int(rx)), max(0, int(ry))
+    x2, y2 = min(img_w, int(rx + rw)), min(img_h, int(ry + rh))
+    rw, rh = max(0, x2 - x1), max(0, y2 - y1)
+
+    starts_x = window_starts(rw, cell_w, stride_x, partial)
+    starts_y = window_starts(rh, cell_h, stride_y, partial)
+    return {
+        'cell_w': cell_w, 'cell_h': cell_h, 'stride_x': stride_x, 'stride_y': stride_y,
+        'region': (x1, y1, rw, rh), 'partial': partial,
+        'starts_x': starts_x, 'starts_y': starts_y,
+        'widths': np.minimum(cell_w, rw - starts_x), 'heights': np.minimum(cell_h, rh - starts_y),
+    }
+
+
+class WindowGrid:
+    """
+    Moment sums of a grid of rectangular windows: cell_w x cell_h pixels,
+    placed every stride_x / stride_y pixels over region (x, y, w, h, default
+    the whole image). A stride below the cell size gives overlapping windows,
+    above it gaps between them. partial keeps the clipped windows at the
+    right and bottom edges of the region.
+
+    The pixels are reduced once into blocks of gcd(cell, stride) per axis
+    (on a thread pool, in bands of block rows), and every window is read
+    from prefix sums over the blocks, so overlapping windows cost about the
+    same as the plain grid.
+    """
+
+    def __init__(self, img_arr, cell_w, cell_h=None, stride_x=None, stride_y=None, region=None,
+                 partial=False, workers=None):
+        self.__dict__.update(grid_geometry(img_arr.shape, cell_w, cell_h, stride_x, stride_y, region, partial))
+
+        rows, cols = self.shape
+        if rows == 0 or cols == 0:
+            self.sums = np.zeros((rows, cols, 3), dtype=np.float64)
+            self.sq_sums = self.sums.copy()
+        else:
+            x1, y1, rw, rh = self.region
+            self.sums, self.sq_sums = self.window_moments(img_arr[y1:y1 + rh, x1:x1 + rw], workers)
+        self.counts = (self.heights[:, None] * self.widths[None, :]).astype(np.float64)
+
+    def window_moments(self, region_arr, workers):
+        bw = gcd(self.cell_w, self.stride_x)
+        bh = gcd(self.cell_h, self.stride_y)
+        h, w = region_arr.shape[:2]
+        block_rows = -(-h // bh)
+
+        # Integer data stays exact: the prefix sums are kept in uint64
+        acc_dtype = np.uint64 if np.issubdtype(region_arr.dtype, np.integer) else np.float64
+        sq_dtype = square_dtype(region_arr.dtype)
+
+        def blocks(arr, dtype):
+            # reduceat over 1-pixel blocks would only copy the data, slowly
+            if bw == 1 and bh == 1:
+                return arr.astype(dtype)
+            return block_sum(arr, bh, bw, dtype)
+
+        def band(rows):
+            # Window sums along x of the block rows [r0, r1)
+            r0, r1 = rows
+            pixels = region_arr[r0 * bh:r1 * bh]
+            sums = blocks(pixels, acc_dtype)
+            sq_sums = blocks(np.square(pixels, dtype=sq_dtype), acc_dtype)
+            return (window_sums(sums, self.starts_x, self.cell_w, bw, axis=1),
+                    window_sums(sq_sums, self.starts_x, self.cell_w, bw, axis=1))
+
+        row_bytes = bh * w * 3 * region_arr.itemsize
+        rows_per_band = max(1, BAND_TARGET_BYTES // max(1, row_bytes))
+        bands = [(r, min(r + rows_per_band, block_rows)) for r in range(0, block_rows, rows_per_band)]
+
+        workers = workers or default_workers()
+        if workers == 1 or len(bands) == 1:
+            parts = [band(b) for b in bands]
+        else:
+            with ThreadPoolExecutor(max_workers=min(workers, len(bands))) as pool:
+                parts = list(pool.map(band, bands))
+
+        sums = np.concatenate([p[0] for p in parts], axis=0)
+        sq_sums = np.concatenate([p[1] for p in parts], axis=0)
+        sums = window_sums(sums, self.starts_y, self.cell_h, bh, axis=0)
+        sq_sums = window_sums(sq_sums, self.starts_y, self.cell_h, bh, axis=0)
+        return sums.astype(np.float64), sq_sums.astype(np.float64)
+
+    @property
+    def shape(self):
+        return len(self.starts_y), len(self.starts_x)
+
+    def columns(self):
+        rows, cols = self.shape
+        count = self.counts[:, :, None]
+        mean = self.sums / count
+        std = np.sqrt(np.maximum(self.sq_sums / count - mean * mean, 0))
+
+        ys, xs = np.meshgrid(self.starts_y + self.region[1], self.starts_x + self.region[0], indexing='ij')
+        hs, ws = np.meshgrid(self.heights, self.widths, indexing='ij')
+
+        return {
+            'x': xs.ravel(), 'y': ys.ravel(), 'w': ws.ravel(), 'h': hs.ravel(),
+            'avg_r': mean[:, :, 0].ravel(), 'avg_g': mean[:, :, 1].ravel(), 'avg_b': mean[:, :, 2].ravel(),
+            'std_r': std[:, :, 0].ravel(), 'std_g': std[:, :, 1].ravel(), 'std_b': std[:, :, 2].ravel(),
+        }
+
+    def metric_map(self, metric):
+        """ (rows, cols) map of a metric from GRID_METRICS """
+        return moments_to_metric(self.sums, self.sq_sums, self.counts[:, :, None], metric)
+
+    def rows(self):
+        return columns_to_rows(self.columns())
@@ -0,0 +1,202 @@
+from concurrent.futures import ThreadPoolExecutor
+from math import gcd
+import numpy as np
+import cv2
+
+from app.core.image_store import dtype_max
+from app.core.colorimetry import rgb_to_lab
+from app.core.grid_engine import grid_geometry, window_sums, default_workers
+
+# Channels of the colour spaces; HSV uses the 8-bit convention (H 0..180,
+# S/V 0..255) and LAB is float CIELAB (L 0..100) for every bit depth
+SPACE_CHANNELS = {
+    'rgb': ('r', 'g', 'b'),
+    'hsv': ('h', 's', 'v'),
+    'lab': ('lab_l', 'lab_a', 'lab_b'),
+}
+
+# Mean and std of RGB are already in the moment columns of the grid
+MOMENT_SPACES = ('hsv', 'lab')
+
+
+def percentile_key(p):
+    """ Column prefix of a percentile: 'median' for 50, 'p5', 'p99.5', ... """
+    return 'median' if p == 50 else f"p{p:g}"
+
+
+def quantile_columns(percentiles, spaces):
+    """ Names of the columns added by window_quantiles, in their order """
+    keys = []
+    for space in spaces:
+        for channel in SPACE_CHANNELS[space]:
+            if space in MOMENT_SPACES:
+                keys += [f'avg_{channel}', f'std_{channel}']
+            keys += [f'{percentile_key(p)}_{channel}' for p in percentiles]
+    return keys
+
+
+def space_values(strip, space, max_value):
+    """ (H, W, 3) values of a strip of RGB pixels in a colour space; 8-bit results stay uint8 """
+    if space == 'rgb':
+        return strip
+    if space == 'hsv':
+        strip = np.ascontiguousarray(strip)
+        if strip.dtype == np.uint8:
+            return cv2.cvtColor(strip, cv2.COLOR_RGB2HSV)
+        unit = strip.astype(np.float32) * np.float32(1.0 / max_value)
+        hsv = cv2.cvtColor(unit, cv2.COLOR_RGB2HSV)
+        hsv *= np.array([0.5, 255.0, 255.0], dtype=np.float32)
+        return hsv
+    return rgb_to_lab(strip, max_value)
+
+
+def rank_positions(counts, percentiles):
+    """
+    Lower / upper ranks and interpolation weight of every percentile for
+    cells of counts values (linear interpolation, as np.percentile).
+    """
+    pos = np.asarray(percentiles, dtype=np.float64)[None, :] / 100.0 * (counts[:, None] - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    return lo, hi, pos - lo
+
+
+def hist_quantiles(hists, percentiles, moments):
+    """
+    Percentiles (and optionally mean / std) of the cells from (cells, 256)
+    histograms of 8-bit values. Returns {'p': (cells, len(percentiles)), ...}.
+    """
+    cum = np.cumsum(hists, axis=1)
+    counts = cum[:, -1]
+    result = {}
+    if len(percentiles):
+        lo, hi, frac = rank_positions(counts, percentiles)
+        # Value of rank k: number of bins whose cumulative count is <= k
+        v_lo = (cum[:, None, :] <= lo[:, :, None]).sum(axis=2)
+        v_hi = (cum[:, None, :] <= hi[:, :, None]).sum(axis=2)
+        result['p'] = v_lo + (v_hi - v_lo) * frac
+    if moments:
+        values = np.arange(hists.shape[1], dtype=np.float64)
+        mean = hists @ values / counts
+        result['avg'] = mean
+        result['std'] = np.sqrt(np.maximum(hists @ (values * values) / counts - mean * mean, 0))
+    return result
+
+
+def sorted_quantiles(cells, percentiles, moments):
+    """
+    Percentiles (and optionally mean / std) of the rows of a (cells, n)
+    array. np.partition only orders the values around the needed ranks.
+    """
+    counts = np.full(len(cells), cells.shape[1])
+    result = {}
+    if len(percentiles):
+        lo, hi, frac = rank_positions(counts, percentiles)
+        kth = np.unique(np.concatenate([lo[0], hi[0]]))
+        part = np.partition(cells, kth, axis=1)
+        v_lo = part[:, lo[0]].astype(np.float64)
+        v_hi = part[:, hi[0]].astype(np.float64)
+        result['p'] = v_lo + (v_hi - v_lo) * frac
+    if moments:
+        result['avg'] = cells.mean(axis=1, dtype=np.float64)
+        result['std'] = cells.std(axis=1, dtype=np.float64)
+    return result
+
+
+def strip_hist_quantiles(values, geometry, block_w, percentiles, moments):
+    """
+    One window row of uint8 values (H, W): the pixels are counted per block
+    column with a single offset-encoded bincount (block * 256 + value), and
+    the histograms of the (possibly overlapping) windows are read from
+    prefix sums over the block columns.
+    """
+    h, w = values.shape
+    blocks = -(-w // block_w)
+    offsets = (np.arange(w, dtype=np.int32) // block_w) * 256
+    keys = values + offsets[None, :]
+    hists = np.bincount(keys.ravel(), minlength=blocks * 256).reshape(blocks, 256)
+    hists = window_sums(hists, geometry['starts_x'], geometry['cell_w'], block_w, axis=0)
+    return hist_quantiles(hists, percentiles, moments)
+
+
+def strip_sorted_quantiles(values, geometry, percentiles, moments):
+    """
+    One window row of values (H, W) of any type: windows of the same width
+    are gathered from a strided view into one (cells, n) array and reduced
+    together; the clipped windows at the right edge one by one.
+    """
+    starts, widths = geometry['starts_x'], geometry['widths']
+    cell_w = geometry['cell_w']
+    full = widths == cell_w
+
+    result = {}
+
+    def put(index, part):
+        for key, value in part.items():
+            if key not in result:
+                result[key] = np.zeros((len(starts),) + value.shape[1:])
+            result[key][index] = value
+
+    if full.any():
+        view = np.lib.stride_tricks.sliding_window_view(values, cell_w, axis=1)[:, starts[full]]
+        put(full, sorted_quantiles(view.transpose(1, 0, 2).reshape(int(full.sum()), -1), percentiles, moments))
+    for i in np.flatnonzero(~full):
+        put([i], sorted_quantiles(values[:, starts[i]:starts[i] + widths[i]].reshape(1, -1), percentiles, moments))
+    return result
+
+
+def window_quantiles(img_arr, cell_w, cell_h=None, stride_x=None, stride_y=None, region=None, partial=False,
+                     percentiles=(50,), spaces=('rgb',), workers=None):
+    """
+    Per-cell percentiles (50 = median) of the grid laid out as in WindowGrid,
+    for the channels of the given colour spaces ('rgb', 'hsv', 'lab'); HSV
+    and LAB also get the per-cell mean and std.
+    Returns a dict of 1D arrays named by quantile_columns, one entry per cell
+    in the row-major order of the grid columns.
+
+    The grid is processed one window row at a time (rows on a thread pool).
+    8-bit channels go through per-cell histograms, so a cell costs about as
+    much as its mean; other data (16-bit, float HSV, LAB) through a
+    partitioned sort of the cells gathered from a strided view.
+    """
+    geometry = grid_geometry(img_arr.shape, cell_w, cell_h, stride_x, stride_y, region, partial)
+    percentiles = [float(p) for p in percentiles]
+    keys = quantile_columns(percentiles, spaces)
+    rows, cols = len(geometry['starts_y']), len(geometry['starts_x'])
+    if rows == 0 or cols == 0:
+        return {key: np.zeros(0) for key in keys}
+
+    x1, y1, rw, rh = geometry['region']
+    max_value = dtype_max(img_arr.dtype)
+    block_w = gcd(geometry['cell_w'], geometry['stride_x'])
+
+    def window_row(j):
+        top = y1 + geometry['starts_y'][j]
+        strip = img_arr[top:top + geometry['heights'][j], x1:x1 + rw]
+        values = {}
+        for space in spaces:
+            moments = space in MOMENT_SPACES
+            if not moments and not percentiles:
+                continue
+            converted = space_values(strip, space, max_value)
+            for i, channel in enumerate(SPACE_CHANNELS[space]):
+                channel_values = converted[:, :, i]
+                if channel_values.dtype == np.uint8:
+                    result = strip_hist_quantiles(channel_values, geometry, block_w, percentiles, moments)
+                else:
+                    result = strip_sorted_quantiles(channel_values, geometry, percentiles, moments)
+                if moments:
+                    values[f'avg_{channel}'] = result['avg']
+                    values[f'std_{channel}'] = result['std']
+                for k, p in enumerate(percentiles):
+                    values[f'{percentile_key(p)}_{channel}'] = result['p'][:, k]
+        return values
+
+    workers = workers or default_workers()
+    if workers == 1 or rows == 1:
+        parts = [window_row(j) for j in range(rows)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, rows)) as pool:
+            parts = list(pool.map(window_row, range(rows)))
+
+    return {key: np.concatenate([part[key] for part in parts]) for key in keys}
@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+from app.core.image_store import load_image_array, dtype_max, display_max
+from app.core.colorimetry import rgb_to_lab
+from app.core.grid_engine import default_workers
+from app.core.processor import hist_bins, channel_hist, hist_moments, display_hists, DISPLAY_BINS
+
+# Pixels handled per band of the streaming pass
+BAND_PIXELS = 2 * 1024 * 1024
+
+# Histogram ranges of the float channels (HSV in the 8-bit convention, CIELAB)
+HSV_RANGES = ((0.0, 180.0), (0.0, 256.0), (0.0, 256.0))
+LAB_RANGES = ((0.0, 100.0), (-128.0, 128.0), (-128.0, 128.0))
+FLOAT_RGB_BINS = 4096
+
+
+def bin_centers(low, high, bins):
+    step = (high - low) / bins
+    return low + (np.arange(bins) + 0.5) * step
+
+
+def float_hist(values, low, high, bins):
+    """ Histogram with out-of-range values counted in the first / last bin """
+    idx = ((values - low) * (bins / (high - low))).astype(np.int64)
+    return np.bincount(np.clip(idx, 0, bins - 1), minlength=bins)
+
+
+def channel_sums(values):
+    """ Per-channel sums and sums of squares (float64) of an (H, W, 3) array """
+    values = np.ascontiguousarray(values, dtype=np.float32)
+    sums = np.array(cv2.sumElems(values)[:3])
+    sq_sums = np.array(cv2.sumElems(cv2.multiply(values, values))[:3])
+    return sums, sq_sums
+
+
+def band_profile(band, max_value, seen, rgb_range=None):
+    """
+    Histograms and moment sums of one band of rows.
+    seen: shared bitmap of 8-bit colours (set in place), None for other depths.
+    rgb_range: (low, high) of the float RGB histograms.
+    """
+    pixels = band.reshape(-1, 3)
+    bins = hist_bins(band.dtype)
+    part = {}
+
+    # RGB
+    if bins:
+        part['rgb_hists'] = [channel_hist(pixels[:, i], bins) for i in range(3)]
+    else:
+        part['rgb_hists'] = [float_hist(pixels[:, i], *rgb_range, FLOAT_RGB_BINS) for i in range(3)]
+        part['rgb_sums'] = channel_sums(band)
+
+    # HSV in the 8-bit convention (H 0..180, S/V 0..255)
+    if band.dtype == np.uint8:
+        hsv = cv2.cvtColor(band, cv2.COLOR_RGB2HSV).reshape(-1, 3)
+        part['hsv_hists'] = [channel_hist(hsv[:, i], DISPLAY_BINS) for i in range(3)]
+    else:
+        hsv = cv2.cvtColor(band.astype(np.float32) * np.float32(1.0 / max_value), cv2.COLOR_RGB2HSV)
+        hsv *= np.array([0.5, 255.0, 255.0], dtype=np.float32)
+        part['hsv_sums'] = channel_sums(hsv)
+        hsv = hsv.reshape(-1, 3)
+        part['hsv_hists'] = [float_hist(hsv[:, i], low, high, DISPLAY_BINS) for i, (low, high) in enumerate(HSV_RANGES)]
+
+    # CIELAB
+    lab = rgb_to_lab(band, max_value)
+    part['lab_sums'] = channel_sums(lab)
+    lab = lab.reshape(-1, 3)
+    part['lab_hists'] = [float_hist(lab[:, i], low, high, DISPLAY_BINS) for i, (low, high) in enumerate(LAB_RANGES)]
+
+    # Unique colours
+    if seen is not None:
+        packed = (pixels[:, 0].astype(np.uint32) << 16) | (pixels[:, 1].astype(np.uint32) << 8) | pixels[:, 2]
+        seen[packed] = True
+    elif band.dtype == np.uint16:
+        packed = (pixels[:, 0].astype(np.uint64) << 32) | (pixels[:, 1].astype(np.uint64) << 16) | pixels[:, 2]
+        part['unique'] = np.unique(packed)
+    else:
+        # Float colours: compare the raw bytes of every pixel
+        part['unique'] = np.unique(np.ascontiguousarray(pixels).view(np.dtype((np.void, pixels.itemsize * 3))).ravel())
+
+    return part
+
+
+def merge_sums(parts, key):
+    sums = sum(p[key][0] for p in parts)
+    sq_sums = sum(p[key][1] for p in parts)
+    return sums, sq_sums
+
+
+def sums_to_mean_std(sums, sq_sums, count):
+    mean = sums / count
+    return mean, np.sqrt(np.maximum(sq_sums / count - mean * mean, 0))
+
+
+def moments_block(keys, means, stds, medians):
+    block = {}
+    for i, key in enumerate(keys):
+        block[f'avg_{key}'] = float(means[i])
+        block[f'median_{key}'] = float(medians[i])
+        block[f'std_{key}'] = float(stds[i])
+    return block
+
+
+def compute_image_profile(img_arr, workers=None):
+    """
+    Whole-image statistics in one streaming pass over horizontal bands:
+    RGB / HSV / LAB histograms and moments and the number of unique colours.
+    Bands are reduced on a thread pool and merged. RGB moments and medians of
+    integer images are exact (full bincount histograms); HSV and LAB medians
+    are read from 256-bin histograms.
+    Returns a dict with the same RGB keys as region_stats plus 'hsv', 'lab',
+    'unique_count', 'hist' (display RGB histograms), 'hist_range',
+    'hsv_hist', 'lab_hist' and 'lab_ranges'.
+    """
+    h, w = img_arr.shape[:2]
+    count = h * w
+    if count == 0:
+        return None
+
+    max_value = dtype_max(img_arr.dtype)
+    bins = hist_bins(img_arr.dtype)
+    is_uint8 = img_arr.dtype == np.uint8
+
+    # 8-bit unique colours: a bitmap of all 2^24 colours shared by the bands
+    seen = np.zeros(1 << 24, dtype=bool) if is_uint8 else None
+
+    # Float (HDR) data may exceed 1.0 or go below 0: the RGB histograms span
+    # the observed range, like the selection histograms
+    rgb_range = None
+    if not bins:
+        low = float(np.nanmin(img_arr))
+        rgb_range = (min(0.0, low) if np.isfinite(low) else 0.0, display_max(img_arr))
+
+    band_rows = max(1, BAND_PIXELS // max(1, w))
+    starts = range(0, h, band_rows)
+
+    def run(y):
+        return band_profile(np.ascontiguousarray(img_arr[y:y + band_rows]), max_value, seen, rgb_range)
+
+    workers = workers or default_workers()
+    if workers == 1 or len(starts) == 1:
+        parts = [run(y) for y in starts]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(starts))) as pool:
+            parts = list(pool.map(run, starts))
+
+    rgb_hists = [sum(p['rgb_hists'][i] for p in parts) for i in range(3)]
+    hsv_hists = [sum(p['hsv_hists'][i] for p in parts) for i in range(3)]
+    lab_hists = [sum(p['lab_hists'][i] for p in parts) for i in range(3)]
+
+    if is_uint8:
+        unique_count = int(np.count_nonzero(seen))
+    else:
+        unique_count = len(np.unique(np.concatenate([p['unique'] for p in parts])))
+
+    # RGB moments: exact from the full histograms for integer data
+    if bins:
+        means, stds, medians = zip(*[hist_moments(hist) for hist in rgb_hists])
+        hists, hist_range = display_hists(None, rgb_hists)
+    else:
+        means, stds = sums_to_mean_std(*merge_sums(parts, 'rgb_sums'), count)
+        centers = bin_centers(*rgb_range, FLOAT_RGB_BINS)
+        medians = [hist_moments(hist, centers)[2] for hist in rgb_hists]
+        factor = FLOAT_RGB_BINS // DISPLAY_BINS
+        hists = tuple(hist.reshape(DISPLAY_BINS, factor).sum(axis=1) for hist in rgb_hists)
+        hist_range = rgb_range
+
+    if is_uint8:
+        # Integer HSV values: the histograms give exact moments and medians
+        hsv_means, hsv_stds, hsv_medians = zip(*[hist_moments(hist) for hist in hsv_hists])
+    else:
+        hsv_means, hsv_stds = sums_to_mean_std(*merge_sums(parts, 'hsv_sums'), count)
+        hsv_medians = [hist_moments(hist, bin_centers(low, high, DISPLAY_BINS))[2]
+                       for hist, (low, high) in zip(hsv_hists, HSV_RANGES)]
+
+    lab_means, lab_stds = sums_to_mean_std(*merge_sums(parts, 'lab_sums'), count)
+    lab_medians = [hist_moments(hist, bin_centers(low, high, DISPLAY_BINS))[2]
+                   for hist, (low, high) in zip(lab_hists, LAB_RANGES)]
+
+    return {
+        'width': w, 'height': h,
+        'r': float(means[0]), 'g': float(means[1]), 'b': float(means[2]),
+        'median_r': float(medians[0]), 'median_g': float(medians[1]), 'median_b': float(medians[2]),
+        'std_r': float(stds[0]), 'std_g': float(stds[1]), 'std_b': float(stds[2]),
+        'hsv': moments_block(('h', 's', 'v'), hsv_means, hsv_stds, hsv_medians),
+        'lab': moments_block(('l', 'a', 'b'), lab_means, lab_stds, lab_medians),
+        'count': count,
+        'unique_count': unique_count,
+        'hist': hists,
+        'hist_range': hist_range,
+        'hsv_hist': tuple(hsv_hists),
+        'lab_hist': tuple(lab_hists),
+        'lab_ranges': LAB_RANGES,
+        'max_value': max_value,
+    }
+
+
+def calculate_image_profile(image_path, workers=None, img_arr=None):
+    """ compute_image_profile for an image file (img_arr: its decoded pixels if at hand), None on error """
+    if not image_path:
+        return None
+
+    try:
+        if img_arr is None:
+            img_arr = load_image_array(image_path)
+        return compute_image_profile(img_arr, workers)
+    except Exception as e:
+        print(f"Error profiling image: {e}")
+        return None
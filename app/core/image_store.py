@@ -0,0 +1,239 @@
+import hashlib
+import os
+import tempfile
+import time
+import numpy as np
+import cv2
+from PIL import Image
+
+# Store switches live in a light module, so the UI can set them without numpy / OpenCV
+from app.core.store_config import is_store_enabled, get_cache_dir, get_store_budget
+
+# Lossless formats that may carry more than 8 bits per channel. They are
+# decoded with OpenCV, which keeps uint16 / float32 samples instead of
+# squashing them to 8 bits like PIL's convert('RGB').
+HIGH_DEPTH_EXTENSIONS = ('.png', '.tif', '.tiff', '.pgm', '.ppm', '.pnm', '.pfm', '.exr', '.hdr')
+
+# Sample types kept as they are, anything else is converted to float32
+NATIVE_DTYPES = (np.uint8, np.uint16, np.float32)
+
+# Temp files older than this are left over from crashed writers
+STALE_TMP_SECONDS = 3600
+
+
+def get_store_path(image_path):
+    """
+    Path of the .npy file for the image.
+    The key includes size and mtime, so an edited source file gets a new entry.
+    """
+    st = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}|{st.st_size}|{st.st_mtime_ns}"
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(get_cache_dir(), digest + '.npy')
+
+
+def dtype_max(dtype):
+    """ Nominal full-scale value of a sample type (float data is 0..1) """
+    dtype = np.dtype(dtype)
+    if dtype == np.uint8:
+        return 255
+    if dtype == np.uint16:
+        return 65535
+    return 1.0
+
+
+def to_rgb(img_arr, bgr=False):
+    """
+    Normalises a decoded array to (H, W, 3) RGB with a native sample type.
+    Gray is repeated over the channels, alpha is dropped.
+    """
+    if img_arr.dtype not in NATIVE_DTYPES:
+        img_arr = img_arr.astype(np.float32)
+
+    if img_arr.ndim == 2:
+        return np.repeat(img_arr[:, :, None], 3, axis=2)
+
+    channels = img_arr.shape[2]
+    if channels in (1, 2):
+        return np.repeat(img_arr[:, :, :1], 3, axis=2)
+
+    rgb = img_arr[:, :, 2::-1] if bgr else img_arr[:, :, :3]
+    return np.ascontiguousarray(rgb)
+
+
+def decode_high_depth(image_path):
+    """ OpenCV decode keeping the bit depth, None if OpenCV can't read the file """
+    # imdecode instead of imread: imread can't open non-ASCII paths on Windows
+    data = np.fromfile(image_path, dtype=np.uint8)
+    img = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return None
+    return to_rgb(img, bgr=img.ndim == 3 and img.shape[2] >= 3)
+
+
+def decode_image(image_path):
+    """
+    Full decode of the source file to an (H, W, 3) RGB array.
+    8-bit images give uint8, 16-bit images uint16 and float images float32.
+    """
+    if os.path.splitext(image_path)[1].lower() in HIGH_DEPTH_EXTENSIONS:
+        img_arr = decode_high_depth(image_path)
+        if img_arr is not None:
+            return img_arr
+
+    with Image.open(image_path) as img:
+        # Single-channel 16-bit / 32-bit modes would be clipped by convert('RGB')
+        if img.mode.startswith('I;16'):
+            return to_rgb(np.array(img).astype(np.uint16))
+        if img.mode in ('I', 'F'):
+            return to_rgb(np.array(img).astype(np.float32))
+
+        img = img.convert('RGB')
+        return np.array(img)
+
+
+def display_max(img_arr):
+    """
+    Full scale an image is shown with, adapted to the data like the
+    histograms: 16-bit data uses the smallest 2^k - 1 covering its largest
+    value (a 12-bit camera in a 16-bit file shows 0..4095), float data
+    0..max(1, max). 8-bit data is always 0..255.
+    """
+    if img_arr.dtype == np.uint8 or img_arr.size == 0:
+        return dtype_max(img_arr.dtype)
+    if np.issubdtype(img_arr.dtype, np.integer):
+        return max(255, (1 << int(img_arr.max()).bit_length()) - 1)
+    peak = float(np.nanmax(img_arr))
+    if not np.isfinite(peak):
+        # Infinite samples (EXR / PFM) don't stretch the scale
+        peak = float(img_arr[np.isfinite(img_arr)].max(initial=1.0))
+    return max(1.0, peak)
+
+
+def to_display_uint8(img_arr, max_value=None):
+    """
+    8-bit copy of an image array for display.
+    max_value: full scale mapped to 255 (default: display_max of the array);
+    pass the value of the whole image when converting it in tiles.
+    """
+    if img_arr.dtype == np.uint8:
+        return img_arr
+    if max_value is None:
+        max_value = display_max(img_arr)
+    if img_arr.dtype == np.uint16:
+        shift = max(0, int(max_value).bit_length() - 8)
+        return (img_arr >> shift).astype(np.uint8)
+    scaled = np.clip(img_arr * np.float32(255.0 / max_value), 0, 255)
+    return scaled.astype(np.uint8)
+
+
+def load_image_array(image_path):
+    """
+    Returns the RGB array of the image.
+    With the store enabled the result is a read-only memory map, so slicing a
+    crop only pages in the rows it touches.
+    """
+    if not is_store_enabled():
+        return decode_image(image_path)
+
+    try:
+        store_path = get_store_path(image_path)
+        if os.path.exists(store_path):
+            touch(store_path)
+            return np.load(store_path, mmap_mode='r')
+
+        img_arr = decode_image(image_path)
+
+        # Write to a unique temp file first, so other threads and processes
+        # never see (or publish) a partial array
+        cache_dir = os.path.dirname(store_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, img_arr)
+            os.replace(tmp_path, store_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        prune_store(get_store_budget(), keep=store_path)
+        return np.load(store_path, mmap_mode='r')
+    except OSError as e:
+        print(f"Decoded store unavailable: {e}")
+        return decode_image(image_path)
+
+
+def touch(store_path):
+    """ Marks a stored array as used (its mtime orders the pruning) """
+    try:
+        os.utime(store_path)
+    except OSError:
+        pass
+
+
+def prune_store(budget_bytes, keep=None):
+    """
+    Removes the least recently used arrays until the store fits in
+    budget_bytes, and temp files left by crashed writers.
+    keep: array that is never removed (the one just written).
+    Returns the number of files removed.
+    """
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    now = time.time()
+    entries = []
+    removed = 0
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if entry.name.endswith('.tmp'):
+                if now - st.st_mtime > STALE_TMP_SECONDS:
+                    removed += remove_file(entry.path)
+            elif entry.name.endswith('.npy'):
+                entries.append((st.st_mtime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= budget_bytes:
+            break
+        if keep and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        # Arrays still memory-mapped on Windows can't be removed, they stay
+        if remove_file(path):
+            total -= size
+            removed += 1
+    return removed
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+        return 1
+    except OSError:
+        return 0
+
+
+def clear_store():
+    """ Removes all decoded arrays from the cache directory """
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npy') or name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
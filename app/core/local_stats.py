@@ -0,0 +1,138 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+from app.core.image_store import load_image_array
+from app.core.grid_engine import GRID_METRICS, block_sum, default_workers
+from app.core.masks import rasterize_shape
+
+# Same metrics as the grid heatmaps, but per pixel over a sliding window
+LOCAL_METRICS = GRID_METRICS
+
+# Pixels handled per band (without the halo rows)
+BAND_PIXELS = 1024 * 1024
+
+# Longer side of the map shown in the viewer
+DISPLAY_SIDE = 2048
+
+
+def window_moments(band, window):
+    """
+    Sliding-window mean and mean of squares per channel (float64, same shape as band).
+    Box filters keep the cost per pixel independent of the window size.
+    """
+    ksize = (window, window)
+    mean = cv2.boxFilter(band, cv2.CV_64F, ksize)
+
+    if band.dtype == np.uint8:
+        # Exact uint16 squares, cv2 has no 32-bit unsigned type for the uint16 case
+        squares = np.square(band, dtype=np.uint16)
+    else:
+        squares = np.square(band, dtype=np.float64)
+    sq_mean = cv2.boxFilter(squares, cv2.CV_64F, ksize)
+    return mean, sq_mean
+
+
+def moments_to_local_metric(mean, sq_mean, metric):
+    """ (H, W) float32 map of a metric from LOCAL_METRICS """
+    if metric == 'mean':
+        return mean.mean(axis=2).astype(np.float32)
+    if metric == 'std':
+        std = np.sqrt(np.maximum(sq_mean - mean * mean, 0))
+        return std.mean(axis=2).astype(np.float32)
+    if metric not in ('norm_r', 'norm_b'):
+        raise ValueError(f"Unknown local metric: {metric}")
+
+    g = mean[:, :, 1]
+    channel = 0 if metric == 'norm_r' else 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(g != 0, mean[:, :, channel] / g, 0.0).astype(np.float32)
+
+
+def local_stat_map(img_arr, window, metric='std', workers=None):
+    """
+    Full-resolution map of a sliding-window metric (window x window pixels).
+    The image is processed in horizontal bands with a halo of window/2 rows
+    on a thread pool, so the result is the same as filtering the whole image
+    at once (borders are reflected).
+    """
+    h, w = img_arr.shape[:2]
+    window = max(1, int(window))
+    halo = window // 2 + 1
+    out = np.empty((h, w), dtype=np.float32)
+
+    rows_per_band = max(1, BAND_PIXELS // max(1, w))
+    bands = [(y, min(y + rows_per_band, h)) for y in range(0, h, rows_per_band)]
+
+    def run(band):
+        y0, y1 = band
+        e0, e1 = max(0, y0 - halo), min(h, y1 + halo)
+        mean, sq_mean = window_moments(np.ascontiguousarray(img_arr[e0:e1]), window)
+        values = moments_to_local_metric(mean[y0 - e0:y1 - e0], sq_mean[y0 - e0:y1 - e0], metric)
+        out[y0:y1] = values
+
+    workers = workers or default_workers()
+    if workers == 1 or len(bands) == 1:
+        for band in bands:
+            run(band)
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(bands))) as pool:
+            list(pool.map(run, bands))
+
+    return out
+
+
+def downsample_map(values, max_side=DISPLAY_SIDE):
+    """
+    Reduced copy of a map for display.
+    Returns (small, step): one value of small covers step x step source pixels.
+    """
+    h, w = values.shape[:2]
+    step = max(1, int(np.ceil(max(h, w) / max_side)))
+    if step == 1:
+        return values, 1
+    small = cv2.resize(values, (max(1, w // step), max(1, h // step)), interpolation=cv2.INTER_AREA)
+    return small, step
+
+
+def map_cell_means(values, cell_size):
+    """ Mean of the map in every full grid cell, (rows, cols) float64 """
+    rows, cols = values.shape[0] // cell_size, values.shape[1] // cell_size
+    if rows == 0 or cols == 0:
+        return np.zeros((rows, cols))
+    sums = block_sum(values[:rows * cell_size, :cols * cell_size], cell_size, cell_size, np.float64)
+    return sums / float(cell_size * cell_size)
+
+
+def map_region_stats(values, shape):
+    """
+    Mean, median and std of the map inside a selection shape (see app.core.masks).
+    Returns a dict or None if the shape lies outside the map.
+    """
+    h, w = values.shape[:2]
+    raster = rasterize_shape(shape, w, h)
+    if raster is None:
+        return None
+    x1, y1, mask = raster
+    samples = values[y1:y1 + mask.shape[0], x1:x1 + mask.shape[1]][mask]
+    samples = samples[np.isfinite(samples)]
+    if samples.size == 0:
+        return None
+    return {
+        'mean': float(samples.mean(dtype=np.float64)),
+        'median': float(np.median(samples)),
+        'std': float(samples.std(dtype=np.float64)),
+        'count': int(samples.size),
+    }
+
+
+def calculate_local_map(image_path, window, metric='std', workers=None):
+    """ local_stat_map for an image file, None on error """
+    if not image_path or window <= 0:
+        return None
+
+    try:
+        return local_stat_map(load_image_array(image_path), window, metric, workers)
+    except Exception as e:
+        print(f"Error calculating local statistics: {e}")
+        return None
@@ -0,0 +1,82 @@
+import numpy as np
+import cv2
+
+# Selection shapes are plain dicts in image coordinates:
+#   {'type': 'rect', 'rect': (x, y, w, h)}
+#   {'type': 'ellipse', 'rect': (x, y, w, h)}          bounding box of the ellipse
+#   {'type': 'polygon', 'points': [(x, y), ...]}
+#   {'type': 'brush', 'strokes': [[(x, y), ...], ...], 'radius': r}
+SHAPE_TYPES = ('rect', 'ellipse', 'polygon', 'brush')
+
+
+def shape_bounds(shape):
+    """ Bounding box (x1, y1, x2, y2) of the shape, not clipped """
+    kind = shape['type']
+    if kind in ('rect', 'ellipse'):
+        x, y, w, h = shape['rect']
+        return x, y, x + w, y + h
+
+    if kind == 'polygon':
+        pts = np.asarray(shape['points'], dtype=np.float64)
+        return pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max() + 1, pts[:, 1].max() + 1
+
+    if kind == 'brush':
+        r = shape['radius']
+        pts = np.concatenate([np.asarray(s, dtype=np.float64).reshape(-1, 2) for s in shape['strokes']])
+        return pts[:, 0].min() - r, pts[:, 1].min() - r, pts[:, 0].max() + r + 1, pts[:, 1].max() + r + 1
+
+    raise ValueError(f"Unknown shape type: {kind}")
+
+
+def translate_shape(shape, dx, dy):
+    """ Copy of the shape moved by (dx, dy) """
+    kind = shape['type']
+    if kind in ('rect', 'ellipse'):
+        x, y, w, h = shape['rect']
+        return {'type': kind, 'rect': (x + dx, y + dy, w, h)}
+    if kind == 'polygon':
+        return {'type': kind, 'points': [(x + dx, y + dy) for x, y in shape['points']]}
+    if kind == 'brush':
+        strokes = [[(x + dx, y + dy) for x, y in stroke] for stroke in shape['strokes']]
+        return {'type': kind, 'strokes': strokes, 'radius': shape['radius']}
+    raise ValueError(f"Unknown shape type: {kind}")
+
+
+def rasterize_shape(shape, img_w, img_h):
+    """
+    Rasterises the shape once inside its bounding box clipped to the image.
+    Returns (x1, y1, mask) where mask is a bool array of the clipped box,
+    or None if the shape lies outside the image.
+    """
+    bx1, by1, bx2, by2 = shape_bounds(shape)
+    x1, y1 = max(0, int(np.floor(bx1))), max(0, int(np.floor(by1)))
+    x2, y2 = min(img_w, int(np.ceil(bx2))), min(img_h, int(np.ceil(by2)))
+    if x1 >= x2 or y1 >= y2:
+        return None
+
+    kind = shape['type']
+    if kind == 'rect':
+        return x1, y1, np.ones((y2 - y1, x2 - x1), dtype=bool)
+
+    mask = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+
+    if kind == 'ellipse':
+        x, y, w, h = shape['rect']
+        center = (int(round(x + w / 2 - x1)), int(round(y + h / 2 - y1)))
+        axes = (max(0, int(round(w / 2))), max(0, int(round(h / 2))))
+        cv2.ellipse(mask, center, axes, 0, 0, 360, 1, thickness=-1)
+
+    elif kind == 'polygon':
+        pts = np.round(np.asarray(shape['points'], dtype=np.float64) - (x1, y1)).astype(np.int32)
+        cv2.fillPoly(mask, [pts], 1)
+
+    elif kind == 'brush':
+        thickness = max(1, int(round(2 * shape['radius'])))
+        for stroke in shape['strokes']:
+            pts = np.round(np.asarray(stroke, dtype=np.float64).reshape(-1, 2) - (x1, y1)).astype(np.int32)
+            if len(pts) == 1:
+                cv2.circle(mask, tuple(int(v) for v in pts[0]), thickness // 2, 1, thickness=-1)
+            else:
+                cv2.polylines(mask, [pts], False, 1, thickness=thickness)
+
+    return x1, y1, mask.astype(bool)
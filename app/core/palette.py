@@ -0,0 +1,258 @@
+from math import gcd
+import numpy as np
+import cv2
+
+from app.core.image_store import load_image_array, dtype_max
+from app.core.grid_engine import grid_geometry, window_sums, BAND_TARGET_BYTES
+from app.core.masks import rasterize_shape
+
+PALETTE_METHODS = ('kmeans', 'median_cut')
+DEFAULT_COLORS = 8
+# Pixels used to fit the palette
+SAMPLE_SIZE = 50000
+# Bits per channel of the assignment lookup table (32^3 cells)
+LUT_BITS = 5
+
+
+def sample_pixels(pixels, sample_size=SAMPLE_SIZE, seed=0):
+    """ Random subset of an (N, 3) pixel array (all pixels if N is small) """
+    n = len(pixels)
+    if n <= sample_size:
+        return pixels
+    rng = np.random.default_rng(seed)
+    return pixels[np.sort(rng.choice(n, sample_size, replace=False))]
+
+
+def kmeans_palette(samples, n_colors):
+    """ k-means centres (float32, image units) of the sampled pixels """
+    data = np.ascontiguousarray(samples, dtype=np.float32)
+    k = min(n_colors, len(np.unique(data, axis=0)))
+    if k == 0:
+        return np.zeros((0, 3), dtype=np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.1)
+    cv2.setRNGSeed(0)
+    _, _, centers = cv2.kmeans(data, k, None, criteria, 3, cv2.KMEANS_PP_CENTERS)
+    return centers
+
+
+def median_cut_palette(samples, n_colors):
+    """ Median cut: split the box with the widest channel range at its median """
+    boxes = [np.asarray(samples, dtype=np.float32)]
+    while len(boxes) < n_colors:
+        ranges = [np.ptp(b, axis=0).max() if len(b) > 1 else -1 for b in boxes]
+        i = int(np.argmax(ranges))
+        if ranges[i] <= 0:
+            break
+        box = boxes.pop(i)
+        channel = int(np.argmax(np.ptp(box, axis=0)))
+        order = np.argsort(box[:, channel], kind='stable')
+        half = len(box) // 2
+        boxes += [box[order[:half]], box[order[half:]]]
+    return np.array([b.mean(axis=0) for b in boxes if len(b)], dtype=np.float32).reshape(-1, 3)
+
+
+def build_palette_lut(palette, max_value=255, bits=LUT_BITS):
+    """
+    Nearest palette entry for every cell of a 2^bits per channel RGB grid.
+    Returns a flat uint8 array indexed by (r_q << 2b) | (g_q << b) | b_q.
+    """
+    levels = 1 << bits
+    if isinstance(max_value, (int, np.integer)):
+        # Integer data: a cell holds 2^(depth - bits) consecutive values
+        width = (max_value + 1) / levels
+        centers = (np.arange(levels, dtype=np.float32) + 0.5) * width - 0.5
+    else:
+        centers = (np.arange(levels, dtype=np.float32) + 0.5) * (max_value / levels)
+    grid = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    palette = np.asarray(palette, dtype=np.float32)
+    d = (np.square(grid).sum(axis=1)[:, None] - 2 * grid @ palette.T + np.square(palette).sum(axis=1)[None, :])
+    return np.argmin(d, axis=1).astype(np.uint8)
+
+
+def quantize_indices(pixels, max_value=255, bits=LUT_BITS):
+    """ LUT cell index of every pixel of an (..., 3) array """
+    levels = 1 << bits
+    if pixels.dtype == np.uint8 or pixels.dtype == np.uint16:
+        shift = pixels.dtype.itemsize * 8 - bits
+        q = (pixels >> shift).astype(np.int32)
+    else:
+        q = np.clip((pixels * np.float32(levels / max_value)).astype(np.int32), 0, levels - 1)
+    return (q[..., 0] << (2 * bits)) | (q[..., 1] << bits) | q[..., 2]
+
+
+def assign_palette(pixels, lut, max_value=255, bits=LUT_BITS):
+    """ Palette index of every pixel through the lookup table """
+    return lut[quantize_indices(pixels, max_value, bits)]
+
+
+def palette_counts(pixels, lut, k, max_value=255):
+    """
+    Pixels of every palette entry in an (N, 3) array. The pixels are
+    assigned per band, so the int32 LUT indices never cover the whole image.
+    """
+    counts = np.zeros(k, dtype=np.int64)
+    band = max(1, BAND_TARGET_BYTES // 16)
+    for start in range(0, len(pixels), band):
+        indices = assign_palette(pixels[start:start + band], lut, max_value)
+        counts += np.bincount(indices, minlength=k)[:k]
+    return counts
+
+
+def extract_palette(pixels, n_colors=DEFAULT_COLORS, method='kmeans', sample_size=SAMPLE_SIZE):
+    """
+    Dominant colours of an (N, 3) pixel array.
+    The palette is fitted on a random sample, then every pixel is assigned
+    through a 3D lookup table to count the coverage.
+    Returns {'colors': (k, 3) float32, 'counts': (k,) int64, 'coverage': (k,) fractions,
+    'lut': assignment table, 'max_value': full scale of the image} sorted by coverage.
+    """
+    if len(pixels) == 0:
+        return None
+
+    samples = sample_pixels(pixels, sample_size)
+    if method == 'kmeans':
+        palette = kmeans_palette(samples, n_colors)
+    elif method == 'median_cut':
+        palette = median_cut_palette(samples, n_colors)
+    else:
+        raise ValueError(f"Unknown palette method: {method}")
+
+    max_value = dtype_max(pixels.dtype)
+    if pixels.dtype != np.uint8 and pixels.dtype != np.uint16:
+        max_value = max(float(max_value), float(pixels.max()))
+    return palette_coverage(pixels, palette, max_value)
+
+
+def palette_coverage(pixels, palette, max_value=255):
+    """ Coverage of a given palette over an (N, 3) pixel array, sorted like extract_palette """
+    lut = build_palette_lut(palette, max_value)
+    counts = palette_counts(pixels, lut, len(palette), max_value)
+
+    order = np.argsort(-counts, kind='stable')
+    palette = np.asarray(palette, dtype=np.float32)[order]
+    counts = counts[order]
+    # LUT indices follow the new order
+    remap = np.empty(len(order), dtype=np.uint8)
+    remap[order] = np.arange(len(order), dtype=np.uint8)
+    return {
+        'colors': palette,
+        'counts': counts,
+        'coverage': counts / max(1, counts.sum()),
+        'lut': remap[lut],
+        'max_value': max_value,
+    }
+
+
+def grid_palette_counts(img_arr, palette_result, cell_w, cell_h=None, stride_x=None, stride_y=None,
+                        region=None, partial=False):
+    """
+    Pixels of every palette colour in every cell of a grid laid out as in
+    WindowGrid, (rows, cols, k) int64. The palette indices are counted per
+    block of gcd(cell, stride) pixels with one offset-encoded bincount per
+    band of block rows, the windows are read from prefix sums over the blocks.
+    """
+    geometry = grid_geometry(img_arr.shape, cell_w, cell_h, stride_x, stride_y, region, partial)
+    rows, cols = len(geometry['starts_y']), len(geometry['starts_x'])
+    k = len(palette_result['colors'])
+    if rows == 0 or cols == 0 or k == 0:
+        return np.zeros((rows, cols, k), dtype=np.int64)
+
+    x1, y1, rw, rh = geometry['region']
+    bw = gcd(geometry['cell_w'], geometry['stride_x'])
+    bh = gcd(geometry['cell_h'], geometry['stride_y'])
+    block_rows, block_cols = -(-rh // bh), -(-rw // bw)
+    col_keys = (np.arange(rw, dtype=np.int64) // bw) * k
+
+    rows_per_band = max(1, BAND_TARGET_BYTES // max(1, bh * rw * 8))
+    parts = []
+    for r0 in range(0, block_rows, rows_per_band):
+        r1 = min(r0 + rows_per_band, block_rows)
+        strip = img_arr[y1 + r0 * bh:y1 + min(r1 * bh, rh), x1:x1 + rw]
+        indices = assign_palette(strip, palette_result['lut'], palette_result['max_value'])
+        row_keys = (np.arange(strip.shape[0], dtype=np.int64) // bh) * (block_cols * k)
+        keys = indices + col_keys[None, :] + row_keys[:, None]
+        counts = np.bincount(keys.ravel(), minlength=(r1 - r0) * block_cols * k).reshape(r1 - r0, block_cols, k)
+        parts.append(window_sums(counts, geometry['starts_x'], geometry['cell_w'], bw, axis=1))
+
+    counts = np.concatenate(parts, axis=0)
+    return window_sums(counts, geometry['starts_y'], geometry['cell_h'], bh, axis=0)
+
+
+def selection_pixels(img_arr, rect=None, shape=None):
+    """ (N, 3) pixels of a rectangle (x, y, w, h) or selection shape, None if outside """
+    shape = shape or {'type': 'rect', 'rect': rect}
+    img_h, img_w = img_arr.shape[:2]
+    raster = rasterize_shape(shape, img_w, img_h)
+    if raster is None:
+        return None
+    x1, y1, mask = raster
+    return img_arr[y1:y1 + mask.shape[0], x1:x1 + mask.shape[1]][mask]
+
+
+def calculate_palette(image_path, rect=None, shape=None, n_colors=DEFAULT_COLORS, method='kmeans', img_arr=None):
+    """
+    Palette of a selection (rect or shape) or of the whole image.
+    img_arr: the decoded image, if the caller already has it.
+    Returns the extract_palette dict without the lookup table, None on error.
+    """
+    if not image_path:
+        return None
+
+    try:
+        if img_arr is None:
+            img_arr = load_image_array(image_path)
+        if rect is None and shape is None:
+            pixels = img_arr.reshape(-1, 3)
+        else:
+            pixels = selection_pixels(img_arr, rect, shape)
+        if pixels is None or len(pixels) == 0:
+            return None
+
+        result = extract_palette(pixels, n_colors, method)
+        result.pop('lut')
+        return result
+    except Exception as e:
+        print(f"Error extracting palette: {e}")
+        return None
+
+
+def calculate_batch_palettes(image_paths, n_colors=DEFAULT_COLORS, method='kmeans', rect=None, shape=None):
+    """
+    Palettes of many images (whole image or the same selection in each).
+    Returns {image_path: palette dict}; images that fail are skipped.
+    """
+    results = {}
+    for path in image_paths:
+        result = calculate_palette(path, rect, shape, n_colors, method)
+        if result:
+            results[path] = result
+    return results
+
+
+def calculate_grid_palette(image_path, cell_size, cell_h=None, stride_x=None, stride_y=None, region=None,
+                           partial=False, n_colors=DEFAULT_COLORS, method='kmeans'):
+    """
+    Palette of the grid area (the region or the whole image) and the pixels
+    of each of its colours in every grid cell.
+    Returns {'colors': (k, 3), 'counts': (cells, k) int64} with the cells in
+    the row-major order of the grid rows, None on error.
+    """
+    if not image_path or cell_size <= 0:
+        return None
+
+    try:
+        img_arr = load_image_array(image_path)
+        if region is None:
+            pixels = img_arr.reshape(-1, 3)
+        else:
+            pixels = selection_pixels(img_arr, tuple(region))
+        if pixels is None or len(pixels) == 0:
+            return None
+
+        result = extract_palette(pixels, n_colors, method)
+        counts = grid_palette_counts(img_arr, result, cell_size, cell_h, stride_x, stride_y, region, partial)
+        return {'colors': result['colors'], 'counts': counts.reshape(-1, counts.shape[2])}
+    except Exception as e:
+        print(f"Error calculating grid palette: {e}")
+        return None
@@ -3,106 +3,291 @@ from PIL import Image, ImageDraw, ImageFont
 import cv2
 import os
 
-def calculate_image_stats(image_path, selection_rect):
+from app.core.image_store import load_image_array, decode_image, dtype_max, display_max, to_display_uint8
+from app.core.grid_engine import GridPyramid, WindowGrid, calculate_grid_columns, columns_to_rows, pyramid_groups
+from app.core.grid_quantiles import window_quantiles
+from app.core.masks import rasterize_shape
+from app.core.colorimetry import rgb_to_lab
+
+def calculate_image_stats(image_path, selection_rect, approximate=False, img_arr=None):
     """
     Calculates statistics for the selected area of the image.
     selection_rect: tuple (x, y, w, h)
+    approximate: estimate from a stratified pixel sample with confidence
+    intervals instead (see app.core.sampling).
+    img_arr: the already decoded image, if the caller has it.
     """
     if not image_path or not selection_rect:
         return None
 
-    x, y, w, h = selection_rect
-    
+    if approximate:
+        # Imported here, app.core.sampling builds on this module
+        from app.core.sampling import approximate_image_stats
+        return approximate_image_stats(image_path, selection_rect, img_arr=img_arr)
+
     try:
-        with Image.open(image_path) as img:
-            img = img.convert('RGB')
-            img_arr = np.array(img)
-            
-            # Clip coordinates
-            img_h, img_w, _ = img_arr.shape
-            x1 = max(0, x)
-            y1 = max(0, y)
-            x2 = min(img_w, x + w)
-            y2 = min(img_h, y + h)
-            
-            if x1 >= x2 or y1 >= y2:
-                return None
+        if img_arr is None:
+            img_arr = load_image_array(image_path)
+        
+        # Clip coordinates
+        img_h, img_w, _ = img_arr.shape
+        clipped = clip_rect(selection_rect, img_w, img_h)
+        if clipped is None:
+            return None
+        x1, y1, x2, y2 = clipped
+
+        crop = img_arr[y1:y2, x1:x2]
+        return region_stats(crop.reshape(-1, 3))
 
-            crop = img_arr[y1:y2, x1:x2]
-            
-            # Basic stats (RGB)
-            avg_r = np.mean(crop[:, :, 0])
-            avg_g = np.mean(crop[:, :, 1])
-            avg_b = np.mean(crop[:, :, 2])
-
-            median_r = np.median(crop[:, :, 0])
-            median_g = np.median(crop[:, :, 1])
-            median_b = np.median(crop[:, :, 2])
-            
-            std_r = np.std(crop[:, :, 0])
-            std_g = np.std(crop[:, :, 1])
-            std_b = np.std(crop[:, :, 2])
-
-            # HSV Stats
-            hsv_crop = cv2.cvtColor(crop, cv2.COLOR_RGB2HSV)
-            avg_h = np.mean(hsv_crop[:, :, 0])
-            avg_s = np.mean(hsv_crop[:, :, 1])
-            avg_v = np.mean(hsv_crop[:, :, 2])
-            
-            stats_hsv = {
-                'avg_h': avg_h, 'avg_s': avg_s, 'avg_v': avg_v,
-                'median_h': np.median(hsv_crop[:, :, 0]), 
-                'median_s': np.median(hsv_crop[:, :, 1]), 
-                'median_v': np.median(hsv_crop[:, :, 2]),
-                'std_h': np.std(hsv_crop[:, :, 0]), 
-                'std_s': np.std(hsv_crop[:, :, 1]), 
-                'std_v': np.std(hsv_crop[:, :, 2])
-            }
-
-            # LAB Stats
-            lab_crop = cv2.cvtColor(crop, cv2.COLOR_RGB2LAB)
-            avg_l = np.mean(lab_crop[:, :, 0])
-            avg_a = np.mean(lab_crop[:, :, 1])
-            avg_bb = np.mean(lab_crop[:, :, 2]) # 'b' matches RGB 'b', so use 'bb' for LAB-b
-            
-            stats_lab = {
-                'avg_l': avg_l, 'avg_a': avg_a, 'avg_b': avg_bb,
-                'median_l': np.median(lab_crop[:, :, 0]),
-                'median_a': np.median(lab_crop[:, :, 1]),
-                'median_b': np.median(lab_crop[:, :, 2]),
-                'std_l': np.std(lab_crop[:, :, 0]),
-                'std_a': np.std(lab_crop[:, :, 1]),
-                'std_b': np.std(lab_crop[:, :, 2])
-            }
-
-            # Unique colors
-            pixels = crop.reshape(-1, 3)
-            unique_colors, counts = np.unique(pixels, axis=0, return_counts=True)
-            
-            sorted_indices = np.argsort(-counts)
-            unique_colors = unique_colors[sorted_indices]
-            counts = counts[sorted_indices]
-
-            # Histogram
-            r_hist, _ = np.histogram(crop[:, :, 0], bins=256, range=(0, 256))
-            g_hist, _ = np.histogram(crop[:, :, 1], bins=256, range=(0, 256))
-            b_hist, _ = np.histogram(crop[:, :, 2], bins=256, range=(0, 256))
-            
-            return {
-                'r': avg_r, 'g': avg_g, 'b': avg_b,
-                'median_r': median_r, 'median_g': median_g, 'median_b': median_b,
-                'std_r': std_r, 'std_g': std_g, 'std_b': std_b,
-                'hsv': stats_hsv,
-                'lab': stats_lab,
-                'count': crop.shape[0] * crop.shape[1],
-                'unique_colors': unique_colors,
-                'counts': counts,
-                'hist': (r_hist, g_hist, b_hist)
-            }
     except Exception as e:
         print(f"Error processing image: {e}")
         return None
 
+def calculate_masked_stats(image_path, shape, approximate=False, img_arr=None):
+    """
+    Calculates the same statistics as calculate_image_stats over an
+    arbitrary selection shape (polygon, ellipse, brush mask, see app.core.masks).
+    The mask is rasterised once inside the shape's bounding box.
+    """
+    if not image_path or not shape:
+        return None
+
+    if approximate:
+        from app.core.sampling import approximate_image_stats
+        return approximate_image_stats(image_path, shape=shape, img_arr=img_arr)
+
+    try:
+        if img_arr is None:
+            img_arr = load_image_array(image_path)
+        img_h, img_w = img_arr.shape[:2]
+
+        raster = rasterize_shape(shape, img_w, img_h)
+        if raster is None:
+            return None
+        x1, y1, mask = raster
+
+        crop = img_arr[y1:y1 + mask.shape[0], x1:x1 + mask.shape[1]]
+        pixels = crop[mask]
+        if len(pixels) == 0:
+            return None
+
+        return region_stats(pixels)
+
+    except Exception as e:
+        print(f"Error processing masked selection: {e}")
+        return None
+
+def hist_moments(hist, values=None):
+    """
+    Mean, std and median of the data described by a histogram.
+    values: value of every bin (default: bin index).
+    """
+    if values is None:
+        values = np.arange(len(hist), dtype=np.float64)
+    n = hist.sum()
+    if n == 0:
+        return 0.0, 0.0, 0.0
+
+    mean = float(np.dot(hist, values) / n)
+    var = float(np.dot(hist, (values - mean) ** 2) / n)
+
+    # Same convention as np.median: average of the two middle elements
+    cum = np.cumsum(hist)
+    lo = values[np.searchsorted(cum, (n - 1) // 2, side='right')]
+    hi = values[np.searchsorted(cum, n // 2, side='right')]
+    return mean, np.sqrt(var), (lo + hi) / 2
+
+def float_moments(values):
+    """
+    Mean, std and median of a float channel.
+    Sums are accumulated in float64 without a float64 copy of the data.
+    """
+    n = len(values)
+    if n == 0:
+        return 0.0, 0.0, 0.0
+    mean = float(values.sum(dtype=np.float64) / n)
+    dev = values - values.dtype.type(mean)
+    var = float(np.square(dev).sum(dtype=np.float64) / n)
+    return mean, np.sqrt(var), float(np.median(values))
+
+def channel_moments(values):
+    """ Mean, std, median of one channel: bincount for integer data, float_moments otherwise """
+    bins = hist_bins(values.dtype)
+    if bins:
+        return hist_moments(channel_hist(values, bins))
+    return float_moments(values)
+
+def rgb_summary(pixels):
+    """
+    Mean, median and std per channel of an (N, 3) pixel array.
+    8-bit and 16-bit data is reduced through per-channel bincount histograms.
+    """
+    summary = {'count': len(pixels)}
+    for i, c in enumerate('rgb'):
+        mean, std, median = channel_moments(pixels[:, i])
+        summary[c] = mean
+        summary[f'median_{c}'] = median
+        summary[f'std_{c}'] = std
+    return summary
+
+def clip_rect(rect, img_w, img_h):
+    """ Clips (x, y, w, h) to the image, returns (x1, y1, x2, y2) or None """
+    x, y, w, h = rect
+    x1, y1 = max(0, x), max(0, y)
+    x2, y2 = min(img_w, x + w), min(img_h, y + h)
+    if x1 >= x2 or y1 >= y2:
+        return None
+    return x1, y1, x2, y2
+
+def hist_bins(dtype):
+    """ Number of exact histogram bins for integer samples, None for float data """
+    if dtype == np.uint8:
+        return 256
+    if dtype == np.uint16:
+        return 65536
+    return None
+
+def channel_hist(values, bins=256):
+    """ Histogram of one integer channel via bincount (same bins as np.histogram 0..bins) """
+    return np.bincount(values, minlength=bins)[:bins]
+
+# Number of bins of the histograms returned for display
+DISPLAY_BINS = 256
+
+def display_hists(channels, hists=None):
+    """
+    Display histograms of three channels with DISPLAY_BINS bins.
+    The range adapts to the data: integer data uses 0..2^k covering the largest
+    value (a 12-bit camera in a 16-bit file shows 0..4096), float data 0..max(1, max).
+    hists: exact bincount histograms of integer channels if already computed.
+    Returns (hists, (low, high)).
+    """
+    if hists is not None:
+        last = max(int(np.flatnonzero(h)[-1]) if h.any() else 0 for h in hists)
+        high = max(DISPLAY_BINS, 1 << int(last).bit_length())
+        if high == len(hists[0]) == DISPLAY_BINS:
+            return tuple(hists), (0, DISPLAY_BINS)
+        factor = high // DISPLAY_BINS
+        return tuple(h[:high].reshape(DISPLAY_BINS, factor).sum(axis=1) for h in hists), (0, high)
+
+    low = min(0.0, min(float(c.min()) for c in channels))
+    high = max(1.0, max(float(c.max()) for c in channels))
+    return tuple(np.histogram(c, bins=DISPLAY_BINS, range=(low, high))[0] for c in channels), (low, high)
+
+def float_block(channels, keys):
+    """ Mean/median/std dict like hist_block for three float channels """
+    block = {}
+    for values, key in zip(channels, keys):
+        mean, std, median = float_moments(values)
+        block[f'avg_{key}'] = mean
+        block[f'median_{key}'] = median
+        block[f'std_{key}'] = std
+    return block
+
+def unique_colors_counts(pixels):
+    """
+    Unique colours of an (N, 3) array sorted by pixel count (descending).
+    Integer pixels are packed into one integer per colour, which is much
+    faster than np.unique(axis=0).
+    """
+    if pixels.dtype == np.uint8:
+        packed = (pixels[:, 0].astype(np.uint32) << 16) | (pixels[:, 1].astype(np.uint32) << 8) | pixels[:, 2]
+        bits, mask = 8, 0xFF
+    elif pixels.dtype == np.uint16:
+        packed = (pixels[:, 0].astype(np.uint64) << 32) | (pixels[:, 1].astype(np.uint64) << 16) | pixels[:, 2]
+        bits, mask = 16, 0xFFFF
+    else:
+        # Float colours: compare the raw bytes of every pixel
+        rows = np.ascontiguousarray(pixels).view(np.dtype((np.void, pixels.itemsize * 3))).ravel()
+        unique_rows, counts = np.unique(rows, return_counts=True)
+        order = np.argsort(-counts)
+        colors = unique_rows[order].view(pixels.dtype).reshape(-1, 3)
+        return colors, counts[order]
+
+    unique_packed, counts = np.unique(packed, return_counts=True)
+
+    sorted_indices = np.argsort(-counts)
+    unique_packed = unique_packed[sorted_indices]
+    counts = counts[sorted_indices]
+
+    unique_colors = np.empty((len(unique_packed), 3), dtype=pixels.dtype)
+    unique_colors[:, 0] = unique_packed >> (2 * bits)
+    unique_colors[:, 1] = (unique_packed >> bits) & mask
+    unique_colors[:, 2] = unique_packed & mask
+    return unique_colors, counts
+
+def hist_block(hists, keys):
+    """ Mean/median/std dict for three channel histograms, keys like ('h', 's', 'v') """
+    block = {}
+    for hist, key in zip(hists, keys):
+        mean, std, median = hist_moments(hist)
+        block[f'avg_{key}'] = mean
+        block[f'median_{key}'] = median
+        block[f'std_{key}'] = std
+    return block
+
+def region_stats(pixels):
+    """
+    Statistics of an (N, 3) RGB pixel array (uint8, uint16 or float32).
+    For integer data all moments and medians come from per-channel bincount
+    histograms, so the cost is a few linear passes regardless of the region's
+    shape and no precision is lost. Values are reported in the image's own
+    units; 'max_value' is the full-scale value of its sample type.
+    """
+    n = len(pixels)
+    max_value = dtype_max(pixels.dtype)
+    channels = [pixels[:, i] for i in range(3)]
+
+    # Basic stats (RGB)
+    bins = hist_bins(pixels.dtype)
+    if bins:
+        rgb_hists = [channel_hist(c, bins) for c in channels]
+        rgb = hist_block(rgb_hists, ('r', 'g', 'b'))
+        hists, hist_range = display_hists(channels, rgb_hists)
+    else:
+        rgb = float_block(channels, ('r', 'g', 'b'))
+        hists, hist_range = display_hists(channels)
+
+    # HSV Stats (cvtColor wants an image, so treat the pixels as one column)
+    column = np.ascontiguousarray(pixels).reshape(-1, 1, 3)
+    if pixels.dtype == np.uint8:
+        hsv = cv2.cvtColor(column, cv2.COLOR_RGB2HSV).reshape(-1, 3)
+        stats_hsv = hist_block([channel_hist(hsv[:, i]) for i in range(3)], ('h', 's', 'v'))
+    else:
+        # Float HSV (H 0..360, S/V 0..1) rescaled to the 8-bit convention
+        # (H 0..180, S/V 0..255) so the numbers read the same for every depth
+        unit = column.astype(np.float32) * np.float32(1.0 / max_value)
+        hsv = cv2.cvtColor(unit, cv2.COLOR_RGB2HSV).reshape(-1, 3)
+        hsv *= np.array([0.5, 255.0, 255.0], dtype=np.float32)
+        stats_hsv = float_block([hsv[:, i] for i in range(3)], ('h', 's', 'v'))
+
+    unique_colors, counts = unique_colors_counts(pixels)
+
+    # LAB Stats: float CIELAB (L 0..100) of every unique colour, weighted by
+    # its pixel count, so each colour is converted only once
+    lab = rgb_to_lab(unique_colors, max_value)
+    stats_lab = {}
+    for i, key in enumerate(('l', 'a', 'b')):
+        order = np.argsort(lab[:, i])
+        mean, std, median = hist_moments(counts[order], lab[order, i].astype(np.float64))
+        stats_lab[f'avg_{key}'] = mean
+        stats_lab[f'median_{key}'] = median
+        stats_lab[f'std_{key}'] = std
+
+    return {
+        'r': rgb['avg_r'], 'g': rgb['avg_g'], 'b': rgb['avg_b'],
+        'median_r': rgb['median_r'], 'median_g': rgb['median_g'], 'median_b': rgb['median_b'],
+        'std_r': rgb['std_r'], 'std_g': rgb['std_g'], 'std_b': rgb['std_b'],
+        'hsv': stats_hsv,
+        'lab': stats_lab,
+        'count': n,
+        'unique_colors': unique_colors,
+        'counts': counts,
+        'hist': hists,
+        'hist_range': hist_range,
+        'max_value': max_value,
+    }
+
 def calculate_line_profile(image_path, line_coords):
     """
     Calculates RGB profile along a line.
@@ -114,164 +299,315 @@ def calculate_line_profile(image_path, line_coords):
     x1, y1, x2, y2 = line_coords
     
     try:
-        with Image.open(image_path) as img:
-            img = img.convert('RGB')
-            img_arr = np.array(img)
-            
-            h, w, _ = img_arr.shape
-            
-            # Calculate number of points based on distance
-            dist = int(np.hypot(x2 - x1, y2 - y1))
-            if dist == 0: return None
-            
-            num_points = dist
-            
-            # Generate coordinates
-            x_values = np.linspace(x1, x2, num_points)
-            y_values = np.linspace(y1, y2, num_points)
-            
-            # Sample using nearest neighbor (integer casting)
-            # Clip coords to be safe
-            x_idx = np.clip(np.round(x_values).astype(int), 0, w - 1)
-            y_idx = np.clip(np.round(y_values).astype(int), 0, h - 1)
-            
-            # Extract
-            r = img_arr[y_idx, x_idx, 0]
-            g = img_arr[y_idx, x_idx, 1]
-            b = img_arr[y_idx, x_idx, 2]
-            
-            return {'r': r, 'g': g, 'b': b}
+        img_arr = load_image_array(image_path)
+        
+        h, w, _ = img_arr.shape
+        
+        # Calculate number of points based on distance
+        dist = int(np.hypot(x2 - x1, y2 - y1))
+        if dist == 0: return None
+        
+        num_points = dist
+        
+        # Generate coordinates
+        x_values = np.linspace(x1, x2, num_points)
+        y_values = np.linspace(y1, y2, num_points)
+        
+        # Sample using nearest neighbor (integer casting)
+        # Clip coords to be safe
+        x_idx = np.clip(np.round(x_values).astype(int), 0, w - 1)
+        y_idx = np.clip(np.round(y_values).astype(int), 0, h - 1)
+        
+        # Extract
+        r = img_arr[y_idx, x_idx, 0]
+        g = img_arr[y_idx, x_idx, 1]
+        b = img_arr[y_idx, x_idx, 2]
+
+        # Full scale of the plot adapts to the data like the histograms
+        # (a 12-bit camera in a 16-bit file is plotted 0..4095)
+        max_value = display_max(np.stack([r, g, b]))
+
+        return {'r': r, 'g': g, 'b': b, 'max_value': max_value}
             
     except Exception as e:
         print(f"Error calculating profile: {e}")
         return None
 
-def calculate_grid_stats(image_path, cell_size):
+def pixel_values(img_arr, x, y, size=1):
+    """
+    Values of one pixel of a decoded image for the hover inspector:
+    'rgb', 'hsv' (8-bit convention like region_stats) and 'lab', plus 'mean',
+    the RGB mean of the size x size neighbourhood clipped to the image.
+    Only the pixel and its neighbourhood are read. None outside the image.
+    """
+    img_h, img_w = img_arr.shape[:2]
+    if not (0 <= x < img_w and 0 <= y < img_h):
+        return None
+
+    max_value = dtype_max(img_arr.dtype)
+    pixel = np.array(img_arr[y, x])
+    column = pixel.reshape(1, 1, 3)
+    if pixel.dtype == np.uint8:
+        hsv = cv2.cvtColor(column, cv2.COLOR_RGB2HSV).reshape(3).astype(np.float32)
+    else:
+        unit = column.astype(np.float32) * np.float32(1.0 / max_value)
+        hsv = cv2.cvtColor(unit, cv2.COLOR_RGB2HSV).reshape(3) * np.array([0.5, 255.0, 255.0], dtype=np.float32)
+
+    half = size // 2
+    block = img_arr[max(0, y - half):y + half + 1, max(0, x - half):x + half + 1]
+    mean = block.reshape(-1, 3).mean(axis=0, dtype=np.float64)
+
+    return {
+        'x': x, 'y': y,
+        'rgb': pixel,
+        'hsv': hsv,
+        'lab': rgb_to_lab(pixel.astype(np.float32), max_value),
+        'mean': mean,
+        'count': block.shape[0] * block.shape[1],
+        'max_value': max_value,
+    }
+
+def calculate_grid_stats(image_path, cell_size, workers=None, approximate=False, cell_h=None,
+                         stride_x=None, stride_y=None, region=None, partial=False,
+                         percentiles=None, spaces=('rgb',)):
     """
     Calculates statistics for every cell in a grid over the image.
-    Returns a list of dictionaries with coordinates and stats.
+    Returns a list of dictionaries with coordinates, size and stats.
+    workers: number of threads for the grid engine (default: all cores).
+    approximate: estimate every cell from a strided sample, rows get
+    'ci_r', 'ci_g', 'ci_b' confidence half-widths (see app.core.sampling).
+    cell_h, stride_x / stride_y, region (x, y, w, h) and partial give
+    rectangular, overlapping or clipped cells over a part of the image
+    (see WindowGrid); by default the cells are square and cover the image.
+    percentiles (50 = median) and spaces ('rgb', 'hsv', 'lab') add the
+    per-cell columns of app.core.grid_quantiles (exact mode only).
     """
     if not image_path or cell_size <= 0:
         return []
 
-    results = []
-    
+    window_layout = is_window_layout(cell_size, cell_h, stride_x, stride_y, region, partial)
+    if approximate and not window_layout:
+        from app.core.sampling import approximate_grid_stats
+        return approximate_grid_stats(image_path, cell_size, workers=workers)
+
     try:
-        with Image.open(image_path) as img:
-            img = img.convert('RGB')
-            img_arr = np.array(img)
-            
-            h, w, _ = img_arr.shape
-            
-            # Iterate through grid
-            for y in range(0, h, cell_size):
-                for x in range(0, w, cell_size):
-                    # Define cell boundaries
-                    x2 = min(x + cell_size, w)
-                    y2 = min(y + cell_size, h)
-                    
-                    # Skip partial cells (if not full size)
-                    if (x2 - x) != cell_size or (y2 - y) != cell_size:
-                        continue
-                    
-                    # Extract crop
-                    crop = img_arr[y:y2, x:x2]
-                    
-                    if crop.size == 0:
-                        continue
-                        
-                    # Calculate Stats (Simplified for batch processing)
-                    # We focus on what's requested: "coordinate and data"
-                    # Average RGB is the most useful "data"
-                    
-                    avg_r = np.mean(crop[:, :, 0])
-                    avg_g = np.mean(crop[:, :, 1])
-                    avg_b = np.mean(crop[:, :, 2])
-                    
-                    # Determine predominant color or other metric?
-                    # For now just Averages and Standard Deviations
-                    
-                    results.append({
-                        'x': x,
-                        'y': y,
-                        'avg_r': avg_r,
-                        'avg_g': avg_g,
-                        'avg_b': avg_b,
-                        'std_r': np.std(crop[:, :, 0]),
-                        'std_g': np.std(crop[:, :, 1]),
-                        'std_b': np.std(crop[:, :, 2])
-                    })
-                    
-        return results
-            
+        img_arr = load_image_array(image_path)
+
+        if window_layout:
+            columns = WindowGrid(img_arr, cell_size, cell_h, stride_x, stride_y, region, partial, workers).columns()
+        else:
+            # Partial cells at the edges are skipped by the engine
+            columns = calculate_grid_columns(img_arr, cell_size, workers)
+
+        if percentiles or any(space != 'rgb' for space in spaces):
+            columns.update(window_quantiles(img_arr, cell_size, cell_h, stride_x, stride_y, region, partial,
+                                            percentiles or (), spaces, workers))
+        return columns_to_rows(columns)
+
     except Exception as e:
         print(f"Error calculating grid stats: {e}")
         return []
 
+def calculate_grid_quantiles(image_path, cell_size, cell_h=None, stride_x=None, stride_y=None, region=None,
+                             partial=False, percentiles=(50,), spaces=('rgb',), workers=None):
+    """
+    Per-cell percentile (and HSV / LAB) columns of a grid, in the order of
+    its rows (see app.core.grid_quantiles). None on error.
+    """
+    if not image_path or cell_size <= 0:
+        return None
+
+    try:
+        img_arr = load_image_array(image_path)
+        return window_quantiles(img_arr, cell_size, cell_h, stride_x, stride_y, region, partial,
+                                percentiles, spaces, workers)
+    except Exception as e:
+        print(f"Error calculating grid percentiles: {e}")
+        return None
+
+def is_window_layout(cell_size, cell_h=None, stride_x=None, stride_y=None, region=None, partial=False):
+    """ True if the grid parameters need WindowGrid (not plain square cells over the whole image) """
+    return bool(region is not None or partial or
+                any(v and v != cell_size for v in (cell_h, stride_x, stride_y)))
+
+def build_window_grid(image_path, cell_w, cell_h=None, stride_x=None, stride_y=None, region=None,
+                      partial=False, workers=None, img_arr=None):
+    """
+    WindowGrid of the image (rectangular / overlapping cells), None on error.
+    img_arr: the already decoded image, if the caller has it.
+    """
+    if not image_path or cell_w <= 0:
+        return None
+
+    try:
+        if img_arr is None:
+            img_arr = load_image_array(image_path)
+        return WindowGrid(img_arr, cell_w, cell_h, stride_x, stride_y, region, partial, workers)
+    except Exception as e:
+        print(f"Error building window grid: {e}")
+        return None
+
+def build_grid_pyramid(image_path, base_size, workers=None, img_arr=None):
+    """
+    Builds the moment pyramid of the image at base_size.
+    Grid stats for any multiple of base_size can then be read from it.
+    img_arr: the already decoded image, if the caller has it.
+    """
+    if not image_path or base_size <= 0:
+        return None
+
+    try:
+        if img_arr is None:
+            img_arr = load_image_array(image_path)
+        return GridPyramid(img_arr, base_size, workers)
+    except Exception as e:
+        print(f"Error building grid pyramid: {e}")
+        return None
+
+def calculate_grid_sweep(image_path, cell_sizes, workers=None):
+    """
+    Grid statistics for several cell sizes from one decode of the image.
+    Sizes with a common divisor of at least MIN_PYRAMID_BASE share a
+    pyramid (see pyramid_groups), so 10, 20, 40 read the pixels once.
+    Returns {cell_size: list of dictionaries as in calculate_grid_stats}.
+    """
+    cell_sizes = sorted({int(c) for c in cell_sizes if int(c) > 0})
+    if not image_path or not cell_sizes:
+        return {}
+
+    try:
+        img_arr = load_image_array(image_path)
+    except Exception as e:
+        print(f"Error calculating grid sweep: {e}")
+        return {}
+
+    results = {}
+    for base, sizes in pyramid_groups(cell_sizes):
+        pyramid = build_grid_pyramid(image_path, base, workers, img_arr=img_arr)
+        if pyramid is None:
+            return {}
+        results.update((c, pyramid.rows(c)) for c in sizes)
+    return {c: results[c] for c in cell_sizes}
+
+def calculate_roi_stats(image_path, rois):
+    """
+    Calculates statistics for many named regions of one image.
+    The image is decoded once and every region is read from the same array.
+    rois: list of dicts {'name': str, 'rect': (x, y, w, h)} or
+          {'name': str, 'shape': shape dict (see app.core.masks)}
+    Returns a list of dicts with 'name', 'rect' (clipped bounding box) and RGB mean/median/std.
+    Regions outside the image are skipped.
+    """
+    if not image_path or not rois:
+        return []
+
+    try:
+        return roi_summaries(load_image_array(image_path), rois)
+
+    except Exception as e:
+        print(f"Error calculating ROI stats: {e}")
+        return []
+
+def roi_pixels(img_arr, roi):
+    """
+    (N, 3) pixels and clipped bounding box (x, y, w, h) of a region
+    {'rect': (x, y, w, h)} or {'shape': shape dict} of a decoded image.
+    None if the region lies outside the image.
+    """
+    img_h, img_w = img_arr.shape[:2]
+    shape = roi.get('shape') or {'type': 'rect', 'rect': roi['rect']}
+    raster = rasterize_shape(shape, img_w, img_h)
+    if raster is None:
+        return None
+    x1, y1, mask = raster
+    mh, mw = mask.shape
+
+    crop = img_arr[y1:y1 + mh, x1:x1 + mw]
+    pixels = crop.reshape(-1, 3) if shape['type'] == 'rect' else crop[mask]
+    if len(pixels) == 0:
+        return None
+    return pixels, (x1, y1, mw, mh)
+
+def roi_summaries(img_arr, rois):
+    """ calculate_roi_stats on an already decoded image array """
+    results = []
+    for roi in rois:
+        region = roi_pixels(img_arr, roi)
+        if region is None:
+            continue
+        pixels, rect = region
+
+        summary = rgb_summary(pixels)
+        summary['name'] = roi['name']
+        summary['rect'] = rect
+        results.append(summary)
+
+    return results
+
 def create_annotated_image(image_path, results, cell_size, output_path):
     """
     Creates a copy of the image with grid and coordinates drawn on it.
     """
     try:
-        with Image.open(image_path) as img:
-            img = img.convert('RGB')
-            draw = ImageDraw.Draw(img)
+        # Shown like the viewer: high bit depths are scaled by their significant range
+        img = Image.fromarray(to_display_uint8(decode_image(image_path)))
+        draw = ImageDraw.Draw(img)
+        
+        # Try to load a font
+        try:
+            # Adjust font size based on cell size - make it smaller
+            font_size = max(8, int(cell_size / 6))
+            font = ImageFont.truetype("arial.ttf", font_size)
+        except IOError:
+            font = ImageFont.load_default()
+        
+        img_w, img_h = img.size
+
+        for r in results:
+            x, y = r['x'], r['y']
             
-            # Try to load a font
-            try:
-                # Adjust font size based on cell size - make it smaller
-                font_size = max(8, int(cell_size / 6))
-                font = ImageFont.truetype("arial.ttf", font_size)
-            except IOError:
-                font = ImageFont.load_default()
+            # Rectangular / clipped cells carry their size, square ones use cell_size
+            w = min(r.get('w', cell_size), img_w - x)
+            h = min(r.get('h', cell_size), img_h - y)
+            
+            # Draw rect
+            draw.rectangle([x, y, x+w, y+h], outline="cyan", width=2)
+            
+            # Draw text split in two lines to save width
+            text_x = str(x)
+            text_y = str(y)
+            
+            # Helper to get size
+            def get_size(txt):
+                try:
+                    bbox = draw.textbbox((0, 0), txt, font=font)
+                    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+                except AttributeError:
+                    return draw.textsize(txt, font=font)
+
+            w_x, h_x = get_size(text_x)
+            w_y, h_y = get_size(text_y)
+            
+            total_h = h_x + h_y + 2 # 2px spacing
+
+            # Center X coordinate
+            tx_x = x + (w - w_x) / 2
+            ty_x = y + (h - total_h) / 2
+            
+            # Center Y coordinate below X
+            tx_y = x + (w - w_y) / 2
+            ty_y = ty_x + h_x + 2
+            
+            # Draw X
+            draw.text((tx_x+1, ty_x+1), text_x, font=font, fill="black")
+            draw.text((tx_x, ty_x), text_x, font=font, fill="yellow")
+
+            # Draw Y
+            draw.text((tx_y+1, ty_y+1), text_y, font=font, fill="black")
+            draw.text((tx_y, ty_y), text_y, font=font, fill="yellow")
             
-            img_w, img_h = img.size
-
-            for r in results:
-                x, y = r['x'], r['y']
-                
-                # Calculate dimensions dynamically since we removed them from results
-                w = min(cell_size, img_w - x)
-                h = min(cell_size, img_h - y)
-                
-                # Draw rect
-                draw.rectangle([x, y, x+w, y+h], outline="cyan", width=2)
-                
-                # Draw text split in two lines to save width
-                text_x = str(x)
-                text_y = str(y)
-                
-                # Helper to get size
-                def get_size(txt):
-                    try:
-                        bbox = draw.textbbox((0, 0), txt, font=font)
-                        return bbox[2] - bbox[0], bbox[3] - bbox[1]
-                    except AttributeError:
-                        return draw.textsize(txt, font=font)
-
-                w_x, h_x = get_size(text_x)
-                w_y, h_y = get_size(text_y)
-                
-                total_h = h_x + h_y + 2 # 2px spacing
-
-                # Center X coordinate
-                tx_x = x + (w - w_x) / 2
-                ty_x = y + (h - total_h) / 2
-                
-                # Center Y coordinate below X
-                tx_y = x + (w - w_y) / 2
-                ty_y = ty_x + h_x + 2
-                
-                # Draw X
-                draw.text((tx_x+1, ty_x+1), text_x, font=font, fill="black")
-                draw.text((tx_x, ty_x), text_x, font=font, fill="yellow")
-
-                # Draw Y
-                draw.text((tx_y+1, ty_y+1), text_y, font=font, fill="black")
-                draw.text((tx_y, ty_y), text_y, font=font, fill="yellow")
-                
-            img.save(output_path)
-            return True
+        img.save(output_path)
+        return True
     except Exception as e:
         print(f"Error creating annotated image: {e}")
         return False
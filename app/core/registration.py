@@ -0,0 +1,96 @@
+import numpy as np
+import cv2
+
+from app.core.image_store import load_image_array
+
+# Coarsest pyramid level is reduced until its longer side fits this size
+COARSE_SIDE = 256
+# Pyramid levels with a longer side above this are skipped (the full
+# resolution step below takes over), which bounds the cost for huge images
+MAX_LEVEL_SIDE = 2048
+# Window of the full-resolution refinement
+REFINE_WINDOW = 1024
+
+
+def to_gray(img_arr):
+    """ Single-channel uint8/float view of an RGB array for correlation """
+    if img_arr.ndim == 2:
+        return np.ascontiguousarray(img_arr)
+    return cv2.cvtColor(np.ascontiguousarray(img_arr), cv2.COLOR_RGB2GRAY)
+
+
+def build_pyramid(gray, coarse_side=COARSE_SIDE):
+    """ [full, 1/2, 1/4, ...] down to a level whose longer side is <= coarse_side """
+    levels = [gray]
+    while max(levels[-1].shape[:2]) > coarse_side and min(levels[-1].shape[:2]) > 16:
+        levels.append(cv2.pyrDown(levels[-1]))
+    return levels
+
+
+def correlate_at(base, overlay, offset, window=None):
+    """
+    Refines offset (overlay top-left in base coordinates) by phase correlation
+    of the overlapping parts. window limits the compared area to a centred
+    square of that size. Returns (new_offset, response).
+    """
+    ix, iy = int(round(offset[0])), int(round(offset[1]))
+    bh, bw = base.shape[:2]
+    oh, ow = overlay.shape[:2]
+
+    x1, y1 = max(0, ix), max(0, iy)
+    x2, y2 = min(bw, ix + ow), min(bh, iy + oh)
+    if x2 - x1 < 16 or y2 - y1 < 16:
+        return offset, 0.0
+
+    if window:
+        cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+        half = window // 2
+        x1, x2 = max(x1, cx - half), min(x2, cx + half)
+        y1, y2 = max(y1, cy - half), min(y2, cy + half)
+
+    a = base[y1:y2, x1:x2].astype(np.float32)
+    b = overlay[y1 - iy:y2 - iy, x1 - ix:x2 - ix].astype(np.float32)
+
+    hann = cv2.createHanningWindow((a.shape[1], a.shape[0]), cv2.CV_32F)
+    (sx, sy), response = cv2.phaseCorrelate(b, a, hann)
+
+    # Content of the overlay appears shifted by (sx, sy) in the base crop
+    return (ix + sx, iy + sy), float(response)
+
+
+def estimate_overlay_offset(base_arr, overlay_arr, initial=(0.0, 0.0)):
+    """
+    Sub-pixel position of the overlay on the base image.
+    Coarse-to-fine phase correlation on image pyramids, starting from the
+    initial position, followed by a refinement on a full-resolution window.
+    Returns ((dx, dy), response), response is the correlation peak (0..1).
+    """
+    base_levels = build_pyramid(to_gray(base_arr))
+    overlay_levels = build_pyramid(to_gray(overlay_arr))
+    n = min(len(base_levels), len(overlay_levels))
+
+    top = n - 1
+    scale = 2 ** top
+    offset = (initial[0] / scale, initial[1] / scale)
+    response = 0.0
+
+    for level in range(top, 0, -1):
+        if max(base_levels[level].shape[:2]) <= MAX_LEVEL_SIDE or level == top:
+            offset, response = correlate_at(base_levels[level], overlay_levels[level], offset)
+        # Next level is twice as large
+        offset = (offset[0] * 2, offset[1] * 2)
+
+    # Final step on full resolution, limited to a centred window
+    offset, response = correlate_at(base_levels[0], overlay_levels[0], offset, REFINE_WINDOW)
+    return offset, response
+
+
+def align_overlay(base_path, overlay_path, initial=(0.0, 0.0)):
+    """ estimate_overlay_offset for two image files, None on error """
+    try:
+        base_arr = load_image_array(base_path)
+        overlay_arr = load_image_array(overlay_path)
+        return estimate_overlay_offset(base_arr, overlay_arr, initial)
+    except Exception as e:
+        print(f"Error aligning overlay: {e}")
+        return None
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from app.core.store_config import default_cache_dir
+
+# Bump with every change to the layout of a cached result, old entries are then ignored
+CACHE_VERSION = 2
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Seconds between two writes of the access time of an entry
+TOUCH_INTERVAL = 60
+
+
+class ResultCache:
+    """
+    Persistent cache of computed results (ROI stats, grid tables, profiles).
+    Entries are keyed by the image file (path, size, mtime), the kind of
+    result and its parameters.
+    The least recently used entries are evicted once the total size of stored
+    results exceeds max_bytes.
+    """
+
+    def __init__(self, db_path=None, max_bytes=DEFAULT_MAX_BYTES):
+        if db_path is None:
+            db_path = os.path.join(os.path.dirname(default_cache_dir()), 'results.sqlite')
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_access REAL)")
+        # Content hashes of older versions, keys no longer read the files
+        self.conn.execute("DROP TABLE IF EXISTS file_hashes")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_access ON results(last_access)")
+        self.conn.commit()
+
+    def image_key(self, image_path):
+        """
+        Identity of the image file: path, size and mtime. Cheap to get (no
+        read of the file), and an edited file gets new entries.
+        """
+        path = os.path.abspath(image_path)
+        st = os.stat(path)
+        return f"{path}|{st.st_size}|{st.st_mtime_ns}"
+
+    def make_key(self, kind, image_path, params):
+        raw = f"{CACHE_VERSION}|{kind}|{self.image_key(image_path)}|{params!r}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value, last_access FROM results WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            # The access time only orders the eviction, so it is written at
+            # most every TOUCH_INTERVAL instead of a commit per hit
+            now = time.time()
+            if now - row[1] > TOUCH_INTERVAL:
+                self.conn.execute("UPDATE results SET last_access=? WHERE key=?", (now, key))
+                self.conn.commit()
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            return None
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time()))
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        """ Drops least recently used entries until the cache fits max_bytes (lock held) """
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self.conn.execute("SELECT key, size FROM results ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM results WHERE key=?", (key,))
+            total -= size
+
+    def lookup(self, kind, image_path, params):
+        """ Cached result for (image, kind, params) or None, never computes """
+        if not self.enabled or not image_path:
+            return None
+        try:
+            return self.get(self.make_key(kind, image_path, params))
+        except OSError:
+            return None
+
+    def get_or_compute(self, kind, image_path, params, compute):
+        """
+        Returns the cached result for (image, kind, params) or calls compute()
+        and stores its result. Empty results are never cached.
+        """
+        if not self.enabled or not image_path:
+            return compute()
+
+        try:
+            key = self.make_key(kind, image_path, params)
+        except OSError:
+            return compute()
+
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        result = compute()
+        if result is not None and not (hasattr(result, '__len__') and len(result) == 0):
+            try:
+                self.put(key, result)
+            except Exception as e:
+                print(f"Error writing result cache: {e}")
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM results")
+            self.conn.commit()
+            self.conn.execute("VACUUM")
+
+
+_default_cache = None
+
+
+def get_result_cache():
+    """
+    Shared cache instance, opened on first use. If the cache directory is
+    unusable the instance is a disabled in-memory cache, every result is
+    then computed.
+    """
+    global _default_cache
+    if _default_cache is None:
+        try:
+            _default_cache = ResultCache()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error opening result cache: {e}")
+            _default_cache = ResultCache(':memory:')
+            _default_cache.enabled = False
+    return _default_cache
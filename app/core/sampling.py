@@ -0,0 +1,244 @@
+import numpy as np
+
+from app.core.image_store import load_image_array
+from app.core.grid_engine import grid_moments, moments_to_columns
+from app.core.masks import rasterize_shape
+from app.core.processor import region_stats, clip_rect, columns_to_rows
+
+SAMPLE_METHODS = ('stratified', 'strided')
+
+# Pixels drawn for an approximate selection
+SAMPLE_SIZE = 256 * 1024
+# Pixels drawn per cell for an approximate grid
+CELL_SAMPLES = 64
+
+# Two-sided 95% normal quantile
+Z_95 = 1.96
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def sample_positions(height, width, sample_size=SAMPLE_SIZE, method='stratified', seed=0):
+    """
+    Row and column indices of a pixel sample of a height x width area.
+    The area is covered by step x step strata (step chosen for about
+    sample_size pixels). 'stratified' draws one random pixel in every
+    stratum, 'strided' takes the same random offset in all of them.
+    Positions that fall outside partial edge strata are dropped, so every
+    pixel has the same inclusion probability 1 / step^2.
+    Returns (ys, xs, step); step == 1 means the whole area.
+    """
+    step = max(1, int(np.sqrt(height * width / max(1, sample_size))))
+    if step == 1:
+        ys, xs = np.indices((height, width))
+        return ys.ravel(), xs.ravel(), 1
+
+    rows = -(-height // step)
+    cols = -(-width // step)
+    rng = np.random.default_rng(seed)
+    if method == 'stratified':
+        dy = rng.integers(0, step, (rows, cols))
+        dx = rng.integers(0, step, (rows, cols))
+    elif method == 'strided':
+        dy = np.full((rows, cols), rng.integers(0, step))
+        dx = np.full((rows, cols), rng.integers(0, step))
+    else:
+        raise ValueError(f"Unknown sampling method: {method}")
+
+    ys = np.arange(rows)[:, None] * step + dy
+    xs = np.arange(cols)[None, :] * step + dx
+    keep = (ys < height) & (xs < width)
+    return ys[keep], xs[keep], step
+
+
+def mean_ci(std, n, population):
+    """ 95% half-width of a sample mean, with the finite population correction """
+    if n <= 1:
+        return 0.0
+    fpc = np.sqrt(max(0.0, 1.0 - n / population))
+    return float(Z_95 * std / np.sqrt(n) * fpc)
+
+
+def std_ci(values, n, population):
+    """
+    95% half-width of the sample std (delta method on the variance,
+    no normality assumption: uses the fourth central moment).
+    """
+    if n <= 1:
+        return 0.0
+    dev = values - values.mean()
+    var = float(np.mean(dev * dev))
+    if var == 0:
+        return 0.0
+    m4 = float(np.mean(dev ** 4))
+    fpc = np.sqrt(max(0.0, 1.0 - n / population))
+    se_var = np.sqrt(max(m4 - var * var, 0.0) / n) * fpc
+    return float(Z_95 * se_var / (2 * np.sqrt(var)))
+
+
+def percentile_ci(sorted_values, q, population):
+    """
+    Estimate and distribution-free 95% interval of the q-th percentile
+    from order statistics of a sorted sample: (value, low, high).
+    """
+    n = len(sorted_values)
+    p = q / 100.0
+    rank = int(np.clip(round(n * p), 0, n - 1))
+    if n >= population:
+        value = float(sorted_values[rank])
+        return value, value, value
+    half = Z_95 * np.sqrt(n * p * (1 - p))
+    lo = int(np.clip(np.floor(n * p - half), 0, n - 1))
+    hi = int(np.clip(np.ceil(n * p + half), 0, n - 1))
+    return float(sorted_values[rank]), float(sorted_values[lo]), float(sorted_values[hi])
+
+
+def estimate_stats(sample, population):
+    """
+    region_stats of a pixel sample with estimates for the whole population:
+    'count' is the population size and colour counts are scaled to it.
+    Adds 'approximate', 'sample_count', 'percentiles' ({q: [r, g, b]}) and
+    'ci' with 95% half-widths of the means and stds ('r', 'std_r', ...),
+    (low, high) intervals of the percentiles ({q: [(low, high)] * 3}) and
+    of the colour shares ('colors': half-width per unique colour).
+    Unique colours are those seen in the sample, a lower bound.
+    """
+    n = len(sample)
+    stats = region_stats(sample)
+    if stats is None:
+        return None
+
+    ci = {}
+    percentiles = {q: [] for q in PERCENTILES}
+    ci['percentiles'] = {q: [] for q in PERCENTILES}
+    for i, c in enumerate('rgb'):
+        values = sample[:, i].astype(np.float64)
+        ci[c] = mean_ci(stats[f'std_{c}'], n, population)
+        ci[f'std_{c}'] = std_ci(values, n, population)
+        sorted_values = np.sort(values)
+        for q in PERCENTILES:
+            value, lo, hi = percentile_ci(sorted_values, q, population)
+            percentiles[q].append(value)
+            ci['percentiles'][q].append((lo, hi))
+
+    share = stats['counts'] / n
+    fpc = np.sqrt(max(0.0, 1.0 - n / population))
+    ci['colors'] = Z_95 * np.sqrt(share * (1 - share) / n) * fpc
+
+    scale = population / n
+    stats['counts'] = np.round(stats['counts'] * scale).astype(np.int64)
+    stats['count'] = int(population)
+    stats['sample_count'] = n
+    stats['percentiles'] = percentiles
+    stats['ci'] = ci
+    stats['approximate'] = True
+    return stats
+
+
+def sample_region(img_arr, x1, y1, mask=None, height=None, width=None,
+                  sample_size=SAMPLE_SIZE, method='stratified', seed=0):
+    """
+    Pixel sample of the area starting at (x1, y1), either a mask or a
+    height x width rectangle. Returns ((N, 3) sample, population size).
+    """
+    if mask is not None:
+        height, width = mask.shape
+        population = int(np.count_nonzero(mask))
+        # The mask only selects, the strata still cover its bounding box
+        sample_size = int(sample_size * height * width / max(1, population))
+    else:
+        population = height * width
+
+    ys, xs, step = sample_positions(height, width, sample_size, method, seed)
+    if mask is not None:
+        keep = mask[ys, xs]
+        ys, xs = ys[keep], xs[keep]
+    return img_arr[y1 + ys, x1 + xs], population
+
+
+def approximate_image_stats(image_path, selection_rect=None, shape=None,
+                            sample_size=SAMPLE_SIZE, method='stratified', img_arr=None):
+    """
+    Estimated statistics of a rectangle (x, y, w, h) or a selection shape
+    from a stratified (or strided) pixel sample, see estimate_stats.
+    Selections smaller than the sample are computed on all their pixels.
+    img_arr: the already decoded image, if the caller has it.
+    """
+    if not image_path or (not selection_rect and not shape):
+        return None
+
+    try:
+        if img_arr is None:
+            img_arr = load_image_array(image_path)
+        img_h, img_w = img_arr.shape[:2]
+
+        if shape is not None:
+            raster = rasterize_shape(shape, img_w, img_h)
+            if raster is None:
+                return None
+            x1, y1, mask = raster
+            sample, population = sample_region(img_arr, x1, y1, mask=mask,
+                                               sample_size=sample_size, method=method)
+        else:
+            clipped = clip_rect(selection_rect, img_w, img_h)
+            if clipped is None:
+                return None
+            x1, y1, x2, y2 = clipped
+            sample, population = sample_region(img_arr, x1, y1, height=y2 - y1, width=x2 - x1,
+                                               sample_size=sample_size, method=method)
+
+        if len(sample) == 0:
+            return None
+        return estimate_stats(sample, population)
+
+    except Exception as e:
+        print(f"Error sampling image: {e}")
+        return None
+
+
+def sample_step(cell_size, cell_samples=CELL_SAMPLES):
+    """ Largest divisor of cell_size that leaves at least cell_samples pixels per cell """
+    target = max(1, int(cell_size / np.sqrt(cell_samples)))
+    for step in range(target, 0, -1):
+        if cell_size % step == 0:
+            return step
+    return 1
+
+
+def approximate_grid_columns(img_arr, cell_size, cell_samples=CELL_SAMPLES, workers=None, seed=0):
+    """
+    Grid columns like calculate_grid_columns from a strided sample: every
+    step-th pixel of every cell with one random offset (step divides the
+    cell size). Adds 'ci_r', 'ci_g', 'ci_b', the 95% half-widths of the
+    cell means.
+    """
+    step = sample_step(cell_size, cell_samples)
+    rows, cols = img_arr.shape[0] // cell_size, img_arr.shape[1] // cell_size
+    rng = np.random.default_rng(seed)
+    oy, ox = rng.integers(0, step, 2)
+
+    sub = img_arr[:rows * cell_size, :cols * cell_size][oy::step, ox::step]
+    sub_cell = cell_size // step
+    n = sub_cell * sub_cell
+    sums, sq_sums = grid_moments(sub, sub_cell, workers)
+    columns = moments_to_columns(sums, sq_sums, n, cell_size, cell_size)
+
+    fpc = np.sqrt(max(0.0, 1.0 - n / float(cell_size * cell_size)))
+    # Sample std with Bessel's correction for the standard error
+    bessel = np.sqrt(n / (n - 1)) if n > 1 else 0.0
+    for c in 'rgb':
+        columns[f'ci_{c}'] = Z_95 * columns[f'std_{c}'] * bessel / np.sqrt(n) * fpc
+    return columns
+
+
+def approximate_grid_stats(image_path, cell_size, cell_samples=CELL_SAMPLES, workers=None):
+    """ calculate_grid_stats from a strided sample of every cell, with confidence columns """
+    if not image_path or cell_size <= 0:
+        return []
+
+    try:
+        img_arr = load_image_array(image_path)
+        return columns_to_rows(approximate_grid_columns(img_arr, cell_size, cell_samples, workers))
+    except Exception as e:
+        print(f"Error sampling grid stats: {e}")
+        return []
@@ -0,0 +1,662 @@
+import asyncio
+import http.client
+import json
+import math
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.core.image_store import decode_image, load_image_array, is_store_enabled
+from app.core.grid_engine import WindowGrid, calculate_grid_columns, columns_to_rows, default_workers
+from app.core.processor import region_stats, roi_pixels, roi_summaries, is_window_layout
+from app.core.masks import SHAPE_TYPES
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Decoded images kept in memory between requests
+WARM_CACHE_BYTES = 1024 * 1024 * 1024
+# Images kept at most, memory-mapped store files cost no RAM but a mapping each
+WARM_CACHE_IMAGES = 64
+
+# Latencies kept per endpoint for the percentiles of /metrics
+LATENCY_WINDOW = 1000
+# Throughput of /metrics is also reported over this many recent seconds
+RATE_WINDOW = 60.0
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class RequestError(Exception):
+    """ Client error, sent back with its HTTP status """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class WarmImageCache:
+    """
+    LRU of decoded image arrays shared by all requests, limited by size.
+    Memory-mapped arrays of the decoded store count as 0 bytes, the number
+    of entries is limited as well.
+    Entries are keyed by path, size and mtime, so an overwritten file is
+    decoded again. Concurrent requests for the same image decode it once.
+    """
+
+    def __init__(self, max_bytes=WARM_CACHE_BYTES, max_images=WARM_CACHE_IMAGES):
+        self.max_bytes = max_bytes
+        self.max_images = max_images
+        self.entries = OrderedDict()  # key -> array
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.loading = {}  # key -> lock held while the image is decoded
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_path):
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            raise RequestError(404, f"File not found: {image_path}")
+        key = (os.path.abspath(image_path), st.st_size, st.st_mtime_ns)
+
+        with self.lock:
+            img_arr = self.lookup(key)
+            if img_arr is not None:
+                return img_arr
+            key_lock = self.loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                img_arr = self.lookup(key)
+                if img_arr is not None:
+                    return img_arr
+                self.misses += 1
+            try:
+                # The memory-mapped store costs no RAM here, plain decodes do
+                img_arr = load_image_array(image_path) if is_store_enabled() else decode_image(image_path)
+            finally:
+                with self.lock:
+                    self.loading.pop(key, None)
+            self.put(key, img_arr)
+            return img_arr
+
+    def lookup(self, key):
+        """ Cached array or None, under self.lock """
+        img_arr = self.entries.get(key)
+        if img_arr is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return img_arr
+
+    def put(self, key, img_arr):
+        size = 0 if isinstance(img_arr, np.memmap) else img_arr.nbytes
+        with self.lock:
+            # Older versions of the same file are never asked for again
+            for old in [k for k in self.entries if k[0] == key[0]]:
+                self.remove(old)
+            self.entries[key] = img_arr
+            self.bytes += size
+            while (self.bytes > self.max_bytes or len(self.entries) > self.max_images) and len(self.entries) > 1:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        img_arr = self.entries.pop(key)
+        if not isinstance(img_arr, np.memmap):
+            self.bytes -= img_arr.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def info(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'images': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'max_images': self.max_images,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+class ServiceMetrics:
+    """ Request counts, errors, latency percentiles and throughput per endpoint """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.recent = deque()  # finish times of requests within RATE_WINDOW
+        self.in_flight = 0
+        self.queries = 0
+
+    def begin(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finish(self, endpoint, seconds, ok, queries=0):
+        now = time.monotonic()
+        with self.lock:
+            self.in_flight -= 1
+            self.queries += queries
+            entry = self.endpoints.setdefault(endpoint, {
+                'requests': 0, 'errors': 0, 'latencies': deque(maxlen=LATENCY_WINDOW)})
+            entry['requests'] += 1
+            if not ok:
+                entry['errors'] += 1
+            entry['latencies'].append(seconds)
+            self.recent.append(now)
+            while self.recent and now - self.recent[0] > RATE_WINDOW:
+                self.recent.popleft()
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            uptime = now - self.start
+            while self.recent and now - self.recent[0] > RATE_WINDOW:
+                self.recent.popleft()
+            total = sum(e['requests'] for e in self.endpoints.values())
+            endpoints = {}
+            for name, entry in self.endpoints.items():
+                latencies = np.array(entry['latencies']) * 1000
+                p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) if len(latencies) else (0.0, 0.0, 0.0)
+                endpoints[name] = {
+                    'requests': entry['requests'],
+                    'errors': entry['errors'],
+                    'latency_ms': {
+                        'mean': float(latencies.mean()) if len(latencies) else 0.0,
+                        'p50': float(p50), 'p95': float(p95), 'p99': float(p99),
+                        'max': float(latencies.max()) if len(latencies) else 0.0,
+                    },
+                }
+            return {
+                'uptime_s': uptime,
+                'requests': total,
+                'queries': self.queries,
+                'in_flight': self.in_flight,
+                'requests_per_s': total / uptime if uptime > 0 else 0.0,
+                'recent_requests_per_s': len(self.recent) / min(RATE_WINDOW, uptime) if uptime > 0 else 0.0,
+                'endpoints': endpoints,
+            }
+
+
+def to_json(value):
+    """ Stats dicts with numpy values -> JSON-serialisable data """
+    if isinstance(value, dict):
+        return {str(k): to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def is_number(value):
+    """ Finite JSON number (booleans are ints in Python, but not numbers here) """
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def is_positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def is_rect(value):
+    return isinstance(value, (list, tuple)) and len(value) == 4 and all(is_number(v) for v in value)
+
+
+def parse_grid_layout(query):
+    """ cell_h, stride_x, stride_y, region and partial of a grid request as WindowGrid arguments """
+    layout = {}
+    for key in ('cell_h', 'stride_x', 'stride_y'):
+        value = query.get(key)
+        if value is not None:
+            if not is_positive_int(value):
+                raise RequestError(400, f"'{key}' must be a positive integer")
+            layout[key] = value
+    region = query.get('region')
+    if region is not None:
+        if not is_rect(region):
+            raise RequestError(400, "'region' must be [x, y, w, h] numbers")
+        layout['region'] = tuple(int(v) for v in region)
+    partial = query.get('partial', False)
+    if not isinstance(partial, bool):
+        raise RequestError(400, "'partial' must be true or false")
+    layout['partial'] = partial
+    return layout
+
+
+def parse_points(value, min_points=1):
+    """ [(x, y), ...] of a JSON list of number pairs, None if it isn't one """
+    if not isinstance(value, list) or len(value) < min_points:
+        return None
+    if not all(isinstance(p, (list, tuple)) and len(p) == 2 and all(is_number(v) for v in p) for p in value):
+        return None
+    return [tuple(p) for p in value]
+
+
+def parse_shape(shape):
+    """ Selection shape of a request (see app.core.masks) with its fields checked """
+    if not isinstance(shape, dict) or shape.get('type') not in SHAPE_TYPES:
+        raise RequestError(400, f"'shape' must be a dict with a 'type' of {', '.join(SHAPE_TYPES)}")
+    kind = shape['type']
+    if kind in ('rect', 'ellipse'):
+        if not is_rect(shape.get('rect')):
+            raise RequestError(400, f"A {kind} shape needs 'rect': [x, y, w, h] numbers")
+        return {'type': kind, 'rect': tuple(shape['rect'])}
+    if kind == 'polygon':
+        points = parse_points(shape.get('points'), 3)
+        if points is None:
+            raise RequestError(400, "A polygon shape needs 'points': at least 3 [x, y] number pairs")
+        return {'type': kind, 'points': points}
+
+    radius = shape.get('radius')
+    strokes = shape.get('strokes')
+    if not is_number(radius) or radius < 0:
+        raise RequestError(400, "A brush shape needs a non-negative 'radius'")
+    if not isinstance(strokes, list) or not strokes:
+        raise RequestError(400, "A brush shape needs 'strokes': lists of [x, y] number pairs")
+    strokes = [parse_points(stroke) for stroke in strokes]
+    if any(stroke is None for stroke in strokes):
+        raise RequestError(400, "A brush shape needs 'strokes': lists of [x, y] number pairs")
+    return {'type': kind, 'strokes': strokes, 'radius': radius}
+
+
+def parse_region(query):
+    """ {'rect': (x, y, w, h)} or {'shape': shape dict} of a request item """
+    if not isinstance(query, dict):
+        raise RequestError(400, "Every selection / ROI must be a JSON object")
+    if query.get('shape') is not None:
+        return {'shape': parse_shape(query['shape'])}
+    rect = query.get('rect')
+    if not is_rect(rect):
+        raise RequestError(400, "'rect' must be [x, y, w, h] numbers")
+    return {'rect': tuple(int(v) for v in rect)}
+
+
+def selection_result(img_arr, query):
+    """ region_stats of one selection; the colour list only on request (it can be huge) """
+    region = roi_pixels(img_arr, parse_region(query))
+    if region is None:
+        return None
+    pixels, rect = region
+    stats = region_stats(pixels)
+    stats['rect'] = rect
+    if not query.get('colors'):
+        del stats['unique_colors'], stats['counts']
+    if not query.get('hist'):
+        del stats['hist'], stats['hist_range']
+    return stats
+
+
+class AnalysisService:
+    """
+    Local HTTP service around the processor functions (JSON in, JSON out).
+
+      GET  /health   {'status': 'ok'}
+      GET  /metrics  request counts, latency percentiles, throughput, cache use
+      POST /stats    {'path', 'rect' | 'shape' | 'selections': [...], 'hist', 'colors'}
+                     full statistics of one selection, or a list for 'selections'
+      POST /rois     {'path', 'rois': [{'name', 'rect' | 'shape'}, ...]}
+                     mean / median / std of many regions in one call
+      POST /grid     {'path', 'cell_size', 'cell_h', 'stride_x', 'stride_y', 'region', 'partial'}
+                     grid cell rows (only cell_size is required, see WindowGrid)
+
+    Decoded images stay in a WarmImageCache, the computation runs on a
+    thread pool so the event loop keeps accepting connections.
+    Connections are kept alive (HTTP/1.1), so a client can send many
+    requests without reconnecting.
+    """
+
+    def __init__(self, workers=None, cache_bytes=WARM_CACHE_BYTES):
+        self.workers = workers or default_workers()
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='analysis')
+        self.cache = WarmImageCache(cache_bytes)
+        self.metrics = ServiceMetrics()
+        self.server = None
+        # Open connections, closed on shutdown so idle keep-alive clients don't hold the loop
+        self.connections = {}  # task -> writer
+        self.routes = {
+            ('GET', '/health'): self.health,
+            ('GET', '/metrics'): self.get_metrics,
+            ('POST', '/stats'): self.stats,
+            ('POST', '/rois'): self.rois,
+            ('POST', '/grid'): self.grid,
+        }
+
+    # --- Endpoints, run on the pool; return (result, number of queries) ---
+
+    def health(self, body):
+        return {'status': 'ok'}, 0
+
+    def get_metrics(self, body):
+        metrics = self.metrics.snapshot()
+        metrics['workers'] = self.workers
+        metrics['cache'] = self.cache.info()
+        return metrics, 0
+
+    def stats(self, body):
+        img_arr = self.cache.get(required(body, 'path'))
+        if 'selections' in body:
+            selections = body['selections']
+            if not isinstance(selections, list):
+                raise RequestError(400, "'selections' must be a list")
+            if not all(isinstance(query, dict) for query in selections):
+                raise RequestError(400, "Every selection must be a JSON object")
+            options = {'hist': body.get('hist'), 'colors': body.get('colors')}
+            return [selection_result(img_arr, dict(options, **query)) for query in selections], len(selections)
+        return selection_result(img_arr, body), 1
+
+    def rois(self, body):
+        rois = required(body, 'rois')
+        if not isinstance(rois, list):
+            raise RequestError(400, "'rois' must be a list")
+        regions = []
+        for i, roi in enumerate(rois):
+            region = parse_region(roi)  # Also rejects items that aren't objects
+            region['name'] = roi.get('name', f"ROI {i + 1}")
+            regions.append(region)
+        img_arr = self.cache.get(required(body, 'path'))
+        return roi_summaries(img_arr, regions), len(regions)
+
+    def grid(self, body):
+        cell_size = required(body, 'cell_size')
+        if not is_positive_int(cell_size):
+            raise RequestError(400, "'cell_size' must be a positive integer")
+        layout = parse_grid_layout(body)
+        img_arr = self.cache.get(required(body, 'path'))
+        # One request is one task of the pool, the grid engine itself stays single-threaded
+        if is_window_layout(cell_size, **layout):
+            columns = WindowGrid(img_arr, cell_size, workers=1, **layout).columns()
+        else:
+            columns = calculate_grid_columns(img_arr, cell_size, workers=1)
+        return columns_to_rows(columns), 1
+
+    # --- HTTP ---
+
+    async def handle_request(self, method, path, body):
+        """ (status, JSON-ready payload) of one request """
+        route = path.split('?', 1)[0]
+        handler = self.routes.get((method, route))
+        if handler is None:
+            if any(r == route for _, r in self.routes):
+                return 405, {'error': f"{method} not allowed on {route}"}, 0
+            return 404, {'error': f"Unknown endpoint: {route}"}, 0
+
+        try:
+            data = json.loads(body) if body else {}
+            if not isinstance(data, dict):
+                raise RequestError(400, "Request body must be a JSON object")
+        except ValueError as e:
+            return 400, {'error': f"Invalid JSON: {e}"}, 0
+
+        loop = asyncio.get_running_loop()
+        try:
+            result, queries = await loop.run_in_executor(self.pool, handler, data)
+            return 200, {'result': to_json(result)}, queries
+        except RequestError as e:
+            return e.status, {'error': str(e)}, 0
+        except Exception as e:
+            print(f"Error handling {route}: {e}")
+            return 500, {'error': str(e)}, 0
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                start = time.perf_counter()
+                self.metrics.begin()
+                status, payload, queries = await self.handle_request(method, path, body)
+                # Unknown paths share one entry, so probing clients can't grow the metrics
+                route = path.split('?', 1)[0]
+                endpoint = route if any(r == route for _, r in self.routes) else 'unknown'
+                self.metrics.finish(endpoint, time.perf_counter() - start, status == 200, queries)
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(http_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except RequestError as e:
+            writer.write(http_response(e.status, {'error': str(e)}, False))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.pop(task, None)
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+        """ Starts listening on host:port, or on a Unix socket if socket_path is given """
+        if socket_path:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    def address(self):
+        """ (host, port) actually bound, e.g. after starting on port 0 """
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, on_started=None, stop=None):
+        """ Serves until stop (an asyncio.Event) is set or the task is cancelled """
+        await self.start(host, port, socket_path)
+        if on_started:
+            on_started(self)
+        try:
+            if stop is None:
+                await self.server.serve_forever()
+            else:
+                await stop.wait()
+        finally:
+            self.server.close()
+            tasks = list(self.connections)
+            for writer in self.connections.values():
+                writer.close()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.server.wait_closed()
+            self.pool.shutdown(wait=False)
+
+
+def required(body, key):
+    if key not in body:
+        raise RequestError(400, f"Missing '{key}'")
+    return body[key]
+
+
+async def read_request(reader):
+    """ (method, path, headers, body) of the next HTTP request, None at end of stream """
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise RequestError(400, "Malformed request line")
+    method, path, _ = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise RequestError(400, "Invalid Content-Length")
+    if length < 0:
+        raise RequestError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise RequestError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), path, headers, body
+
+
+def http_response(status, payload, keep_alive=True):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    head = (
+        f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+        f"Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode('latin-1') + body
+
+
+def run_service(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, cache_bytes=WARM_CACHE_BYTES,
+                socket_path=None):
+    """ Runs the service in the current thread until interrupted """
+    service = AnalysisService(workers, cache_bytes)
+
+    def on_started(service):
+        where = socket_path or "http://%s:%d" % service.address()
+        print(f"Analysis service on {where} ({service.workers} workers, Ctrl+C to stop)", flush=True)
+
+    try:
+        asyncio.run(service.serve(host, port, socket_path, on_started))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_service_thread(host=DEFAULT_HOST, port=0, workers=None, cache_bytes=WARM_CACHE_BYTES):
+    """
+    Runs the service on a daemon thread (port 0 picks a free port), for
+    embedding and tests. Returns (service, stop); stop() shuts it down.
+    """
+    started = threading.Event()
+    state = {}
+
+    def run():
+        async def main():
+            state['loop'] = asyncio.get_running_loop()
+            state['stop'] = asyncio.Event()
+            await service.serve(host, port, on_started=lambda s: started.set(), stop=state['stop'])
+
+        try:
+            asyncio.run(main())
+        except Exception as e:
+            print(f"Error running analysis service: {e}")
+            started.set()
+
+    service = AnalysisService(workers, cache_bytes)
+    thread = threading.Thread(target=run, name='analysis-service', daemon=True)
+    thread.start()
+    started.wait()
+
+    def stop():
+        if 'stop' in state:
+            state['loop'].call_soon_threadsafe(state['stop'].set)
+        thread.join()
+
+    return service, stop
+
+
+def self_check():
+    """
+    Round trip through start_service_thread on a free localhost port: a
+    small test image is sent through every endpoint and the malformed
+    requests must come back as 400. Returns the list of failed checks.
+    """
+    import cv2
+
+    failures = []
+
+    def check(name, ok):
+        if not ok:
+            failures.append(name)
+
+    img = np.zeros((40, 60, 3), dtype=np.uint8)
+    img[:, 30:] = (10, 20, 30)  # RGB
+    fd, image_path = tempfile.mkstemp(suffix='.png')
+    os.close(fd)
+    service, stop = start_service_thread(workers=2)
+    try:
+        cv2.imwrite(image_path, cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+        host, port = service.address()
+        conn = http.client.HTTPConnection(host, port, timeout=10)
+
+        def call(method, path, body=None):
+            conn.request(method, path, json.dumps(body) if body is not None else None,
+                         {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+
+        status, payload = call('GET', '/health')
+        check("health", status == 200 and payload['result'] == {'status': 'ok'})
+
+        status, payload = call('POST', '/stats', {'path': image_path, 'rect': [30, 0, 30, 40]})
+        check("stats", status == 200 and round(payload['result']['r']) == 10 and round(payload['result']['b']) == 30)
+
+        status, payload = call('POST', '/rois', {'path': image_path, 'rois': [{'rect': [0, 0, 30, 40]}]})
+        check("rois", status == 200 and len(payload['result']) == 1)
+
+        status, payload = call('POST', '/grid', {'path': image_path, 'cell_size': 20})
+        check("grid", status == 200 and len(payload['result']) == 6)
+
+        status, payload = call('POST', '/grid', {'path': image_path, 'cell_size': 20, 'cell_h': 10,
+                                                 'stride_x': 10, 'region': [0, 0, 60, 30]})
+        check("grid layout", status == 200 and len(payload['result']) == 15 and payload['result'][0]['h'] == 10)
+
+        status, _ = call('POST', '/grid', {'path': image_path, 'cell_size': True})
+        check("grid: boolean cell_size is 400", status == 400)
+
+        status, _ = call('POST', '/stats', {'path': image_path, 'rect': [0, 0, "x", 10]})
+        check("stats: non-numeric rect is 400", status == 400)
+
+        status, payload = call('POST', '/stats', {'path': image_path,
+                                                  'shape': {'type': 'ellipse', 'rect': [30, 0, 30, 40]}})
+        check("stats: ellipse shape", status == 200 and round(payload['result']['r']) == 10)
+
+        for shape in ({'type': 'polygon'}, {'type': 'ellipse'}, {'type': 'star'},
+                      {'type': 'brush', 'strokes': [[[1, 2]]]}, {'type': 'polygon', 'points': [[0, 0], [1]]}):
+            status, _ = call('POST', '/stats', {'path': image_path, 'shape': shape})
+            check(f"stats: shape {shape} is 400", status == 400)
+
+        status, _ = call('POST', '/stats', {'path': image_path, 'selections': [[0, 0, 10, 10]]})
+        check("stats: non-object selection is 400", status == 400)
+
+        status, _ = call('POST', '/rois', {'path': image_path, 'rois': ['roi']})
+        check("rois: non-object ROI is 400", status == 400)
+
+        status, _ = call('GET', '/metrics')
+        check("metrics", status == 200)
+        conn.close()
+
+        for length in ('abc', '-1'):
+            with socket.create_connection((host, port), timeout=10) as sock:
+                sock.sendall(f"POST /stats HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode('latin-1'))
+                reply = sock.recv(4096).split(b' ', 2)
+                check(f"Content-Length {length} is 400", len(reply) > 1 and reply[1] == b'400')
+    except Exception as e:
+        failures.append(f"error: {e}")
+    finally:
+        stop()
+        os.remove(image_path)
+    return failures
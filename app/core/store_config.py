@@ -0,0 +1,42 @@
+import os
+import sys
+
+# Optional store of decoded RGB arrays.
+# The first time an image is requested its decoded array is written to a .npy
+# file in the cache directory; later calls (and other processes) memory-map it
+# instead of decoding the source file again.
+# The oldest used arrays are removed once the store grows over budget_bytes.
+_store_settings = {
+    'enabled': False,
+    'cache_dir': None,
+    'budget_bytes': 8 * 1024 ** 3,
+}
+
+
+def default_cache_dir():
+    """ Per-user cache directory for decoded images """
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'rgb_tool', 'decoded')
+
+
+def set_store_enabled(enabled, cache_dir=None, budget_bytes=None):
+    _store_settings['enabled'] = bool(enabled)
+    if cache_dir:
+        _store_settings['cache_dir'] = cache_dir
+    if budget_bytes:
+        _store_settings['budget_bytes'] = int(budget_bytes)
+
+
+def is_store_enabled():
+    return _store_settings['enabled']
+
+
+def get_cache_dir():
+    return _store_settings['cache_dir'] or default_cache_dir()
+
+
+def get_store_budget():
+    return _store_settings['budget_bytes']
@@ -0,0 +1,251 @@
+import hashlib
+import os
+import re
+import queue
+import threading
+import numpy as np
+import cv2
+
+from app.core.image_store import decode_image, to_rgb
+from app.core.store_config import default_cache_dir
+from app.core.grid_engine import grid_moments
+from app.core.masks import rasterize_shape
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.wmv', '.mpg', '.mpeg')
+
+# Decoded frames waiting for the stats consumer; bounds the memory use
+QUEUE_FRAMES = 8
+
+# Per-frame values recorded for every region
+SERIES_METRICS = ('avg_r', 'avg_g', 'avg_b', 'std_r', 'std_g', 'std_b', 'norm_r', 'norm_b')
+
+# Numbered frame files: prefix, frame number, extension
+SEQUENCE_PATTERN = re.compile(r'^(.*?)(\d+)(\.[^.]+)$')
+
+
+def is_video(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def sequence_paths(image_path):
+    """
+    All files of the numbered sequence the image belongs to (frame_0001.png,
+    frame_0002.png, ...), sorted by frame number. [] if the name has no number.
+    """
+    folder, name = os.path.split(os.path.abspath(image_path))
+    match = SEQUENCE_PATTERN.match(name)
+    if not match:
+        return []
+    prefix, _, ext = match.groups()
+
+    frames = []
+    for other in os.listdir(folder):
+        m = SEQUENCE_PATTERN.match(other)
+        if m and m.group(1) == prefix and m.group(3).lower() == ext.lower():
+            frames.append((int(m.group(2)), os.path.join(folder, other)))
+    return [path for _, path in sorted(frames)]
+
+
+def video_info(video_path):
+    """ (frame count, fps) of a video file, None if OpenCV can't open it """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return None
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), float(cap.get(cv2.CAP_PROP_FPS)) or None
+    finally:
+        cap.release()
+
+
+def video_frames(video_path, step=1):
+    """
+    Yields (frame index, RGB array) of every step-th frame.
+    Skipped frames are only grabbed, not decoded.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video: {video_path}")
+    try:
+        index = 0
+        while True:
+            if index % step:
+                if not cap.grab():
+                    break
+            else:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield index, to_rgb(frame, bgr=True)
+            index += 1
+    finally:
+        cap.release()
+
+
+def sequence_frames(paths, step=1):
+    """ Yields (frame index, RGB array) of every step-th file of an image sequence """
+    for index in range(0, len(paths), step):
+        yield index, decode_image(paths[index])
+
+
+def preview_frame_path(video_path):
+    """
+    First frame of a video saved as PNG in the cache directory, so it can be
+    opened like an image to place regions. None if the video can't be read.
+    """
+    folder = os.path.join(os.path.dirname(default_cache_dir()), 'frames')
+    os.makedirs(folder, exist_ok=True)
+    st = os.stat(video_path)
+    key = f"{os.path.abspath(video_path)}|{st.st_size}|{st.st_mtime_ns}"
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:10]
+    path = os.path.join(folder, f"{os.path.basename(video_path)}.{digest}.png")
+    if os.path.exists(path):
+        return path
+
+    for _, frame in video_frames(video_path):
+        cv2.imwrite(path, np.ascontiguousarray(frame[:, :, ::-1]))
+        return path
+    return None
+
+
+def produce_frames(frames, frame_queue, stop):
+    """ Producer: decodes frames into the bounded queue, ends with None (or an exception) """
+    try:
+        for item in frames:
+            while not stop.is_set():
+                try:
+                    frame_queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+    except Exception as e:
+        frame_queue.put(e)
+        return
+    frame_queue.put(None)
+
+
+def roi_rasters(rois, img_w, img_h):
+    """ [(name, bounding rect, x1, y1, mask or None for rectangles)] of the regions inside the frame """
+    rasters = []
+    for roi in rois:
+        shape = roi.get('shape') or {'type': 'rect', 'rect': roi['rect']}
+        raster = rasterize_shape(shape, img_w, img_h)
+        if raster is None:
+            continue
+        x1, y1, mask = raster
+        mh, mw = mask.shape
+        rasters.append((roi['name'], (x1, y1, mw, mh), x1, y1, None if shape['type'] == 'rect' else mask))
+    return rasters
+
+
+def region_moments(frame, x1, y1, w, h, mask=None):
+    """ Per-channel mean and std of a frame region (cv2.meanStdDev, any sample type) """
+    crop = np.ascontiguousarray(frame[y1:y1 + h, x1:x1 + w])
+    if mask is not None:
+        mean, std = cv2.meanStdDev(crop, mask=mask.astype(np.uint8))
+    else:
+        mean, std = cv2.meanStdDev(crop)
+    return mean.ravel(), std.ravel()
+
+
+def analyze_frames(frames, rois, cell_size=None, total=None, progress=None, cancel=None):
+    """
+    Streams frames through the region / grid statistics.
+    A producer thread decodes frames into a bounded queue while this thread
+    computes the stats, so decoding and computing overlap and at most
+    QUEUE_FRAMES decoded frames are held in memory.
+    frames: iterator of (frame index, RGB array); rois: like calculate_roi_stats.
+    cell_size: also record per-cell means of the grid for every frame.
+    progress(done, total) is called after every frame; cancel is a
+    threading.Event that stops the run (the partial series is returned).
+    Returns {'frames': indices, 'rois': [{'name', 'rect', 'series': {metric: array}}],
+    'grid': (frames, rows, cols, 3) float32 cell means or None}.
+    """
+    frame_queue = queue.Queue(maxsize=QUEUE_FRAMES)
+    stop = threading.Event()
+    producer = threading.Thread(target=produce_frames, args=(frames, frame_queue, stop), daemon=True)
+    producer.start()
+
+    indices = []
+    rasters = None
+    series = None
+    grid = []
+    try:
+        while True:
+            item = frame_queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if cancel is not None and cancel.is_set():
+                break
+
+            index, frame = item
+            if rasters is None:
+                rasters = roi_rasters(rois, frame.shape[1], frame.shape[0])
+                series = [{m: [] for m in SERIES_METRICS} for _ in rasters]
+
+            for (name, rect, x1, y1, mask), values in zip(rasters, series):
+                mean, std = region_moments(frame, x1, y1, rect[2], rect[3], mask)
+                for i, c in enumerate('rgb'):
+                    values[f'avg_{c}'].append(mean[i])
+                    values[f'std_{c}'].append(std[i])
+                g = mean[1]
+                values['norm_r'].append(mean[0] / g if g != 0 else 0.0)
+                values['norm_b'].append(mean[2] / g if g != 0 else 0.0)
+
+            if cell_size:
+                sums, _ = grid_moments(frame, cell_size, workers=1)
+                grid.append((sums / float(cell_size * cell_size)).astype(np.float32))
+
+            indices.append(index)
+            if progress:
+                progress(len(indices), total)
+    finally:
+        stop.set()
+        # Unblock the producer if it waits on a full queue
+        while producer.is_alive():
+            try:
+                frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    return {
+        'frames': np.array(indices, dtype=np.int64),
+        'rois': [{'name': r[0], 'rect': r[1], 'series': {m: np.array(v[m], dtype=np.float64) for m in SERIES_METRICS}}
+                 for r, v in zip(rasters or [], series or [])],
+        'grid': np.stack(grid) if grid else None,
+    }
+
+
+def calculate_frame_series(source, rois, cell_size=None, step=1, progress=None, cancel=None):
+    """
+    Per-frame statistics of a video file or a list of image files (a sequence).
+    Adds 'times' (seconds for videos, frame numbers for sequences), 'fps',
+    'source' and 'cell_size' to the analyze_frames result. None on error.
+    """
+    step = max(1, int(step))
+    try:
+        if isinstance(source, str):
+            info = video_info(source)
+            if info is None:
+                raise ValueError(f"Cannot open video: {source}")
+            count, fps = info
+            frames = video_frames(source, step)
+            total = -(-count // step) if count > 0 else None
+        else:
+            fps = None
+            frames = sequence_frames(source, step)
+            total = -(-len(source) // step)
+
+        result = analyze_frames(frames, rois, cell_size, total, progress, cancel)
+        result['times'] = result['frames'] / fps if fps else result['frames'].astype(np.float64)
+        result['fps'] = fps
+        result['source'] = source
+        result['cell_size'] = cell_size
+        return result
+
+    except Exception as e:
+        print(f"Error analysing frames: {e}")
+        return None
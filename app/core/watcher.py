@@ -0,0 +1,265 @@
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.processor import calculate_roi_stats, calculate_grid_stats
+from app.core.grid_engine import default_workers
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+# A new file is analysed once its size and mtime stayed the same this long
+SETTLE_SECONDS = 2.0
+POLL_INTERVAL = 1.0
+# The directory is listed again when its mtime changes, and at least every
+# this many polls (some network file systems don't update directory mtimes)
+FULL_SCAN_POLLS = 30
+
+WATCH_ROI_HEADERS = ["Изображение", "Область", "X", "Y", "W", "H", "Среднее R", "Среднее G", "Среднее B",
+                     "Norm R (G=1)", "Norm B (G=1)", "Медиана R", "Медиана G", "Медиана B",
+                     "Стд.Откл R", "Стд.Откл G", "Стд.Откл B"]
+WATCH_GRID_HEADERS = ["Изображение", "X", "Y", "W", "H", "Среднее R", "Среднее G", "Среднее B",
+                      "Norm R (G=1)", "Norm B (G=1)", "Стд.Откл R", "Стд.Откл G", "Стд.Откл B"]
+
+
+class FolderWatcher:
+    """
+    Finds new image files in a directory by polling.
+    A file is reported once, after its size and mtime have not changed for
+    settle seconds and it can be opened, so files still being written by a
+    capture station are not picked up half way. Files are identified by
+    name, size and mtime, so a new file under a reused name is reported.
+    known: (file name, size, mtime_ns) of files that count as already processed.
+    include_existing: also report files present when the watcher starts.
+    """
+
+    def __init__(self, folder, settle=SETTLE_SECONDS, include_existing=False, known=(),
+                 extensions=IMAGE_EXTENSIONS):
+        self.folder = os.path.abspath(folder)
+        self.settle = settle
+        self.extensions = extensions
+        self.known = set(known)
+        self.seen = {}  # path -> (size, mtime_ns) when it was reported or skipped
+        self.pending = {}  # path -> (size, mtime_ns, time the state was first seen)
+        self.dir_mtime = None
+        self.polls = 0
+        if not include_existing:
+            self.seen.update(self.list_files())
+
+    def list_files(self):
+        """ {path: (size, mtime_ns)} of the image files in the folder """
+        files = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(self.extensions):
+                    continue
+                try:
+                    if entry.is_file():
+                        st = entry.stat()
+                        files[entry.path] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+        return files
+
+    def poll(self, now=None):
+        """ New files that are complete, in name order """
+        now = time.monotonic() if now is None else now
+        self.polls += 1
+
+        dir_mtime = os.stat(self.folder).st_mtime_ns
+        if dir_mtime != self.dir_mtime or self.polls % FULL_SCAN_POLLS == 0:
+            self.dir_mtime = dir_mtime
+            for path, state in self.list_files().items():
+                if self.seen.get(path) == state or path in self.pending:
+                    continue
+                if file_identity(path, state) in self.known:
+                    self.seen[path] = state
+                    continue
+                self.pending[path] = state + (now,)
+
+        ready = []
+        for path, (size, mtime, since) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Deleted or renamed before it settled
+                del self.pending[path]
+                continue
+
+            if (st.st_size, st.st_mtime_ns) != (size, mtime):
+                self.pending[path] = (st.st_size, st.st_mtime_ns, now)
+            elif st.st_size > 0 and now - since >= self.settle and is_readable(path):
+                del self.pending[path]
+                self.seen[path] = (size, mtime)
+                ready.append(path)
+        return sorted(ready)
+
+
+def file_identity(path, state):
+    """ (file name, size, mtime_ns) a file is recognised by across runs """
+    return (os.path.basename(path),) + tuple(state)
+
+
+def is_readable(path):
+    """ False while another process holds the file locked (Windows writers) """
+    try:
+        with open(path, 'rb') as f:
+            f.read(1)
+        return True
+    except OSError:
+        return False
+
+
+def analyze_file(image_path, rois, cell_size=None, layout=None):
+    """
+    ROI stats and optional grid stats of one new file.
+    layout: cell_h, stride_x, stride_y, region and partial of the grid as
+    keyword arguments of calculate_grid_stats (default: square cells).
+    """
+    st = os.stat(image_path)
+    return {
+        'path': image_path,
+        'file_size': st.st_size,
+        'mtime': st.st_mtime_ns,
+        'rois': calculate_roi_stats(image_path, rois) if rois else [],
+        'grid': calculate_grid_stats(image_path, cell_size, workers=1, **(layout or {})) if cell_size else [],
+    }
+
+
+def roi_rows(result):
+    """ Rows in WATCH_ROI_HEADERS order (same layout as the ROI export) """
+    name = os.path.basename(result['path'])
+    rows = []
+    for res in result['rois']:
+        g = res['g']
+        x, y, w, h = res['rect']
+        rows.append([
+            name, res['name'], x, y, w, h,
+            res['r'], res['g'], res['b'],
+            res['r'] / g if g != 0 else 0, res['b'] / g if g != 0 else 0,
+            res['median_r'], res['median_g'], res['median_b'],
+            res['std_r'], res['std_g'], res['std_b'],
+        ])
+    return rows
+
+
+def grid_rows(result):
+    """ Rows in WATCH_GRID_HEADERS order """
+    name = os.path.basename(result['path'])
+    rows = []
+    for cell in result['grid']:
+        g = cell['avg_g']
+        rows.append([
+            name, cell['x'], cell['y'], cell['w'], cell['h'], cell['avg_r'], cell['avg_g'], cell['avg_b'],
+            cell['avg_r'] / g if g != 0 else 0, cell['avg_b'] / g if g != 0 else 0,
+            cell['std_r'], cell['std_g'], cell['std_b'],
+        ])
+    return rows
+
+
+class ResultAppender:
+    """
+    Running CSV export of watch results (';' separated, decimal commas, like
+    the ROI export). Rows are appended and flushed per file, so the export
+    can be opened while the watch is running. Grid rows go to <name>_grid.csv,
+    the name, size and mtime of every analysed file to <name>_files.txt.
+    """
+
+    def __init__(self, output_path):
+        self.roi_path = output_path
+        self.grid_path = os.path.splitext(output_path)[0] + "_grid.csv"
+        self.files_path = os.path.splitext(output_path)[0] + "_files.txt"
+
+    def done_files(self):
+        """ (file name, size, mtime_ns) of the files already in the export, they are not analysed again """
+        done = set()
+        if not os.path.exists(self.files_path):
+            return done
+        with open(self.files_path, encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').rsplit('\t', 2)
+                if len(parts) == 3 and parts[1].isdigit() and parts[2].isdigit():
+                    done.add((parts[0], int(parts[1]), int(parts[2])))
+        return done
+
+    def append(self, result):
+        self.write(self.roi_path, WATCH_ROI_HEADERS, roi_rows(result), 6)
+        self.write(self.grid_path, WATCH_GRID_HEADERS, grid_rows(result), 5)
+        name, size, mtime = file_identity(result['path'], (result['file_size'], result['mtime']))
+        with open(self.files_path, 'a', encoding='utf-8') as f:
+            f.write(f"{name}\t{size}\t{mtime}\n")
+
+    def write(self, path, headers, rows, text_columns):
+        if not rows:
+            return
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, 'a', newline='', encoding='utf-8-sig' if new_file else 'utf-8') as f:
+            writer = csv.writer(f, delimiter=';')
+            if new_file:
+                writer.writerow(headers)
+            for row in rows:
+                writer.writerow(row[:text_columns] + [f"{v:.2f}".replace('.', ',') for v in row[text_columns:]])
+
+
+def load_watch_config(config_path):
+    """ {'rois': [...], 'cell_size': int or None, 'layout': {...}} from a JSON file saved by the GUI """
+    with open(config_path, encoding='utf-8') as f:
+        config = json.load(f)
+    rois = []
+    for roi in config.get('rois', []):
+        roi = dict(roi)
+        if roi.get('rect') is not None:
+            roi['rect'] = tuple(roi['rect'])
+        rois.append(roi)
+    layout = dict(config.get('grid_layout') or {})
+    if layout.get('region') is not None:
+        layout['region'] = tuple(layout['region'])
+    return {'rois': rois, 'cell_size': config.get('cell_size'), 'layout': layout}
+
+
+def save_watch_config(config_path, rois, cell_size=None, layout=None):
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({'rois': rois, 'cell_size': cell_size, 'grid_layout': layout or {}}, f, ensure_ascii=False, indent=2)
+
+
+def run_watch(folder, rois, cell_size=None, output_path=None, interval=POLL_INTERVAL, workers=None,
+              settle=SETTLE_SECONDS, include_existing=False, on_result=None, stop=None, layout=None):
+    """
+    Headless watch loop: analyses every new file of the folder on a thread
+    pool and appends the rows to output_path (default: watch_results.csv in
+    the folder). Files already in the export are skipped. Runs until stop
+    (a threading.Event) is set or the process is interrupted.
+    layout: grid layout of analyze_file.
+    """
+    output_path = output_path or os.path.join(folder, "watch_results.csv")
+    appender = ResultAppender(output_path)
+    watcher = FolderWatcher(folder, settle, include_existing, known=appender.done_files())
+    stop = stop or threading.Event()
+
+    def collect(futures):
+        for future in futures:
+            path = running.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error analysing {path}: {e}")
+                continue
+            appender.append(result)
+            if on_result:
+                on_result(result)
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers or default_workers()) as pool:
+        try:
+            while not stop.is_set():
+                for path in watcher.poll():
+                    running[pool.submit(analyze_file, path, rois, cell_size, layout)] = path
+                collect([f for f in running if f.done()])
+                stop.wait(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Files already submitted are finished and written
+            collect(list(running))
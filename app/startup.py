@@ -0,0 +1,164 @@
+import builtins
+import importlib.util
+import sys
+import threading
+import time
+
+# Time from process start until the main window is on screen
+STARTUP_BUDGET_MS = 1500
+
+# Heavy modules loaded on a background thread once the window is shown,
+# so the first analysis does not pay for the imports
+WARM_UP_MODULES = (
+    'numpy',
+    'cv2',
+    'PIL.Image',
+    'app.core.image_store',
+    'app.core.processor',
+    'app.core.colorimetry',
+    'app.core.compare',
+    'app.core.registration',
+    'app.core.image_profile',
+    'app.core.local_stats',
+    'app.core.palette',
+    'app.core.sampling',
+    'xlsxwriter',
+)
+
+# Modules only imported by name (LazyModule, warm-up, function-level
+# imports), PyInstaller's analysis can't see them: pass each one as
+# --hidden-import (or list them in hiddenimports of a .spec file)
+HIDDEN_IMPORTS = WARM_UP_MODULES + (
+    'app.core.catalog',
+    'app.core.colormap',
+    'app.core.display_modes',
+    'app.core.grid_engine',
+    'app.core.masks',
+    'app.core.service',
+    'app.core.video',
+    'app.core.watcher',
+)
+
+
+class LazyModule:
+    """
+    Module placeholder that imports the real module on first attribute access.
+    Imports go through the interpreter's import lock, so the warm-up thread
+    and the UI thread can race for the same module safely.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def load(self):
+        if self.module is None:
+            __import__(self.name)
+            self.module = sys.modules[self.name]
+        return self.module
+
+    def __getattr__(self, attr):
+        # Only called for attributes missing on the placeholder itself
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.module is not None else 'not loaded'
+        return f"<lazy module '{self.name}' ({state})>"
+
+
+class ImportTimer:
+    """
+    Measures the time spent importing every module while installed
+    (like python -X importtime, but inside the running application).
+    """
+
+    def __init__(self):
+        self.times = {}
+        # Per-thread stack of nested import times
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.original_import = None
+        # Time of the outermost imports, i.e. the real cost
+        self.root_time = 0.0
+
+    def install(self):
+        if self.original_import is None:
+            self.original_import = builtins.__import__
+            builtins.__import__ = self.timed_import
+
+    def uninstall(self):
+        if self.original_import is not None:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self.original_import or builtins.__import__
+        if level:
+            package = (globals or {}).get('__package__') or ''
+            try:
+                full_name = importlib.util.resolve_name('.' * level + name, package)
+            except (ImportError, ValueError):
+                full_name = name
+        else:
+            full_name = name
+
+        # Only first imports are timed, nested imports are subtracted from
+        # the self time of their parent
+        if full_name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            total = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += total
+            with self.lock:
+                if not stack:
+                    self.root_time += total
+                if full_name not in self.times:
+                    self.times[full_name] = (total - nested, total)
+
+    def report(self, limit=20):
+        """ Text table of the slowest imports by self time """
+        rows = sorted(self.times.items(), key=lambda item: -item[1][0])[:limit]
+        lines = [f"{'self, ms':>10} {'total, ms':>10}  module"]
+        for name, (self_time, total) in rows:
+            lines.append(f"{self_time * 1000:10.1f} {total * 1000:10.1f}  {name}")
+        lines.append(f"Imported {len(self.times)} modules in {self.root_time * 1000:.0f} ms")
+        return "\n".join(lines)
+
+
+def warm_up(modules=WARM_UP_MODULES, on_done=None):
+    """
+    Imports the heavy modules on a daemon thread.
+    Missing optional modules (e.g. xlsxwriter) are skipped.
+    on_done(seconds) is called on that thread when finished.
+    """
+    def run():
+        start = time.perf_counter()
+        for name in modules:
+            try:
+                __import__(name)
+            except ImportError:
+                pass
+            except Exception as e:
+                print(f"Error warming up {name}: {e}")
+        if on_done:
+            on_done(time.perf_counter() - start)
+
+    thread = threading.Thread(target=run, name='import-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def check_startup_budget(start, budget_ms=STARTUP_BUDGET_MS):
+    """ Elapsed startup time in ms since start (perf_counter), warns when over budget """
+    elapsed = (time.perf_counter() - start) * 1000
+    if elapsed > budget_ms:
+        print(f"Startup took {elapsed:.0f} ms, over the {budget_ms} ms budget")
+    return elapsed
@@ -1,17 +1,72 @@
 import sys
 import csv
 import os
+import threading
+import time
+from math import gcd
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
                              QSplitter, QGroupBox, QLabel, QTableWidget, QTableWidgetItem, 
                              QHeaderView, QFileDialog, QMessageBox, QApplication, QListWidget, QSlider,
-                             QCheckBox, QSpinBox, QTabWidget)
+                             QCheckBox, QSpinBox, QTabWidget, QLineEdit, QComboBox, QColorDialog)
 from PyQt6.QtGui import QAction, QColor, QIcon
-from PyQt6.QtCore import Qt, QSettings
+from PyQt6.QtCore import Qt, QSettings, QTimer
 
 from app.ui.styles import DARK_STYLESHEET
-from app.ui.widgets import HistogramWidget, LineProfileWidget
-from app.ui.viewer import ImageViewer
-from app.core.processor import calculate_image_stats, calculate_line_profile, calculate_grid_stats, create_annotated_image
+from app.ui.widgets import HistogramWidget, LineProfileWidget, TimeSeriesWidget
+from app.ui.viewer import ImageViewer, MASK_TOOLS
+from app.ui.workers import start_worker
+from app.core.store_config import set_store_enabled
+from app.core.result_cache import get_result_cache
+from app.startup import LazyModule
+
+# NumPy, OpenCV and the compute modules are imported on first use (or by the
+# warm-up thread in main.py), so only Qt is needed to show the window
+np = LazyModule('numpy')
+processor = LazyModule('app.core.processor')
+masks = LazyModule('app.core.masks')
+compare = LazyModule('app.core.compare')
+colorimetry = LazyModule('app.core.colorimetry')
+registration = LazyModule('app.core.registration')
+image_profile = LazyModule('app.core.image_profile')
+local_stats = LazyModule('app.core.local_stats')
+colormap = LazyModule('app.core.colormap')
+palette = LazyModule('app.core.palette')
+image_store = LazyModule('app.core.image_store')
+video = LazyModule('app.core.video')
+watcher = LazyModule('app.core.watcher')
+catalog = LazyModule('app.core.catalog')
+grid_engine = LazyModule('app.core.grid_engine')
+
+# Selections larger than this show sampled stats first, then the exact ones
+APPROX_PIXELS = 16 * 1024 * 1024
+
+# The grid heatmap is rebuilt this long after the last layout change
+HEATMAP_DELAY_MS = 200
+
+ROI_HEADERS = ["Изображение", "Область", "X", "Y", "W", "H", "Среднее R", "Среднее G", "Среднее B", "Norm R (G=1)", "Norm B (G=1)",
+               "Медиана R", "Медиана G", "Медиана B", "Стд.Откл R", "Стд.Откл G", "Стд.Откл B"]
+
+# Catalog values the image list can be sorted and filtered by (see app.core.catalog)
+CATALOG_FIELDS = {
+    'mean_r': "Среднее R", 'mean_g': "Среднее G", 'mean_b': "Среднее B", 'brightness': "Яркость",
+    'norm_r': "Norm R (G=1)", 'norm_b': "Norm B (G=1)",
+    'std_r': "Стд.Откл R", 'std_g': "Стд.Откл G", 'std_b': "Стд.Откл B",
+    'width': "Ширина", 'height': "Высота", 'file_size': "Размер файла", 'mtime': "Дата изменения",
+}
+
+# Viewer display modes (see app.core.display_modes)
+DISPLAY_MODE_LABELS = {
+    'rgb': "RGB", 'r': "Канал R", 'g': "Канал G", 'b': "Канал B",
+    'h': "HSV: H", 's': "HSV: S", 'v': "HSV: V",
+    'l': "LAB: L", 'lab_a': "LAB: a", 'lab_b': "LAB: b",
+    'rg': "R/G (ложные цвета)", 'bg': "B/G (ложные цвета)",
+}
+
+GRID_HEADERS = ["X", "Y", "W", "H", "Среднее R", "Среднее G", "Среднее B", "Norm R (G=1)", "Norm B (G=1)", "Стд.Откл R", "Стд.Откл G", "Стд.Откл B"]
+# Keys of the base grid columns, the percentile / HSV / LAB columns follow them
+GRID_BASE_KEYS = ('x', 'y', 'w', 'h', 'avg_r', 'avg_g', 'avg_b', 'std_r', 'std_g', 'std_b')
+GRID_CHANNEL_LABELS = {'r': "R", 'g': "G", 'b': "B", 'h': "H", 's': "S", 'v': "V",
+                       'lab_l': "L*", 'lab_a': "a*", 'lab_b': "b*"}
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -22,9 +77,37 @@ class MainWindow(QMainWindow):
         
         self.settings = QSettings("RGBTools", "RGBAnalyzer")
         self.last_dir = self.settings.value("last_dir", "")
+        # Size limit of the decoded store, GB (no UI, set in the settings file)
+        set_store_enabled(self.settings.value("decoded_store", False, type=bool),
+                          budget_bytes=self.settings.value("decoded_store_gb", 8, type=int) * 1024 ** 3)
+        self.result_cache = get_result_cache()
+        # Stays off if the cache could not be opened
+        self.result_cache.enabled = self.result_cache.enabled and self.settings.value("result_cache", True, type=bool)
         self.current_stats = None
         self.image_paths = []
+        # image_paths in the order they were loaded, the list may be sorted
+        self.load_order = []
         self.current_image_index = -1
+        self.catalog_values = {}
+        self.catalog_worker = None
+        self.catalog_cancel = None # Event of the running catalog update
+        self.catalog_pending = False
+        self.similar_reference = None
+        self.similar_distances = {}
+        self.grid_pyramid = None
+        self.grid_pyramid_path = None
+        self.window_grid = None # (image path, layout key, WindowGrid)
+        self.pixel_waiters = {} # callback -> image path, run once the viewer has decoded the image
+        self.heatmap_worker = None
+        self.heatmap_pending = False
+        # Spinbox ticks come in bursts, the heatmap follows the last one
+        self.heatmap_timer = QTimer(self)
+        self.heatmap_timer.setSingleShot(True)
+        self.heatmap_timer.setInterval(HEATMAP_DELAY_MS)
+        self.heatmap_timer.timeout.connect(self.refresh_grid_heatmap)
+        self.grid_region = None # Selection the grid is limited to
+        self.stats_worker = None
+        self.stats_cancel = None # Event of the running stats job
         
         self.setAcceptDrops(True)
 
@@ -54,6 +137,30 @@ class MainWindow(QMainWindow):
         export_action.triggered.connect(self.export_csv)
         file_menu.addAction(export_action)
 
+        settings_menu = menubar.addMenu("Настройки")
+
+        self.store_action = QAction("Кэш декодированных изображений (.npy)", self)
+        self.store_action.setCheckable(True)
+        self.store_action.setChecked(self.settings.value("decoded_store", False, type=bool))
+        self.store_action.toggled.connect(self.toggle_decoded_store)
+        settings_menu.addAction(self.store_action)
+
+        clear_store_action = QAction("Очистить кэш изображений", self)
+        clear_store_action.triggered.connect(self.clear_decoded_store)
+        settings_menu.addAction(clear_store_action)
+
+        settings_menu.addSeparator()
+
+        self.cache_action = QAction("Кэш результатов расчёта", self)
+        self.cache_action.setCheckable(True)
+        self.cache_action.setChecked(self.result_cache.enabled)
+        self.cache_action.toggled.connect(self.toggle_result_cache)
+        settings_menu.addAction(self.cache_action)
+
+        clear_cache_action = QAction("Очистить кэш результатов", self)
+        clear_cache_action.triggered.connect(self.clear_result_cache)
+        settings_menu.addAction(clear_cache_action)
+
         # Main layout
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -93,6 +200,46 @@ class MainWindow(QMainWindow):
         self.btn_tool_line.setCheckable(True)
         self.btn_tool_line.clicked.connect(lambda: self.set_tool('line'))
         controls_layout.addWidget(self.btn_tool_line)
+
+        self.btn_tool_polygon = QPushButton("⬠ Полигон")
+        self.btn_tool_polygon.setCheckable(True)
+        self.btn_tool_polygon.setToolTip("Щелчки добавляют вершины, двойной щелчок или правая кнопка завершает")
+        self.btn_tool_polygon.clicked.connect(lambda: self.set_tool('polygon'))
+        controls_layout.addWidget(self.btn_tool_polygon)
+
+        self.btn_tool_ellipse = QPushButton("⬭ Эллипс")
+        self.btn_tool_ellipse.setCheckable(True)
+        self.btn_tool_ellipse.clicked.connect(lambda: self.set_tool('ellipse'))
+        controls_layout.addWidget(self.btn_tool_ellipse)
+
+        self.btn_tool_brush = QPushButton("🖌 Кисть")
+        self.btn_tool_brush.setCheckable(True)
+        self.btn_tool_brush.setToolTip("Мазки добавляются к маске, правая кнопка очищает маску")
+        self.btn_tool_brush.clicked.connect(lambda: self.set_tool('brush'))
+        controls_layout.addWidget(self.btn_tool_brush)
+
+        self.sb_brush_radius = QSpinBox()
+        self.sb_brush_radius.setRange(1, 500)
+        self.sb_brush_radius.setValue(10)
+        self.sb_brush_radius.setToolTip("Радиус кисти (пикс.)")
+        self.sb_brush_radius.valueChanged.connect(self.change_brush_radius)
+        controls_layout.addWidget(self.sb_brush_radius)
+
+        controls_layout.addSpacing(20)
+        controls_layout.addWidget(QLabel("Пипетка:"))
+        self.sb_inspector_size = QSpinBox()
+        self.sb_inspector_size.setRange(1, 101)
+        self.sb_inspector_size.setSingleStep(2)
+        self.sb_inspector_size.setValue(5)
+        self.sb_inspector_size.setToolTip("Окно усреднения N x N под курсором (пикс.)")
+        controls_layout.addWidget(self.sb_inspector_size)
+
+        controls_layout.addWidget(QLabel("Вид:"))
+        self.cb_display_mode = QComboBox()
+        for mode, label in DISPLAY_MODE_LABELS.items():
+            self.cb_display_mode.addItem(label, mode)
+        self.cb_display_mode.setToolTip("Показ отдельного канала или карты отношения в ложных цветах (на расчёты не влияет)")
+        controls_layout.addWidget(self.cb_display_mode)
         
         main_layout.addLayout(controls_layout)
 
@@ -100,16 +247,87 @@ class MainWindow(QMainWindow):
         splitter = QSplitter(Qt.Orientation.Horizontal)
         main_layout.addWidget(splitter)
 
-        # Image List
+        # Image List with catalog sort / filter / similar colour search
+        list_panel = QWidget()
+        list_layout = QVBoxLayout(list_panel)
+        list_layout.setContentsMargins(0, 0, 0, 0)
+
+        sort_layout = QHBoxLayout()
+        self.cb_catalog_sort = QComboBox()
+        self.cb_catalog_sort.addItem("Порядок загрузки", None)
+        self.cb_catalog_sort.addItem("Имя", 'name')
+        self.cb_catalog_sort.addItem("Похожесть цвета", 'similar')
+        for key, label in CATALOG_FIELDS.items():
+            self.cb_catalog_sort.addItem(label, key)
+        self.cb_catalog_sort.setToolTip("Сортировка списка по значениям каталога")
+        self.cb_catalog_sort.currentIndexChanged.connect(self.update_catalog_view)
+        sort_layout.addWidget(self.cb_catalog_sort, 1)
+
+        self.btn_catalog_desc = QPushButton("↓")
+        self.btn_catalog_desc.setCheckable(True)
+        self.btn_catalog_desc.setToolTip("По убыванию")
+        self.btn_catalog_desc.setMaximumWidth(30)
+        self.btn_catalog_desc.toggled.connect(self.update_catalog_view)
+        sort_layout.addWidget(self.btn_catalog_desc)
+        list_layout.addLayout(sort_layout)
+
+        filter_layout = QHBoxLayout()
+        self.cb_catalog_filter = QComboBox()
+        self.cb_catalog_filter.addItem("Без фильтра", None)
+        for key, label in CATALOG_FIELDS.items():
+            if key not in ('mtime', 'file_size'):
+                self.cb_catalog_filter.addItem(label, key)
+        self.cb_catalog_filter.currentIndexChanged.connect(self.update_catalog_view)
+        filter_layout.addWidget(self.cb_catalog_filter, 1)
+
+        self.le_catalog_min = QLineEdit()
+        self.le_catalog_min.setPlaceholderText("от")
+        self.le_catalog_min.setMaximumWidth(50)
+        self.le_catalog_min.editingFinished.connect(self.update_catalog_view)
+        filter_layout.addWidget(self.le_catalog_min)
+
+        self.le_catalog_max = QLineEdit()
+        self.le_catalog_max.setPlaceholderText("до")
+        self.le_catalog_max.setMaximumWidth(50)
+        self.le_catalog_max.editingFinished.connect(self.update_catalog_view)
+        filter_layout.addWidget(self.le_catalog_max)
+        list_layout.addLayout(filter_layout)
+
+        catalog_buttons = QHBoxLayout()
+        btn_index = QPushButton("🗂 Индексировать")
+        btn_index.setToolTip("Средние, разброс и цветовые гистограммы всех изображений списка (только новые и изменённые файлы)")
+        btn_index.clicked.connect(self.update_catalog_view)
+        catalog_buttons.addWidget(btn_index)
+
+        btn_similar = QPushButton("🎨 Похожие")
+        btn_similar.setToolTip("Упорядочить список по сходству цвета с текущим изображением")
+        btn_similar.clicked.connect(self.find_similar_images)
+        catalog_buttons.addWidget(btn_similar)
+        list_layout.addLayout(catalog_buttons)
+
         self.image_list = QListWidget()
         self.image_list.currentRowChanged.connect(self.on_image_selected)
-        splitter.addWidget(self.image_list)
+        list_layout.addWidget(self.image_list, 1)
+
+        self.lbl_catalog = QLabel("")
+        self.lbl_catalog.setWordWrap(True)
+        list_layout.addWidget(self.lbl_catalog)
+        splitter.addWidget(list_panel)
 
         # Viewer
         self.viewer = ImageViewer()
         self.viewer.grid_clicked.connect(self.calculate_stats) 
         self.viewer.item_changed.connect(self.on_item_changed)
         self.viewer.files_dropped.connect(self.load_images)
+        self.viewer.pixel_hovered.connect(self.show_pixel_info)
+        self.viewer.pixels_loaded.connect(self.on_pixels_loaded)
+        self.viewer.set_inspector_size(self.sb_inspector_size.value())
+        self.sb_inspector_size.valueChanged.connect(self.viewer.set_inspector_size)
+        self.cb_display_mode.currentIndexChanged.connect(
+            lambda: self.viewer.set_display_mode(self.cb_display_mode.currentData()))
+        # Hover inspector output
+        self.lbl_pixel = QLabel("")
+        self.statusBar().addWidget(self.lbl_pixel, 1)
         splitter.addWidget(self.viewer)
 
         # Right Panel (Stats + Table)
@@ -137,6 +355,209 @@ class MainWindow(QMainWindow):
         self.lbl_hsv.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
         self.stats_tabs.addTab(self.lbl_hsv, "HSV")
 
+        # LAB / Delta E Tab
+        lab_tab = QWidget()
+        lab_layout = QVBoxLayout(lab_tab)
+
+        lab_controls = QHBoxLayout()
+        self.btn_reference = QPushButton("🎨 Эталон...")
+        self.btn_reference.setToolTip("Эталонный цвет для ΔE")
+        self.btn_reference.clicked.connect(self.choose_reference_color)
+        lab_controls.addWidget(self.btn_reference)
+
+        lab_controls.addWidget(QLabel("Формула:"))
+        self.cb_de_method = QComboBox()
+        self.cb_de_method.addItem("ΔE76", '76')
+        self.cb_de_method.addItem("ΔE2000", '2000')
+        self.cb_de_method.setCurrentIndex(1)
+        self.cb_de_method.currentIndexChanged.connect(self.update_lab_text)
+        lab_controls.addWidget(self.cb_de_method)
+        lab_layout.addLayout(lab_controls)
+
+        self.lbl_lab = QLabel("Данные LAB")
+        self.lbl_lab.setAlignment(Qt.AlignmentFlag.AlignTop)
+        self.lbl_lab.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        lab_layout.addWidget(self.lbl_lab, 1)
+        self.stats_tabs.addTab(lab_tab, "LAB / ΔE")
+
+        # Whole-image profile Tab (computed in the background on load)
+        profile_tab = QWidget()
+        profile_layout = QVBoxLayout(profile_tab)
+        btn_profile_hist = QPushButton("🖼 Гистограмма всего изображения")
+        btn_profile_hist.clicked.connect(self.show_profile_histogram)
+        profile_layout.addWidget(btn_profile_hist)
+
+        self.lbl_profile = QLabel("")
+        self.lbl_profile.setAlignment(Qt.AlignmentFlag.AlignTop)
+        self.lbl_profile.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        profile_layout.addWidget(self.lbl_profile, 1)
+        self.stats_tabs.addTab(profile_tab, "Изображение")
+
+        self.image_profile = None
+        self.profile_worker = None
+
+        self.reference_color = QColor(self.settings.value("reference_color", ""))
+        if not self.reference_color.isValid():
+            self.reference_color = None
+        self.current_overlay_stats = None
+
+        # Multi-ROI Tab
+        roi_tab = QWidget()
+        roi_layout = QVBoxLayout(roi_tab)
+
+        roi_buttons = QHBoxLayout()
+        btn_add_roi = QPushButton("➕ Добавить")
+        btn_add_roi.setToolTip("Добавить текущее выделение как именованную область")
+        btn_add_roi.clicked.connect(self.add_roi)
+        roi_buttons.addWidget(btn_add_roi)
+
+        btn_remove_roi = QPushButton("➖ Удалить")
+        btn_remove_roi.setToolTip("Удалить выбранные на изображении области")
+        btn_remove_roi.clicked.connect(self.remove_rois)
+        roi_buttons.addWidget(btn_remove_roi)
+
+        btn_clear_roi = QPushButton("🗑 Очистить")
+        btn_clear_roi.clicked.connect(self.clear_rois)
+        roi_buttons.addWidget(btn_clear_roi)
+        roi_layout.addLayout(roi_buttons)
+
+        roi_actions = QHBoxLayout()
+        btn_calc_roi = QPushButton("▶ Рассчитать области")
+        btn_calc_roi.clicked.connect(self.calculate_rois)
+        roi_actions.addWidget(btn_calc_roi)
+
+        btn_export_roi = QPushButton("💾 Экспорт (все фото)")
+        btn_export_roi.clicked.connect(self.export_rois)
+        roi_actions.addWidget(btn_export_roi)
+        roi_layout.addLayout(roi_actions)
+
+        self.roi_table = QTableWidget()
+        self.roi_table.setColumnCount(10)
+        self.roi_table.setHorizontalHeaderLabels(["Область", "R", "G", "B", "Norm R", "Norm B", "Ст.R", "Ст.G", "Ст.B", "Лок. карта"])
+        self.roi_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        roi_layout.addWidget(self.roi_table)
+
+        self.stats_tabs.addTab(roi_tab, "Области")
+        self.roi_counter = 0
+
+        # Video / frame sequence Tab: per-frame ROI and grid statistics
+        self.video_tab = QWidget()
+        video_layout = QVBoxLayout(self.video_tab)
+
+        video_buttons = QHBoxLayout()
+        btn_open_video = QPushButton("🎞 Открыть видео...")
+        btn_open_video.clicked.connect(self.open_video)
+        video_buttons.addWidget(btn_open_video)
+
+        self.btn_frame_series = QPushButton("▶ Рассчитать по кадрам")
+        self.btn_frame_series.setToolTip("Области (или выделение) и сетка для каждого кадра видео или нумерованной последовательности")
+        self.btn_frame_series.clicked.connect(self.calculate_frame_series)
+        video_buttons.addWidget(self.btn_frame_series)
+
+        btn_stop_series = QPushButton("⏹ Стоп")
+        btn_stop_series.clicked.connect(self.stop_frame_series)
+        video_buttons.addWidget(btn_stop_series)
+        video_layout.addLayout(video_buttons)
+
+        series_controls = QHBoxLayout()
+        series_controls.addWidget(QLabel("Каждый N-й кадр:"))
+        self.sb_frame_step = QSpinBox()
+        self.sb_frame_step.setRange(1, 1000)
+        self.sb_frame_step.setValue(1)
+        series_controls.addWidget(self.sb_frame_step)
+
+        self.cb_series_grid = QCheckBox("Сетка")
+        self.cb_series_grid.setToolTip("Также средние по ячейкам сетки (размер из группы 'Сетка')")
+        series_controls.addWidget(self.cb_series_grid)
+
+        btn_export_series = QPushButton("💾 Экспорт ряда")
+        btn_export_series.clicked.connect(self.export_frame_series)
+        series_controls.addWidget(btn_export_series)
+        video_layout.addLayout(series_controls)
+
+        plot_controls = QHBoxLayout()
+        self.cb_series_roi = QComboBox()
+        self.cb_series_roi.currentIndexChanged.connect(self.update_series_plot)
+        plot_controls.addWidget(self.cb_series_roi)
+
+        self.cb_series_metric = QComboBox()
+        self.cb_series_metric.addItem("Среднее RGB", ('avg_r', 'avg_g', 'avg_b'))
+        self.cb_series_metric.addItem("Стд.Откл RGB", ('std_r', 'std_g', 'std_b'))
+        self.cb_series_metric.addItem("Norm R, B (G=1)", ('norm_r', 'norm_b'))
+        self.cb_series_metric.currentIndexChanged.connect(self.update_series_plot)
+        plot_controls.addWidget(self.cb_series_metric)
+        video_layout.addLayout(plot_controls)
+
+        self.lbl_video = QLabel("")
+        self.lbl_video.setAlignment(Qt.AlignmentFlag.AlignTop)
+        self.lbl_video.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        video_layout.addWidget(self.lbl_video, 1)
+        self.stats_tabs.addTab(self.video_tab, "Видео")
+
+        # Preview frame path -> video file
+        self.video_sources = {}
+        self.frame_series = None
+        self.series_worker = None
+        self.series_cancel = None
+
+        # Watch Tab: analyses every new image of a folder as it appears
+        watch_tab = QWidget()
+        watch_layout = QVBoxLayout(watch_tab)
+
+        watch_buttons = QHBoxLayout()
+        btn_watch_folder = QPushButton("📂 Папка...")
+        btn_watch_folder.clicked.connect(self.choose_watch_folder)
+        watch_buttons.addWidget(btn_watch_folder)
+
+        btn_watch_output = QPushButton("💾 Файл результатов...")
+        btn_watch_output.setToolTip("CSV, в который дописываются результаты (по умолчанию watch_results.csv в папке)")
+        btn_watch_output.clicked.connect(self.choose_watch_output)
+        watch_buttons.addWidget(btn_watch_output)
+
+        self.cb_watch_grid = QCheckBox("Сетка")
+        self.cb_watch_grid.setToolTip("Также статистика по ячейкам сетки (размер, шаг и область из группы 'Сетка'), в файл *_grid.csv")
+        watch_buttons.addWidget(self.cb_watch_grid)
+        watch_layout.addLayout(watch_buttons)
+
+        watch_controls = QHBoxLayout()
+        self.btn_watch_start = QPushButton("▶ Начать наблюдение")
+        self.btn_watch_start.setToolTip("Области (или выделение) и сетка считаются для каждого нового файла папки")
+        self.btn_watch_start.clicked.connect(self.start_watch)
+        watch_controls.addWidget(self.btn_watch_start)
+
+        btn_watch_stop = QPushButton("⏹ Стоп")
+        btn_watch_stop.clicked.connect(self.stop_watch)
+        watch_controls.addWidget(btn_watch_stop)
+
+        btn_watch_config = QPushButton("💾 Сохранить настройку")
+        btn_watch_config.setToolTip("Области и сетку в JSON для запуска без окна: main.py --watch ПАПКА --config ФАЙЛ")
+        btn_watch_config.clicked.connect(self.save_watch_config)
+        watch_controls.addWidget(btn_watch_config)
+        watch_layout.addLayout(watch_controls)
+
+        self.lbl_watch = QLabel("Папка не выбрана")
+        self.lbl_watch.setWordWrap(True)
+        self.lbl_watch.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        watch_layout.addWidget(self.lbl_watch)
+
+        self.watch_table = QTableWidget()
+        self.watch_table.setColumnCount(7)
+        self.watch_table.setHorizontalHeaderLabels(["Файл", "Область", "R", "G", "B", "Norm R", "Norm B"])
+        self.watch_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        watch_layout.addWidget(self.watch_table, 1)
+        self.stats_tabs.addTab(watch_tab, "Наблюдение")
+
+        self.watch_folder = None
+        self.watch_output = None
+        self.folder_watcher = None
+        self.watch_appender = None
+        self.watch_job = None
+        # Path -> worker of the files being analysed
+        self.watch_workers = {}
+        self.watch_done = 0
+        self.watch_timer = QTimer(self)
+        self.watch_timer.timeout.connect(self.poll_watch_folder)
+
         stats_buttons_layout = QHBoxLayout()
 
         self.btn_copy = QPushButton("📋 Копировать RGB")
@@ -171,6 +592,45 @@ class MainWindow(QMainWindow):
         self.opacity_slider.setValue(50)
         self.opacity_slider.valueChanged.connect(self.change_opacity)
         overlay_layout.addWidget(self.opacity_slider)
+
+        self.btn_align = QPushButton("🎯 Автовыравнивание")
+        self.btn_align.setToolTip("Подобрать положение наложения по фазовой корреляции")
+        self.btn_align.clicked.connect(self.align_overlay)
+        overlay_layout.addWidget(self.btn_align)
+        self.align_worker = None
+        self.compare_worker = None
+
+        compare_controls = QHBoxLayout()
+        compare_controls.addWidget(QLabel("Карта разницы:"))
+        self.cb_delta_map = QComboBox()
+        self.cb_delta_map.addItem("Нет", None)
+        self.cb_delta_map.addItem("ΔR", 'dr')
+        self.cb_delta_map.addItem("ΔG", 'dg')
+        self.cb_delta_map.addItem("ΔB", 'db')
+        self.cb_delta_map.addItem("ΔE", 'de')
+        self.cb_delta_map.currentIndexChanged.connect(self.show_delta_map)
+        compare_controls.addWidget(self.cb_delta_map)
+
+        compare_controls.addWidget(QLabel("Ячейка:"))
+        self.sb_delta_cell = QSpinBox()
+        self.sb_delta_cell.setRange(1, 512)
+        self.sb_delta_cell.setValue(8)
+        compare_controls.addWidget(self.sb_delta_cell)
+
+        self.cb_compare_method = QComboBox()
+        self.cb_compare_method.addItem("ΔE76", '76')
+        self.cb_compare_method.addItem("ΔE2000", '2000')
+        compare_controls.addWidget(self.cb_compare_method)
+        overlay_layout.addLayout(compare_controls)
+
+        self.btn_compare = QPushButton("⚖ Сравнить с наложением")
+        self.btn_compare.clicked.connect(self.compare_overlay)
+        overlay_layout.addWidget(self.btn_compare)
+
+        self.lbl_compare = QLabel("")
+        self.lbl_compare.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        overlay_layout.addWidget(self.lbl_compare)
+        self.compare_result = None
         
         right_layout.addWidget(overlay_group)
 
@@ -185,6 +645,9 @@ class MainWindow(QMainWindow):
         
         self.line_profile = LineProfileWidget()
         self.viz_tabs.addTab(self.line_profile, "Профиль линии")
+
+        self.time_series = TimeSeriesWidget()
+        self.viz_tabs.addTab(self.time_series, "Временной ряд")
         
         viz_layout.addWidget(self.viz_tabs)
         right_layout.addWidget(viz_group)
@@ -204,19 +667,148 @@ class MainWindow(QMainWindow):
         self.sb_cell_size.setValue(50)
         self.sb_cell_size.valueChanged.connect(self.update_grid_size)
         grid_controls.addWidget(self.sb_cell_size)
+        grid_controls.addWidget(QLabel("x"))
+        self.sb_cell_h = QSpinBox()
+        self.sb_cell_h.setRange(0, 10000)
+        self.sb_cell_h.setSpecialValueText("квадрат")
+        self.sb_cell_h.setToolTip("Высота ячейки, 'квадрат' - равна ширине")
+        self.sb_cell_h.valueChanged.connect(self.update_grid_size)
+        grid_controls.addWidget(self.sb_cell_h)
         grid_layout.addLayout(grid_controls)
 
+        stride_controls = QHBoxLayout()
+        stride_controls.addWidget(QLabel("Шаг X:"))
+        self.sb_stride_x = QSpinBox()
+        self.sb_stride_y = QSpinBox()
+        for sb in (self.sb_stride_x, self.sb_stride_y):
+            sb.setRange(0, 10000)
+            sb.setSpecialValueText("= ячейке")
+            sb.setToolTip("Шаг меньше ячейки - перекрывающиеся окна")
+            sb.valueChanged.connect(self.update_grid_size)
+        stride_controls.addWidget(self.sb_stride_x)
+        stride_controls.addWidget(QLabel("Y:"))
+        stride_controls.addWidget(self.sb_stride_y)
+        grid_layout.addLayout(stride_controls)
+
+        area_controls = QHBoxLayout()
+        self.cb_grid_partial = QCheckBox("Неполные ячейки")
+        self.cb_grid_partial.setToolTip("Учитывать обрезанные ячейки у правого и нижнего краёв")
+        self.cb_grid_partial.stateChanged.connect(self.update_grid_size)
+        area_controls.addWidget(self.cb_grid_partial)
+        self.cb_grid_region = QCheckBox("Только выделение")
+        self.cb_grid_region.setToolTip("Сетка только внутри текущего выделения")
+        self.cb_grid_region.stateChanged.connect(self.toggle_grid_region)
+        area_controls.addWidget(self.cb_grid_region)
+        grid_layout.addLayout(area_controls)
+
+        quantile_controls = QHBoxLayout()
+        quantile_controls.addWidget(QLabel("Перцентили:"))
+        self.le_grid_percentiles = QLineEdit(self.settings.value("grid_percentiles", ""))
+        self.le_grid_percentiles.setPlaceholderText("нет, напр. 5, 50, 95")
+        self.le_grid_percentiles.setToolTip("Перцентили по ячейкам в экспорте сетки (50 - медиана)")
+        quantile_controls.addWidget(self.le_grid_percentiles)
+        self.cb_grid_hsv = QCheckBox("HSV")
+        self.cb_grid_lab = QCheckBox("LAB")
+        for cb in (self.cb_grid_hsv, self.cb_grid_lab):
+            cb.setToolTip("Также среднее, стд.откл и перцентили ячеек в этом пространстве")
+            quantile_controls.addWidget(cb)
+        self.cb_grid_palette = QCheckBox("Палитра")
+        self.cb_grid_palette.setToolTip("Доли цветов палитры области сетки по ячейкам\n"
+                                        "(число цветов и метод - в 'Детализация цветов')")
+        quantile_controls.addWidget(self.cb_grid_palette)
+        grid_layout.addLayout(quantile_controls)
+
+        heatmap_controls = QHBoxLayout()
+        heatmap_controls.addWidget(QLabel("Тепловая карта:"))
+        self.cb_heatmap = QComboBox()
+        self.cb_heatmap.addItem("Нет", None)
+        self.cb_heatmap.addItem("Среднее", 'mean')
+        self.cb_heatmap.addItem("Стд.Откл", 'std')
+        self.cb_heatmap.addItem("Norm R (G=1)", 'norm_r')
+        self.cb_heatmap.addItem("Norm B (G=1)", 'norm_b')
+        self.cb_heatmap.addItem("Локальная карта", 'local')
+        self.cb_heatmap.currentIndexChanged.connect(self.update_grid_heatmap)
+        heatmap_controls.addWidget(self.cb_heatmap)
+        grid_layout.addLayout(heatmap_controls)
+
         self.btn_export_grid = QPushButton("💾 Экспорт сетки в Excel")
         self.btn_export_grid.clicked.connect(self.export_grid_stats)
         grid_layout.addWidget(self.btn_export_grid)
+
+        sweep_controls = QHBoxLayout()
+        sweep_controls.addWidget(QLabel("Серия размеров:"))
+        self.le_sweep_sizes = QLineEdit(self.settings.value("sweep_sizes", "10, 20, 40, 80"))
+        sweep_controls.addWidget(self.le_sweep_sizes)
+        grid_layout.addLayout(sweep_controls)
+
+        self.btn_export_sweep = QPushButton("💾 Экспорт серии сеток")
+        self.btn_export_sweep.clicked.connect(self.export_grid_sweep)
+        grid_layout.addWidget(self.btn_export_sweep)
         
         right_layout.addWidget(grid_group)
 
+        # --- Local Statistics Group ---
+        local_group = QGroupBox("Локальная статистика")
+        local_layout = QVBoxLayout(local_group)
+
+        local_controls = QHBoxLayout()
+        self.cb_local_metric = QComboBox()
+        self.cb_local_metric.addItem("Стд.Откл", 'std')
+        self.cb_local_metric.addItem("Среднее", 'mean')
+        self.cb_local_metric.addItem("Norm R (G=1)", 'norm_r')
+        self.cb_local_metric.addItem("Norm B (G=1)", 'norm_b')
+        local_controls.addWidget(self.cb_local_metric)
+
+        local_controls.addWidget(QLabel("Окно:"))
+        self.sb_local_window = QSpinBox()
+        self.sb_local_window.setRange(2, 1001)
+        self.sb_local_window.setValue(15)
+        local_controls.addWidget(self.sb_local_window)
+        local_layout.addLayout(local_controls)
+
+        local_buttons = QHBoxLayout()
+        self.btn_local_map = QPushButton("▶ Построить карту")
+        self.btn_local_map.clicked.connect(self.build_local_map)
+        local_buttons.addWidget(self.btn_local_map)
+
+        btn_hide_local = QPushButton("❌ Скрыть")
+        btn_hide_local.clicked.connect(self.clear_local_map)
+        local_buttons.addWidget(btn_hide_local)
+        local_layout.addLayout(local_buttons)
+
+        self.lbl_local = QLabel("")
+        local_layout.addWidget(self.lbl_local)
+        self.local_map = None
+        self.local_worker = None
+
+        right_layout.addWidget(local_group)
+
 
         # --- Colors Table ---
         table_group = QGroupBox("Детализация цветов")
         table_layout = QVBoxLayout(table_group)
         
+        palette_controls = QHBoxLayout()
+        self.cb_color_mode = QComboBox()
+        self.cb_color_mode.addItem("Уникальные цвета", None)
+        self.cb_color_mode.addItem("Палитра (k-means)", 'kmeans')
+        self.cb_color_mode.addItem("Палитра (median cut)", 'median_cut')
+        self.cb_color_mode.currentIndexChanged.connect(self.refresh_color_table)
+        palette_controls.addWidget(self.cb_color_mode)
+
+        palette_controls.addWidget(QLabel("Цветов:"))
+        self.sb_palette_size = QSpinBox()
+        self.sb_palette_size.setRange(2, 64)
+        self.sb_palette_size.setValue(8)
+        self.sb_palette_size.valueChanged.connect(self.refresh_color_table)
+        palette_controls.addWidget(self.sb_palette_size)
+
+        btn_export_palettes = QPushButton("💾 Палитры (все фото)")
+        btn_export_palettes.setToolTip("Палитра всего изображения для каждого загруженного фото")
+        btn_export_palettes.clicked.connect(self.export_palettes)
+        palette_controls.addWidget(btn_export_palettes)
+        table_layout.addLayout(palette_controls)
+
         self.table = QTableWidget()
         self.table.setColumnCount(5)
         self.table.setHorizontalHeaderLabels(["R", "G", "B", "Кол-во", "Цвет"])
@@ -231,6 +823,23 @@ class MainWindow(QMainWindow):
         self.last_command = ""
         self.last_calculated_params = None
 
+    def toggle_decoded_store(self, enabled):
+        self.settings.setValue("decoded_store", enabled)
+        set_store_enabled(enabled)
+
+    def clear_decoded_store(self):
+        removed = image_store.clear_store()
+        QMessageBox.information(self, "Кэш", f"Удалено файлов: {removed}")
+
+    def toggle_result_cache(self, enabled):
+        self.settings.setValue("result_cache", enabled)
+        self.result_cache.enabled = enabled
+
+    def clear_result_cache(self):
+        self.result_cache.clear()
+        self.last_calculated_params = None
+        QMessageBox.information(self, "Кэш", "Кэш результатов очищен.")
+
     def open_image(self):
         file_names, _ = QFileDialog.getOpenFileNames(self, "Открыть изображения", self.last_dir, "Изображения (*.png *.jpg *.jpeg *.bmp *.tif)")
         if file_names:
@@ -249,6 +858,7 @@ class MainWindow(QMainWindow):
         for f in paths:
             if f not in self.image_paths:
                 self.image_paths.append(f)
+                self.load_order.append(f)
                 self.image_list.addItem(os.path.basename(f))
                 added_any = True
         
@@ -257,6 +867,140 @@ class MainWindow(QMainWindow):
         if self.image_list.count() > 0 and self.image_list.currentRow() == -1:
             self.image_list.setCurrentRow(0)
             
+    def update_catalog_view(self, *args):
+        """ Brings the catalog up to date for the listed images (new and modified files only), then sorts and filters """
+        if not self.image_paths:
+            return
+        if self.catalog_worker is not None:
+            # Applied again once the running update finishes
+            self.catalog_pending = True
+            return
+
+        self.catalog_pending = False
+        self.lbl_catalog.setText("Индексация...")
+        self.catalog_cancel = threading.Event()
+        self.catalog_worker = start_worker(
+            lambda paths, cancel, progress: catalog.get_catalog().update(paths, progress=progress, cancel=cancel),
+            list(self.image_paths), self.catalog_cancel,
+            on_progress=self.on_catalog_progress,
+            on_finished=self.on_catalog_updated,
+            on_error=self.on_catalog_error)
+
+    def on_catalog_progress(self, values):
+        done, total = values
+        self.lbl_catalog.setText(f"Индексация: {done} из {total}")
+
+    def on_catalog_error(self, message):
+        self.catalog_worker = None
+        self.catalog_cancel = None
+        self.lbl_catalog.setText(f"Ошибка каталога: {message}")
+
+    def on_catalog_updated(self, indexed):
+        self.catalog_worker = None
+        self.catalog_cancel = None
+        paths = list(self.image_paths)
+        self.catalog_values = catalog.get_catalog().entries(paths)
+        if self.similar_reference in self.catalog_values:
+            self.similar_distances = dict(catalog.get_catalog().similar(self.similar_reference, paths))
+        self.apply_catalog_view()
+        if self.catalog_pending:
+            self.update_catalog_view()
+
+    def catalog_filter_range(self):
+        """ (field, low, high) of the list filter, None bounds are open """
+        field = self.cb_catalog_filter.currentData()
+
+        def parse(edit):
+            text = edit.text().strip().replace(',', '.')
+            try:
+                return float(text) if text else None
+            except ValueError:
+                return None
+
+        return field, parse(self.le_catalog_min), parse(self.le_catalog_max)
+
+    def format_catalog_value(self, key, value):
+        if key == 'mtime':
+            return time.strftime("%Y-%m-%d %H:%M", time.localtime(value / 1e9))
+        if key == 'file_size':
+            return f"{value / (1024 * 1024):.1f} МБ"
+        if key in ('width', 'height'):
+            return str(int(value))
+        if key in ('norm_r', 'norm_b', 'similar'):
+            return f"{value:.4f}"
+        return f"{value:.1f}"
+
+    def apply_catalog_view(self):
+        """ Reorders image_paths and the list by the sort key, hides rows outside the filter range """
+        key = self.cb_catalog_sort.currentData()
+        reverse = self.btn_catalog_desc.isChecked()
+        values = self.catalog_values
+        listed = set(self.image_paths)
+        paths = [p for p in self.load_order if p in listed]
+
+        if key == 'name':
+            paths.sort(key=lambda p: os.path.basename(p).lower(), reverse=reverse)
+        elif key is not None:
+            source = self.similar_distances if key == 'similar' else {p: v[key] for p, v in values.items()}
+            known = [p for p in paths if p in source]
+            known.sort(key=lambda p: source[p], reverse=reverse)
+            # Images missing from the catalog stay at the end
+            paths = known + [p for p in paths if p not in source]
+        elif reverse:
+            paths.reverse()
+
+        current = self.viewer.image_path
+        self.image_paths = paths
+        self.image_list.blockSignals(True)
+        self.image_list.clear()
+        for path in paths:
+            text = os.path.basename(path)
+            if key == 'similar' and path in self.similar_distances:
+                text += f"  [{self.format_catalog_value('similar', self.similar_distances[path])}]"
+            elif key not in (None, 'name', 'similar') and path in values:
+                text += f"  [{self.format_catalog_value(key, values[path][key])}]"
+            self.image_list.addItem(text)
+            entry = values.get(path)
+            if entry:
+                self.image_list.item(self.image_list.count() - 1).setToolTip("\n".join(
+                    f"{label}: {self.format_catalog_value(k, entry[k])}" for k, label in CATALOG_FIELDS.items()))
+        if current in paths:
+            self.image_list.setCurrentRow(paths.index(current))
+        self.image_list.blockSignals(False)
+
+        field, low, high = self.catalog_filter_range()
+        shown = len(paths)
+        if field is not None and (low is not None or high is not None):
+            for row, path in enumerate(paths):
+                entry = values.get(path)
+                value = entry[field] if entry else None
+                hidden = value is None or (low is not None and value < low) or (high is not None and value > high)
+                self.image_list.setRowHidden(row, hidden)
+                shown -= hidden
+
+        text = f"В каталоге: {len(values)} из {len(paths)}"
+        if shown != len(paths):
+            text += f", показано: {shown}"
+        if key == 'similar' and self.similar_reference:
+            text += f"<br>Похожие на: {os.path.basename(self.similar_reference)}"
+        self.lbl_catalog.setText(text)
+
+    def find_similar_images(self):
+        if not self.viewer.image_path or self.viewer.image_path not in self.image_paths:
+            QMessageBox.warning(self, "Ошибка", "Выберите изображение в списке.")
+            return
+        self.similar_reference = self.viewer.image_path
+        self.similar_distances = {}
+        self.btn_catalog_desc.blockSignals(True)
+        self.btn_catalog_desc.setChecked(False)
+        self.btn_catalog_desc.blockSignals(False)
+        index = self.cb_catalog_sort.findData('similar')
+        if self.cb_catalog_sort.currentIndex() == index:
+            self.update_catalog_view()
+        else:
+            # Triggers update_catalog_view
+            self.cb_catalog_sort.setCurrentIndex(index)
+
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
             event.accept()
@@ -270,20 +1014,48 @@ class MainWindow(QMainWindow):
         if image_files:
             self.load_images(image_files)
 
+        for f in files:
+            if video.is_video(f):
+                self.add_video(f)
+
     def clear_images(self):
+        # The running catalog update indexes images that are no longer listed
+        if self.catalog_cancel is not None:
+            self.catalog_cancel.set()
         self.image_paths = []
+        self.load_order = []
+        self.catalog_values = {}
+        self.similar_reference = None
+        self.similar_distances = {}
+        self.lbl_catalog.setText("")
         self.image_list.clear()
+        self.viewer.clear_rois()
+        self.viewer.set_mask_shape(None)
         self.viewer.scene.clear()
+        self.viewer.pixel_array = None
+        self.viewer.display_item = None
+        self.lbl_pixel.setText("")
         self.lbl_rgb.setText("Список очищен.")
         self.lbl_hsv.setText("")
+        self.lbl_lab.setText("")
+        self.lbl_profile.setText("")
         self.histogram.set_data([], [], [])
         self.current_stats = None
+        self.current_overlay_stats = None
+        self.image_profile = None
         self.last_calculated_params = None
+        self.grid_pyramid = None
+        self.grid_pyramid_path = None
+        self.window_grid = None
 
     def on_image_selected(self, index):
         if 0 <= index < len(self.image_paths):
             path = self.image_paths[index]
             self.viewer.load_image(path)
+            self.start_image_profile(path)
+            self.clear_local_map()
+            self.clear_compare()
+            self.update_grid_heatmap()
             self.lbl_rgb.setText(f"Загружено: {os.path.basename(path)}")
             
             # Auto-calculate stats if we have a rect
@@ -297,6 +1069,26 @@ class MainWindow(QMainWindow):
             # Reset overlay opacity slider if needed, or keep it?
             # Keeping it allows persistent overlay settings.
 
+    def show_pixel_info(self, info):
+        """ Status bar text of the pixel under the cursor (see ImageViewer.pixel_hovered) """
+        if info is None:
+            self.lbl_pixel.setText("")
+            return
+
+        if info['max_value'] == 1.0:
+            rgb = ", ".join(f"{v:.4f}" for v in info['rgb'])
+        else:
+            rgb = ", ".join(str(int(v)) for v in info['rgb'])
+        h, sat, v = info['hsv']
+        l, a, b = info['lab']
+        text = (f"X={info['x']}, Y={info['y']}   RGB: {rgb}   HSV: {h:.0f}, {sat:.0f}, {v:.0f}   "
+                f"LAB: {l:.1f}, {a:.1f}, {b:.1f}")
+        if info['count'] > 1:
+            size = self.sb_inspector_size.value()
+            mean = ", ".join(f"{m:.1f}" if info['max_value'] != 1.0 else f"{m:.4f}" for m in info['mean'])
+            text += f"   Среднее {size}x{size}: {mean}"
+        self.lbl_pixel.setText(text)
+
     def set_overlay(self):
         row = self.image_list.currentRow()
         if row >= 0:
@@ -307,6 +1099,122 @@ class MainWindow(QMainWindow):
 
     def remove_overlay(self):
         self.viewer.set_overlay(None)
+        self.clear_compare()
+
+    def clear_compare(self):
+        self.compare_result = None
+        self.lbl_compare.setText("")
+        self.viewer.set_map_layer(None)
+
+    def align_overlay(self):
+        """ Estimates the overlay position in the background, starting from the current one """
+        overlay_info = self.viewer.get_overlay_info()
+        if not overlay_info or not self.viewer.image_path:
+            QMessageBox.warning(self, "Ошибка", "Сначала установите наложение.")
+            return
+
+        overlay_path, overlay_pos = overlay_info
+        image_path = self.viewer.image_path
+        initial = (overlay_pos.x(), overlay_pos.y())
+
+        self.btn_align.setEnabled(False)
+        self.lbl_compare.setText("Выравнивание...")
+        self.align_worker = start_worker(
+            registration.align_overlay, image_path, overlay_path, initial,
+            on_finished=lambda result: self.on_overlay_aligned(image_path, overlay_path, result),
+            on_error=lambda message: self.on_overlay_aligned(image_path, overlay_path, None))
+
+    def on_overlay_aligned(self, image_path, overlay_path, result):
+        self.btn_align.setEnabled(True)
+        self.align_worker = None
+
+        # Base or overlay changed while the worker was running
+        overlay_info = self.viewer.get_overlay_info()
+        if not overlay_info or overlay_info[0] != overlay_path or self.viewer.image_path != image_path:
+            self.lbl_compare.setText("")
+            return
+
+        if not result:
+            self.lbl_compare.setText("Не удалось выровнять наложение.")
+            return
+
+        (dx, dy), response = result
+        self.clear_compare()
+        self.viewer.set_overlay_pos(dx, dy)
+        self.lbl_compare.setText(f"<b>Смещение наложения:</b> X={dx:.2f}, Y={dy:.2f} (корреляция {response:.2f})")
+
+        self.last_calculated_params = None
+        self.calculate_stats()
+
+    def compare_overlay(self):
+        """ Delta maps and summary of base vs overlay over their whole overlap, computed in the background """
+        overlay_info = self.viewer.get_overlay_info()
+        if not overlay_info or not self.viewer.image_path:
+            QMessageBox.warning(self, "Ошибка", "Сначала установите наложение.")
+            return
+
+        overlay_path, overlay_pos = overlay_info
+        image_path = self.viewer.image_path
+        offset = (int(round(overlay_pos.x())), int(round(overlay_pos.y())))
+        cell_size = self.sb_delta_cell.value()
+        method = self.cb_compare_method.currentData()
+
+        params = (image_path, overlay_path, offset)
+        self.btn_compare.setEnabled(False)
+        self.lbl_compare.setText("Сравнение...")
+        self.compare_worker = start_worker(
+            self.result_cache.get_or_compute,
+            'overlay_difference', image_path, (os.path.abspath(overlay_path), offset, cell_size, method),
+            lambda: compare.calculate_overlay_difference(image_path, overlay_path, offset, cell_size, method),
+            on_finished=lambda result: self.on_overlay_compared(params, result),
+            on_error=lambda message: self.on_overlay_compared(params, None))
+
+    def on_overlay_compared(self, params, result):
+        self.btn_compare.setEnabled(True)
+        self.compare_worker = None
+
+        # Base, overlay or its position changed while the worker was running
+        image_path, overlay_path, offset = params
+        overlay_info = self.viewer.get_overlay_info()
+        if (not overlay_info or overlay_info[0] != overlay_path or self.viewer.image_path != image_path or
+                (int(round(overlay_info[1].x())), int(round(overlay_info[1].y()))) != offset):
+            self.lbl_compare.setText("")
+            return
+
+        if not result:
+            self.clear_compare()
+            self.lbl_compare.setText("Изображения не перекрываются.")
+            return
+
+        self.compare_result = result
+        sm = result['summary']
+        self.lbl_compare.setText(
+            f"<b>Пикселей в перекрытии:</b> {sm['count']}<br>"
+            f"<b>Средняя Δ (База - Наложение):</b> R={sm['mean_dr']:+.2f}, G={sm['mean_dg']:+.2f}, B={sm['mean_db']:+.2f}<br>"
+            f"<b>Средняя |Δ|:</b> R={sm['mad_r']:.2f}, G={sm['mad_g']:.2f}, B={sm['mad_b']:.2f}<br>"
+            f"<b>{self.cb_compare_method.currentText()}:</b> сред. {sm['mean_de']:.2f}, ст.откл {sm['std_de']:.2f}, 95% {sm['p95_de']:.2f}, макс. {sm['max_de']:.2f}"
+        )
+
+        if self.cb_delta_map.currentData() is None:
+            self.cb_delta_map.setCurrentIndex(self.cb_delta_map.count() - 1) # ΔE
+        else:
+            self.show_delta_map()
+
+    def show_delta_map(self):
+        key = self.cb_delta_map.currentData()
+        if not key or not self.compare_result:
+            self.viewer.set_map_layer(None)
+            return
+
+        values = self.compare_result['maps'][key]
+        if key == 'de':
+            vmin, vmax = 0.0, max(float(np.percentile(values, 99)), 1e-6) if values.size else 1.0
+        else:
+            # Signed differences: symmetric range around zero
+            limit = float(np.percentile(np.abs(values), 99)) if values.size else 1.0
+            vmin, vmax = -max(limit, 1e-6), max(limit, 1e-6)
+
+        self.viewer.set_map_layer(values, self.compare_result['origin'], self.compare_result['cell_size'], vmin, vmax)
 
     def change_opacity(self, value):
         self.viewer.set_overlay_opacity(value / 100.0)
@@ -316,27 +1224,316 @@ class MainWindow(QMainWindow):
             self.viewer.fitInView(self.viewer.scene.itemsBoundingRect(), Qt.AspectRatioMode.KeepAspectRatio)
 
     def toggle_grid(self, state):
-        self.viewer.set_grid(self.cb_grid.isChecked(), self.sb_cell_size.value())
+        layout = self.grid_layout()
+        self.viewer.set_grid(self.cb_grid.isChecked(), layout['cell_size'], self.viewer_grid_layout(layout))
+        self.update_grid_heatmap()
 
-    def update_grid_size(self, value):
+    def update_grid_size(self, *args):
         if self.cb_grid.isChecked():
-            self.viewer.set_grid(True, value)
+            layout = self.grid_layout()
+            self.viewer.set_grid(True, layout['cell_size'], self.viewer_grid_layout(layout))
+            self.update_grid_heatmap()
+
+    def toggle_grid_region(self, state):
+        """ Limits the grid to the selection at the time the box is checked """
+        self.grid_region = None
+        if self.cb_grid_region.isChecked():
+            self.grid_region = self.viewer.get_selection_rect()
+            if not self.grid_region or self.grid_region[2] <= 0 or self.grid_region[3] <= 0:
+                self.grid_region = None
+                self.cb_grid_region.blockSignals(True)
+                self.cb_grid_region.setChecked(False)
+                self.cb_grid_region.blockSignals(False)
+                QMessageBox.warning(self, "Ошибка", "Сначала выделите область.")
+                return
+        self.update_grid_size()
+
+    def grid_layout(self, cell_size=None):
+        """
+        Grid parameters of the 'Сетка' group as keyword arguments of
+        processor.calculate_grid_stats. cell_size replaces the cell width,
+        the height and strides are scaled with it (grid series).
+        """
+        cell_w = self.sb_cell_size.value()
+        cell_h = self.sb_cell_h.value() or cell_w
+        stride_x = self.sb_stride_x.value() or cell_w
+        stride_y = self.sb_stride_y.value() or cell_h
+        if cell_size and cell_size != cell_w:
+            k = cell_size / cell_w
+            cell_h, stride_x, stride_y = (max(1, round(v * k)) for v in (cell_h, stride_x, stride_y))
+            cell_w = cell_size
+        return {
+            'cell_size': cell_w, 'cell_h': cell_h, 'stride_x': stride_x, 'stride_y': stride_y,
+            'region': self.grid_region if self.cb_grid_region.isChecked() else None,
+            'partial': self.cb_grid_partial.isChecked(),
+        }
+
+    def grid_quantile_options(self):
+        """
+        (percentiles, colour spaces) of the per-cell columns requested in the
+        'Сетка' group, None if there are none. Raises ValueError on bad input.
+        """
+        text = self.le_grid_percentiles.text().replace(';', ',')
+        percentiles = sorted({float(v.replace(' ', '')) for v in text.split(',') if v.strip()})
+        if any(p < 0 or p > 100 for p in percentiles):
+            raise ValueError("percentile out of range")
+        self.settings.setValue("grid_percentiles", self.le_grid_percentiles.text())
+
+        spaces = ['rgb']
+        if self.cb_grid_hsv.isChecked():
+            spaces.append('hsv')
+        if self.cb_grid_lab.isChecked():
+            spaces.append('lab')
+        if not percentiles and len(spaces) == 1:
+            return None
+        return tuple(percentiles), tuple(spaces)
+
+    def grid_palette_options(self):
+        """ (n_colors, method) of the per-cell palette columns, None if they are off """
+        if not self.cb_grid_palette.isChecked():
+            return None
+        return self.sb_palette_size.value(), self.cb_color_mode.currentData() or 'kmeans'
+
+    def viewer_grid_layout(self, layout):
+        return {k: layout[k] for k in ('cell_h', 'stride_x', 'stride_y', 'region')}
+
+    def grid_layout_key(self, layout):
+        """ Result cache parameters of a grid layout """
+        region = tuple(layout['region']) if layout['region'] else None
+        return (layout['cell_size'], layout['cell_h'], layout['stride_x'], layout['stride_y'],
+                region, layout['partial'])
+
+    def build_local_map(self):
+        """ Sliding-window statistics map of the current image, built in the background """
+        image_path = self.viewer.image_path
+        if not image_path:
+            QMessageBox.warning(self, "Ошибка", "Сначала загрузите изображение.")
+            return
+
+        metric = self.cb_local_metric.currentData()
+        window = self.sb_local_window.value()
+
+        self.btn_local_map.setEnabled(False)
+        self.lbl_local.setText("Расчёт карты...")
+        self.local_worker = start_worker(
+            local_stats.calculate_local_map, image_path, window, metric,
+            on_finished=lambda values: self.on_local_map(image_path, metric, window, values))
+
+    def on_local_map(self, image_path, metric, window, values):
+        self.btn_local_map.setEnabled(True)
+        self.local_worker = None
+        if image_path != self.viewer.image_path:
+            self.lbl_local.setText("")
+            return
+        if values is None:
+            self.lbl_local.setText("Ошибка расчёта карты.")
+            return
+
+        self.local_map = {'metric': metric, 'window': window, 'values': values}
+        vmin, vmax = colormap.value_range(values)
+        name = self.cb_local_metric.itemText(self.cb_local_metric.findData(metric))
+        self.lbl_local.setText(f"{name}, окно {window}: {vmin:.3f} .. {vmax:.3f} (1-99%)")
+
+        # The map layer is shared with the overlay delta maps
+        self.cb_delta_map.blockSignals(True)
+        self.cb_delta_map.setCurrentIndex(0)
+        self.cb_delta_map.blockSignals(False)
+
+        # Large maps are shown reduced, the full map is kept for sampling
+        small, step = local_stats.downsample_map(values)
+        self.viewer.set_map_layer(small, (0, 0), step, vmin, vmax)
+
+        self.update_grid_heatmap()
+        if self.roi_table.rowCount():
+            self.calculate_rois()
+
+    def clear_local_map(self):
+        had_map = self.local_map is not None
+        self.local_map = None
+        self.lbl_local.setText("")
+        if had_map:
+            self.viewer.set_map_layer(None)
+            if self.cb_heatmap.currentData() == 'local':
+                self.update_grid_heatmap()
+
+    def when_pixels_loaded(self, callback):
+        """ Runs callback() once the viewer's pixel_array of the current image is decoded """
+        self.pixel_waiters[callback] = self.viewer.image_path
+
+    def on_pixels_loaded(self, path):
+        waiters, self.pixel_waiters = self.pixel_waiters, {}
+        for callback, waiter_path in waiters.items():
+            # Waiters of images no longer shown are dropped
+            if waiter_path == path:
+                callback()
+
+    def update_grid_heatmap(self):
+        """ Refreshes the heatmap shortly after the last change of image, layout or metric """
+        self.heatmap_timer.start()
+
+    def refresh_grid_heatmap(self):
+        metric = self.cb_heatmap.currentData()
+        if not metric or not self.cb_grid.isChecked() or not self.viewer.image_path:
+            self.viewer.set_grid_heatmap(None)
+            return
+
+        layout = self.grid_layout()
+        cell_size = layout['cell_size']
+        if metric == 'local':
+            # Per-cell mean of the local statistics map (square grids only)
+            local_map = self.local_map
+            if local_map is None or processor.is_window_layout(**layout):
+                self.viewer.set_grid_heatmap(None)
+            else:
+                self.viewer.set_grid_heatmap(local_stats.map_cell_means(local_map['values'], cell_size))
+            return
+
+        grid = self.cached_grid(layout)
+        if grid is not None:
+            if processor.is_window_layout(**layout):
+                self.viewer.set_grid_heatmap(grid.metric_map(metric))
+            else:
+                self.viewer.set_grid_heatmap(grid.metric_map(cell_size, metric))
+            return
+
+        # The moments are built on a worker from the viewer's decoded pixels;
+        # the old heatmap doesn't match the new cells meanwhile
+        self.viewer.set_grid_heatmap(None)
+        if self.viewer.pixel_array is None:
+            self.when_pixels_loaded(self.refresh_grid_heatmap)
+            return
+        if self.heatmap_worker is not None:
+            self.heatmap_pending = True
+            return
+
+        image_path = self.viewer.image_path
+        if processor.is_window_layout(**layout):
+            kwargs = dict(layout)
+            fn, size = processor.build_window_grid, kwargs.pop('cell_size')
+        else:
+            fn, size, kwargs = processor.build_grid_pyramid, self.grid_pyramid_base(cell_size), {}
+        self.heatmap_worker = start_worker(
+            fn, image_path, size, img_arr=self.viewer.pixel_array, **kwargs,
+            on_finished=lambda grid: self.on_heatmap_grid(image_path, layout, grid),
+            on_error=lambda message: self.on_heatmap_grid(image_path, layout, None))
+
+    def on_heatmap_grid(self, image_path, layout, grid):
+        self.heatmap_worker = None
+        if image_path == self.viewer.image_path and grid is not None:
+            self.store_grid(image_path, layout, grid)
+        elif not self.heatmap_pending:
+            # Failed (or for another image): don't retry the same layout over and over
+            return
+        self.heatmap_pending = False
+        self.refresh_grid_heatmap()
+
+    def cached_grid(self, layout):
+        """ GridPyramid / WindowGrid of the current image already built for the layout, None if there is none """
+        image_path = self.viewer.image_path
+        if processor.is_window_layout(**layout):
+            if self.window_grid and self.window_grid[:2] == (image_path, self.grid_layout_key(layout)):
+                return self.window_grid[2]
+            return None
+        pyramid = self.grid_pyramid if self.grid_pyramid_path == image_path else None
+        return pyramid if pyramid and pyramid.supports(layout['cell_size']) else None
+
+    def store_grid(self, image_path, layout, grid):
+        if processor.is_window_layout(**layout):
+            self.window_grid = (image_path, self.grid_layout_key(layout), grid)
+        else:
+            self.grid_pyramid = grid
+            self.grid_pyramid_path = image_path
+
+    def grid_pyramid_base(self, cell_size):
+        """
+        Base size of a new pyramid for cell_size: the common divisor with the
+        cached one, so sweeping sizes 10, 20, 40... reads the pixels only once.
+        """
+        pyramid = self.grid_pyramid if self.grid_pyramid_path == self.viewer.image_path else None
+        if pyramid:
+            common = gcd(pyramid.base_size, cell_size)
+            if common >= grid_engine.MIN_PYRAMID_BASE:
+                return common
+        return cell_size
+
+    def get_grid_pyramid(self, cell_size):
+        """ Moment pyramid of the current image that supports cell_size, built if needed """
+        pyramid = self.cached_grid({'cell_size': cell_size})
+        if pyramid is None:
+            image_path = self.viewer.image_path
+            pyramid = processor.build_grid_pyramid(image_path, self.grid_pyramid_base(cell_size),
+                                                   img_arr=self.viewer.pixel_array)
+            self.grid_pyramid = pyramid
+            self.grid_pyramid_path = image_path
+        return pyramid
+
+    def get_window_grid(self, layout):
+        """ WindowGrid of the current image for a rectangular / overlapping layout, kept for the last layout """
+        grid = self.cached_grid(layout)
+        if grid is None:
+            args = dict(layout)
+            grid = processor.build_window_grid(self.viewer.image_path, args.pop('cell_size'), **args,
+                                               img_arr=self.viewer.pixel_array)
+            self.window_grid = (self.viewer.image_path, self.grid_layout_key(layout), grid) if grid else None
+        return grid
+
+    def compute_grid_results(self, layout, quantiles=None, palette_options=None):
+        """
+        Grid rows of the current image; quantiles: (percentiles, spaces),
+        palette_options: (n_colors, method) of extra per-cell columns
+        """
+        if processor.is_window_layout(**layout):
+            grid = self.get_window_grid(layout)
+            rows = grid.rows() if grid else []
+        else:
+            cell_size = layout['cell_size']
+            pyramid = self.get_grid_pyramid(cell_size)
+            rows = pyramid.rows(cell_size) if pyramid else []
+
+        if rows and quantiles:
+            percentiles, spaces = quantiles
+            columns = processor.calculate_grid_quantiles(self.viewer.image_path, percentiles=percentiles,
+                                                         spaces=spaces, **layout)
+            if columns is None:
+                return []
+            for key, values in columns.items():
+                for row, value in zip(rows, values.tolist()):
+                    row[key] = value
+
+        if rows and palette_options:
+            n_colors, method = palette_options
+            result = palette.calculate_grid_palette(self.viewer.image_path, n_colors=n_colors, method=method, **layout)
+            if result is None:
+                return []
+            # Share of each palette colour in the cell, %; the colour goes into the column name
+            shares = result['counts'] * 100.0 / np.maximum(result['counts'].sum(axis=1, keepdims=True), 1)
+            for i, color in enumerate(result['colors']):
+                key = f"palette_{i + 1} ({', '.join(f'{c:.4g}' for c in color)})"
+                for row, value in zip(rows, shares[:, i].tolist()):
+                    row[key] = value
+        return rows
 
     def set_tool(self, mode):
         self.btn_tool_rect.setChecked(mode == 'rect')
         self.btn_tool_line.setChecked(mode == 'line')
+        self.btn_tool_polygon.setChecked(mode == 'polygon')
+        self.btn_tool_ellipse.setChecked(mode == 'ellipse')
+        self.btn_tool_brush.setChecked(mode == 'brush')
         self.viewer.set_tool(mode)
         
         # Switch tabs to match useful info
-        if mode == 'rect':
+        if mode == 'rect' or mode in MASK_TOOLS:
             self.viz_tabs.setCurrentWidget(self.histogram)
             self.calculate_stats()
         else:
             self.viz_tabs.setCurrentWidget(self.line_profile)
             self.calculate_profile()
 
+    def change_brush_radius(self, value):
+        self.viewer.brush_radius = value
+
     def on_item_changed(self):
-        if self.viewer.current_tool == 'rect':
+        if self.viewer.current_tool == 'rect' or self.viewer.current_tool in MASK_TOOLS:
             self.calculate_stats()
         elif self.viewer.current_tool == 'line':
             self.calculate_profile()
@@ -349,13 +1546,107 @@ class MainWindow(QMainWindow):
 
         # Optimization check could be added here similar to stats
 
-        profile_data = calculate_line_profile(self.viewer.image_path, line_coords)
+        image_path = self.viewer.image_path
+        profile_data = self.result_cache.get_or_compute(
+            'line_profile', image_path, line_coords,
+            lambda: processor.calculate_line_profile(image_path, line_coords))
         if profile_data:
-            self.line_profile.set_data(profile_data['r'], profile_data['g'], profile_data['b'])
+            self.line_profile.set_data(profile_data['r'], profile_data['g'], profile_data['b'],
+                                       profile_data.get('max_value', 255))
     
+    def get_selection_stats(self, image_path, rect=None, shape=None, img_arr=None):
+        """ Stats of a rect or a mask shape, through the result cache; img_arr: the decoded image if at hand """
+        if shape is not None:
+            return self.result_cache.get_or_compute(
+                'masked_stats', image_path, shape,
+                lambda: processor.calculate_masked_stats(image_path, shape, img_arr=img_arr))
+        return self.result_cache.get_or_compute(
+            'image_stats', image_path, rect,
+            lambda: processor.calculate_image_stats(image_path, rect, img_arr=img_arr))
+
+    def cached_selection_stats(self, image_path, rect=None, shape=None):
+        if shape is not None:
+            return self.result_cache.lookup('masked_stats', image_path, shape)
+        return self.result_cache.lookup('image_stats', image_path, rect)
+
+    def get_approximate_stats(self, image_path, rect=None, shape=None, img_arr=None):
+        """ Sampled stats with confidence intervals, not cached (they are cheap) """
+        if shape is not None:
+            return processor.calculate_masked_stats(image_path, shape, approximate=True, img_arr=img_arr)
+        return processor.calculate_image_stats(image_path, rect, approximate=True, img_arr=img_arr)
+
+    def overlay_selection(self, rect=None, shape=None):
+        """ (overlay_path, rect, shape) of the selection in overlay coordinates, None without overlay """
+        overlay_info = self.viewer.get_overlay_info()
+        if not overlay_info:
+            return None
+        overlay_path, overlay_pos = overlay_info
+        if shape is not None:
+            return overlay_path, None, masks.translate_shape(shape, -overlay_pos.x(), -overlay_pos.y())
+
+        # Calculate rect relative to overlay
+        ox = int(rect[0] - overlay_pos.x())
+        oy = int(rect[1] - overlay_pos.y())
+        return overlay_path, (ox, oy, rect[2], rect[3]), None
+
+    def selection_stats_job(self, selections, cancel, palette_options, progress):
+        """
+        Stats of the selection and the overlay (runs on a worker).
+        selections: (image_path, rect, shape, decoded image or None) of each.
+        palette_options: (n_colors, method) of the colour table palette of
+        the first selection, None without it.
+        Every image is decoded at most once: the estimate from a pixel sample
+        is reported through progress first, the exact stats of the same
+        arrays and the palette are returned after it:
+        ([stats of each selection], palette or None). None if cancelled.
+        """
+        arrays, estimates = [], []
+        for i, (image_path, rect, shape, img_arr) in enumerate(selections):
+            estimate = self.cached_selection_stats(image_path, rect, shape)
+            needs_pixels = estimate is None or (i == 0 and palette_options is not None)
+            if needs_pixels and img_arr is None:
+                try:
+                    img_arr = image_store.load_image_array(image_path)
+                except Exception as e:
+                    print(f"Error loading image: {e}")
+            if estimate is None and img_arr is not None:
+                estimate = self.get_approximate_stats(image_path, rect, shape, img_arr)
+            arrays.append(img_arr)
+            estimates.append(estimate)
+            if cancel.is_set():
+                return None
+        progress(*estimates)
+
+        exact = []
+        for (image_path, rect, shape, _), img_arr, estimate in zip(selections, arrays, estimates):
+            if cancel.is_set():
+                return None
+            if img_arr is None or (estimate and not estimate.get('approximate')):
+                # Cached (the estimate is already exact) or not decodable
+                exact.append(estimate)
+            else:
+                exact.append(self.get_selection_stats(image_path, rect, shape, img_arr))
+
+        palette_result = None
+        if palette_options is not None and arrays[0] is not None and not cancel.is_set():
+            image_path, rect, shape, _ = selections[0]
+            palette_result = self.get_palette(image_path, rect, shape, *palette_options, img_arr=arrays[0])
+        return exact, palette_result
+
+    def cancel_stats_job(self):
+        """ Stops the running selection stats worker, its results are dropped """
+        if self.stats_cancel is not None:
+            self.stats_cancel.set()
+        self.stats_cancel = None
+        self.stats_worker = None
+
     def calculate_stats(self, rect=None):
+        shape = None
         if rect is None or isinstance(rect, bool): 
-            rect = self.viewer.get_selection_rect()
+            if self.viewer.current_tool in MASK_TOOLS:
+                shape = self.viewer.get_selection_shape()
+            else:
+                rect = self.viewer.get_selection_rect()
         
         if hasattr(rect, 'getRect'): 
              r = rect
@@ -364,35 +1655,86 @@ class MainWindow(QMainWindow):
              new_rect = (int(r.x()), int(r.y()), int(r.width()), int(r.height()))
              rect = new_rect
 
-        if not rect:
+        if not rect and not shape:
             self.lbl_rgb.setText("Ошибка: Не выделена область или файл не найден.")
             self.btn_copy.setEnabled(False)
             self.btn_csv.setEnabled(False)
             return
 
         # Optimization: Check if we are recalculating the same thing
-        current_params = (self.viewer.image_path, rect)
+        current_params = (self.viewer.image_path, rect, shape)
         if hasattr(self, 'last_calculated_params') and self.last_calculated_params == current_params:
             return
         self.last_calculated_params = current_params
 
+        image_path = self.viewer.image_path
+        overlay = self.overlay_selection(rect, shape)
+
+        # Large selections: show an estimate from a pixel sample right away
+        # and replace it with the exact numbers once the worker is done
+        if shape is not None:
+            x1, y1, x2, y2 = masks.shape_bounds(shape)
+        else:
+            x1, y1, x2, y2 = rect[0], rect[1], rect[0] + rect[2], rect[1] + rect[3]
+        if self.viewer.pixmap is not None:
+            x1, y1 = max(0, x1), max(0, y1)
+            x2, y2 = min(self.viewer.pixmap.width(), x2), min(self.viewer.pixmap.height(), y2)
+        area = max(0, x2 - x1) * max(0, y2 - y1)
+        # The palette pass covers every pixel: it goes to the worker unless it
+        # is cached or the selection is small and already decoded
+        palette_options = self.table_palette_options()
+        palette_result = None
+        if palette_options:
+            palette_result = self.result_cache.lookup('palette', image_path, (rect, shape) + palette_options)
+        palette_pending = palette_options is not None and palette_result is None and (
+            area > APPROX_PIXELS or self.viewer.pixel_array is None)
+        # One job at a time: a new selection replaces the running one
+        self.cancel_stats_job()
+        if palette_pending or (area > APPROX_PIXELS and self.cached_selection_stats(image_path, rect, shape) is None):
+            # The viewer's decoded pixels spare the worker a decode of the file
+            selections = [(image_path, rect, shape, self.viewer.pixel_array)]
+            if overlay:
+                selections.append(overlay + (None,))
+            self.stats_cancel = threading.Event()
+            self.stats_worker = start_worker(
+                self.selection_stats_job, selections, self.stats_cancel,
+                palette_options if palette_pending else None,
+                on_progress=lambda values: self.on_approximate_stats(current_params, values),
+                on_finished=lambda result: self.on_exact_stats(current_params, palette_result, result))
+            return
+
         # Base Image Stats
-        stats = calculate_image_stats(self.viewer.image_path, rect)
-        
+        stats = self.get_selection_stats(image_path, rect, shape, self.viewer.pixel_array)
+        if palette_options and palette_result is None:
+            palette_result = self.get_palette(image_path, rect, shape, *palette_options,
+                                              img_arr=self.viewer.pixel_array)
+
         # Overlay Stats
-        overlay_stats = None
-        overlay_info = self.viewer.get_overlay_info()
-        if overlay_info:
-            overlay_path, overlay_pos = overlay_info
-            
-            # Calculate rect relative to overlay
-            ox = int(rect[0] - overlay_pos.x())
-            oy = int(rect[1] - overlay_pos.y())
-            ow = rect[2]
-            oh = rect[3]
-            
-            overlay_stats = calculate_image_stats(overlay_path, (ox, oy, ow, oh))
+        overlay_stats = self.get_selection_stats(*overlay) if overlay else None
+        self.show_stats(image_path, rect, shape, stats, overlay_stats, palette_result)
+
+    def on_approximate_stats(self, params, values):
+        # The selection changed while the worker was running
+        if params != self.last_calculated_params:
+            return
+        image_path, rect, shape = params
+        stats, overlay_stats = (list(values) + [None])[:2]
+        self.show_stats(image_path, rect, shape, stats, overlay_stats)
 
+    def on_exact_stats(self, params, palette_result, result):
+        """ palette_result: the cached palette, if the worker didn't compute it """
+        if result is None or params != self.last_calculated_params:
+            return
+        self.stats_worker = None
+        self.stats_cancel = None
+        image_path, rect, shape = params
+        values, computed_palette = result
+        stats, overlay_stats = (list(values) + [None])[:2]
+        self.show_stats(image_path, rect, shape, stats, overlay_stats, computed_palette or palette_result)
+
+    def show_stats(self, image_path, rect, shape, stats, overlay_stats, palette_result=None):
+        """ palette_result: palette of the colour table in palette mode, None while it is pending """
+        self.current_overlay_stats = overlay_stats
         if stats:
             self.current_stats = stats
             r = stats['r']
@@ -406,16 +1748,41 @@ class MainWindow(QMainWindow):
             
             self.last_command = f"R,B {norm_r:.2f},{norm_b:.2f}"
             
-            # RGB Text
-            res_text = (
-                f"<b>Средний RGB:</b> R={r:.1f}, G={g:.1f}, B={b:.1f}<br>"
-                f"<b>Медиана:</b> R={stats['median_r']:.1f}, G={stats['median_g']:.1f}, B={stats['median_b']:.1f}<br>"
-                f"<b>Разброс (Шум):</b> R={stats['std_r']:.2f}, G={stats['std_g']:.2f}, B={stats['std_b']:.2f}<br>"
+            # RGB Text (float images are 0..1, so they get more decimals)
+            p = 1 if stats.get('max_value', 255) > 1 else 4
+            approximate = stats.get('approximate', False)
+            ci = stats.get('ci', {})
+
+            def with_ci(key, precision):
+                value = f"{stats[key]:.{precision}f}"
+                return f"{value}±{ci[key]:.{precision}f}" if approximate else value
+
+            res_text = ""
+            if approximate:
+                res_text += (
+                    f"<span style='color: orange'>≈ Оценка по выборке {stats['sample_count']} из {stats['count']} пикс. "
+                    f"(95% доверительный интервал), уточняется...</span><br>"
+                )
+            res_text += (
+                f"<b>Средний RGB:</b> R={with_ci('r', p)}, G={with_ci('g', p)}, B={with_ci('b', p)}<br>"
+                f"<b>Медиана:</b> R={stats['median_r']:.{p}f}, G={stats['median_g']:.{p}f}, B={stats['median_b']:.{p}f}<br>"
+                f"<b>Разброс (Шум):</b> R={with_ci('std_r', p + 1)}, G={with_ci('std_g', p + 1)}, B={with_ci('std_b', p + 1)}<br>"
+            )
+            if approximate:
+                low, high = stats['percentiles'][5], stats['percentiles'][95]
+                res_text += (
+                    f"<b>Перцентили 5–95%:</b> R={low[0]:.{p}f}–{high[0]:.{p}f}, "
+                    f"G={low[1]:.{p}f}–{high[1]:.{p}f}, B={low[2]:.{p}f}–{high[2]:.{p}f}<br>"
+                )
+            res_text += (
                 f"<b>Нормализация (G=1.0):</b> R={norm_r:.4f}, G={norm_g:.4f}, B={norm_b:.4f}<br>"
                 f"<div style='font-size: 16px; color: #4ec9b0; margin-top: 5px;'><b>{self.last_command}</b></div><br>"
                 f"<b>Всего пикселей:</b> {stats['count']}<br>"
-                f"<b>Уникальных цветов:</b> {len(stats['unique_colors'])}"
             )
+            if approximate:
+                res_text += f"<b>Уникальных цветов в выборке:</b> {len(stats['unique_colors'])}"
+            else:
+                res_text += f"<b>Уникальных цветов:</b> {len(stats['unique_colors'])}"
             
             if overlay_stats:
                 or_ = overlay_stats['r']
@@ -445,6 +1812,8 @@ class MainWindow(QMainWindow):
                 f"<b>Разброс:</b> H={hsv.get('std_h', 0):.2f}, S={hsv.get('std_s', 0):.2f}, V={hsv.get('std_v', 0):.2f}"
             )
             self.lbl_hsv.setText(hsv_text)
+            self.update_lab_text()
+            self.update_profile_text()
 
             self.btn_copy.setEnabled(True)
             self.btn_csv.setEnabled(True)
@@ -452,36 +1821,702 @@ class MainWindow(QMainWindow):
             # Update Histogram (Base only for now, or maybe combined?)
             self.histogram.set_data(*stats['hist'])
 
-            # Populate table
-            unique_colors = stats['unique_colors']
-            counts = stats['counts']
-            
-            # Limit to top 10000 to avoid freezing UI
-            limit = 10000
-            count_shown = min(len(unique_colors), limit)
-            self.table.setRowCount(count_shown)
-            
-            if len(unique_colors) > limit:
-                 self.lbl_rgb.setText(res_text + f"<br><span style='color: orange'>Показано топ {limit} из {len(unique_colors)} цветов</span>")
-            
-            for i in range(self.table.rowCount()):
-                color = unique_colors[i]
-                count = counts[i]
-                
-                self.table.setItem(i, 0, QTableWidgetItem(str(color[0])))
-                self.table.setItem(i, 1, QTableWidgetItem(str(color[1])))
-                self.table.setItem(i, 2, QTableWidgetItem(str(color[2])))
-                self.table.setItem(i, 3, QTableWidgetItem(str(count)))
-                
-                # Color preview item
-                color_item = QTableWidgetItem()
-                color_item.setBackground(QColor(int(color[0]), int(color[1]), int(color[2])))
-                self.table.setItem(i, 4, color_item)
+            # Populate table: palette of the selection or its unique colours
+            max_value = stats.get('max_value', 255)
+            if self.cb_color_mode.currentData():
+                # The palette comes with the exact result (or from the cache)
+                if palette_result:
+                    labels = [f"{c} ({f * 100:.1f}%)" for c, f in zip(palette_result['counts'], palette_result['coverage'])]
+                    self.fill_color_table(palette_result['colors'], labels, max_value)
+                else:
+                    self.table.setRowCount(0)
+            else:
+                unique_colors = stats['unique_colors']
+                counts = stats['counts']
+
+                # Limit to top 10000 to avoid freezing UI
+                limit = 10000
+                if len(unique_colors) > limit:
+                     self.lbl_rgb.setText(res_text + f"<br><span style='color: orange'>Показано топ {limit} из {len(unique_colors)} цветов</span>")
+
+                prefix = "≈" if stats.get('approximate') else ""
+                self.fill_color_table(unique_colors[:limit], [f"{prefix}{c}" for c in counts[:limit]], max_value)
         else:
             self.lbl_rgb.setText("Ошибка при обработке изображения.")
             self.btn_copy.setEnabled(False)
             self.btn_csv.setEnabled(False)
 
+    def get_image_profile(self, image_path, img_arr=None):
+        return self.result_cache.get_or_compute(
+            'image_profile', image_path, None,
+            lambda: image_profile.calculate_image_profile(image_path, img_arr=img_arr))
+
+    def start_image_profile(self, image_path):
+        """
+        Whole-image stats in the background, cached with the image. They are
+        computed from the viewer's pixels, so the file isn't decoded twice.
+        """
+        self.image_profile = None
+        self.lbl_profile.setText("Расчёт статистики изображения...")
+        cached = self.result_cache.lookup('image_profile', image_path, None)
+        if cached is not None:
+            self.on_image_profile(image_path, cached)
+        elif self.viewer.pixel_array is None:
+            self.when_pixels_loaded(lambda: self.start_image_profile(image_path))
+        else:
+            self.profile_worker = start_worker(
+                self.get_image_profile, image_path, self.viewer.pixel_array,
+                on_finished=lambda profile: self.on_image_profile(image_path, profile))
+
+    def on_image_profile(self, image_path, profile):
+        # Another image was selected while the worker was running
+        if image_path != self.viewer.image_path:
+            return
+        self.profile_worker = None
+        self.image_profile = profile
+        self.update_profile_text()
+
+    def update_profile_text(self):
+        """ Whole-image stats and the current selection compared to them """
+        profile = self.image_profile
+        if not profile:
+            if self.profile_worker is None:
+                self.lbl_profile.setText("")
+            return
+
+        p = 1 if profile.get('max_value', 255) > 1 else 4
+        hsv, lab = profile['hsv'], profile['lab']
+        text = (
+            f"<b>Размер:</b> {profile['width']} x {profile['height']} ({profile['count']} пикс.)<br>"
+            f"<b>Средний RGB:</b> R={profile['r']:.{p}f}, G={profile['g']:.{p}f}, B={profile['b']:.{p}f}<br>"
+            f"<b>Медиана:</b> R={profile['median_r']:.{p}f}, G={profile['median_g']:.{p}f}, B={profile['median_b']:.{p}f}<br>"
+            f"<b>Разброс:</b> R={profile['std_r']:.{p + 1}f}, G={profile['std_g']:.{p + 1}f}, B={profile['std_b']:.{p + 1}f}<br>"
+            f"<b>HSV (сред.):</b> H={hsv['avg_h']:.1f}, S={hsv['avg_s']:.1f}, V={hsv['avg_v']:.1f}<br>"
+            f"<b>LAB (сред.):</b> L*={lab['avg_l']:.2f}, a*={lab['avg_a']:+.2f}, b*={lab['avg_b']:+.2f}<br>"
+            f"<b>Уникальных цветов:</b> {profile['unique_count']}"
+        )
+
+        stats = self.current_stats
+        if stats:
+            rows = []
+            for c in 'rgb':
+                diff = stats[c] - profile[c]
+                ratio = stats[c] / profile[c] if profile[c] else 0
+                z = diff / profile[f'std_{c}'] if profile[f'std_{c}'] else 0
+                rows.append(f"{c.upper()}: {diff:+.{p}f} (x{ratio:.3f}, {z:+.2f}σ)")
+            text += "<br><hr><br><b>Выделение - изображение:</b><br>" + "<br>".join(rows)
+
+        self.lbl_profile.setText(text)
+
+    def show_profile_histogram(self):
+        if not self.image_profile:
+            QMessageBox.information(self, "Изображение", "Статистика изображения ещё рассчитывается.")
+            return
+        self.histogram.set_data(*self.image_profile['hist'])
+        self.viz_tabs.setCurrentWidget(self.histogram)
+
+    def fill_color_table(self, colors, count_labels, max_value=255):
+        self.table.setRowCount(len(colors))
+
+        # Preview colours are shown in 8 bits whatever the image depth
+        preview_scale = 255.0 / max_value
+        is_float = np.issubdtype(np.asarray(colors).dtype, np.floating)
+        fmt = ("{:.0f}" if max_value > 1 else "{:.4f}") if is_float else "{}"
+
+        for i, (color, count) in enumerate(zip(colors, count_labels)):
+            self.table.setItem(i, 0, QTableWidgetItem(fmt.format(color[0])))
+            self.table.setItem(i, 1, QTableWidgetItem(fmt.format(color[1])))
+            self.table.setItem(i, 2, QTableWidgetItem(fmt.format(color[2])))
+            self.table.setItem(i, 3, QTableWidgetItem(count))
+
+            # Color preview item
+            color_item = QTableWidgetItem()
+            preview = np.clip(np.asarray(color, dtype=np.float64) * preview_scale, 0, 255).astype(int)
+            color_item.setBackground(QColor(int(preview[0]), int(preview[1]), int(preview[2])))
+            self.table.setItem(i, 4, color_item)
+
+    def table_palette_options(self):
+        """ (n_colors, method) of the colour table palette, None when it lists the unique colours """
+        method = self.cb_color_mode.currentData()
+        return (self.sb_palette_size.value(), method) if method else None
+
+    def get_palette(self, image_path, rect=None, shape=None, n_colors=8, method='kmeans', img_arr=None):
+        return self.result_cache.get_or_compute(
+            'palette', image_path, (rect, shape, n_colors, method),
+            lambda: palette.calculate_palette(image_path, rect, shape, n_colors, method, img_arr))
+
+    def refresh_color_table(self):
+        if self.current_stats:
+            self.last_calculated_params = None
+            self.calculate_stats()
+
+    def export_palettes(self):
+        """ Palettes of the whole image for every loaded image """
+        if not self.image_paths:
+            QMessageBox.warning(self, "Ошибка", "Нет загруженных изображений.")
+            return
+
+        file_name, _ = QFileDialog.getSaveFileName(self, "Сохранить палитры", self.last_dir, "Excel файлы (*.xlsx);;CSV файлы (*.csv)")
+        if not file_name:
+            return
+
+        n_colors = self.sb_palette_size.value()
+        method = self.cb_color_mode.currentData() or 'kmeans'
+        headers = ["Изображение", "№", "R", "G", "B", "Пикселей", "Доля, %"]
+
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            params = (None, None, n_colors, method)
+            palettes = {path: self.result_cache.lookup('palette', path, params) for path in self.image_paths}
+            computed = palette.calculate_batch_palettes([p for p, r in palettes.items() if r is None], n_colors, method)
+            for path, palette_result in computed.items():
+                palettes[path] = self.result_cache.get_or_compute('palette', path, params, lambda: palette_result)
+
+            rows = []
+            for path, palette_result in palettes.items():
+                if not palette_result:
+                    continue
+                for i, (color, count, share) in enumerate(zip(palette_result['colors'], palette_result['counts'], palette_result['coverage']), 1):
+                    rows.append([os.path.basename(path), i, float(color[0]), float(color[1]), float(color[2]),
+                                 int(count), float(share * 100)])
+
+            if file_name.endswith('.xlsx'):
+                import xlsxwriter
+                workbook = xlsxwriter.Workbook(file_name)
+                worksheet = workbook.add_worksheet("Палитры")
+                header_format = workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1})
+                for col, header in enumerate(headers):
+                    worksheet.write(0, col, header, header_format)
+                for r, row in enumerate(rows, 1):
+                    worksheet.write_row(r, 0, row)
+                worksheet.set_column(0, 0, 25)
+                workbook.close()
+            else:
+                with open(file_name, 'w', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(headers)
+                    writer.writerows(rows)
+
+            QMessageBox.information(self, "Успех", f"Палитры сохранены в {file_name}")
+        except ImportError:
+            QMessageBox.critical(self, "Ошибка", "Установите xlsxwriter: pip install xlsxwriter")
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить: {e}")
+        finally:
+            QApplication.restoreOverrideCursor()
+
+    def open_video(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "Открыть видео", self.last_dir,
+                                                   "Видео (*.mp4 *.avi *.mov *.mkv *.m4v *.wmv *.mpg *.mpeg)")
+        if file_name:
+            self.add_video(file_name)
+
+    def add_video(self, video_path):
+        """ Adds the first frame of a video to the image list, regions are placed on it """
+        try:
+            preview = video.preview_frame_path(video_path)
+        except Exception as e:
+            print(f"Error reading video: {e}")
+            preview = None
+        if not preview:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось открыть видео:\n{video_path}")
+            return
+
+        self.video_sources[preview] = video_path
+        self.load_images([preview])
+        self.last_dir = os.path.dirname(video_path)
+        self.settings.setValue("last_dir", self.last_dir)
+        self.image_list.setCurrentRow(self.image_paths.index(preview))
+        self.stats_tabs.setCurrentWidget(self.video_tab)
+
+    def frame_source(self):
+        """ Video file of the current preview frame, or the numbered sequence of the current image """
+        image_path = self.viewer.image_path
+        if not image_path:
+            return None
+        if image_path in self.video_sources:
+            return self.video_sources[image_path]
+        paths = video.sequence_paths(image_path)
+        return paths if len(paths) > 1 else None
+
+    def analysis_rois(self):
+        """ The ROI layer, or the current selection as a single region if there are no ROIs """
+        rois = self.viewer.get_rois()
+        if not rois:
+            if self.viewer.current_tool in MASK_TOOLS:
+                shape = self.viewer.get_selection_shape()
+                rois = [{'name': "Выделение", 'shape': shape}] if shape else []
+            else:
+                rect = self.viewer.get_selection_rect()
+                rois = [{'name': "Выделение", 'rect': rect}] if rect else []
+        return rois
+
+    def calculate_frame_series(self):
+        source = self.frame_source()
+        if source is None:
+            QMessageBox.warning(self, "Ошибка", "Откройте видео или кадр нумерованной последовательности (frame_0001.png, ...).")
+            return
+        if self.series_worker is not None:
+            return
+
+        rois = self.analysis_rois()
+        cell_size = self.sb_cell_size.value() if self.cb_series_grid.isChecked() else None
+        if not rois and not cell_size:
+            QMessageBox.warning(self, "Ошибка", "Добавьте области, выделите участок или включите сетку.")
+            return
+
+        self.series_cancel = threading.Event()
+        self.btn_frame_series.setEnabled(False)
+        self.lbl_video.setText("Обработка кадров...")
+        self.series_worker = start_worker(
+            video.calculate_frame_series, source, rois, cell_size, self.sb_frame_step.value(),
+            cancel=self.series_cancel,
+            on_progress=self.on_frame_series_progress,
+            on_finished=self.on_frame_series)
+
+    def stop_frame_series(self):
+        if self.series_cancel is not None:
+            self.series_cancel.set()
+
+    def on_frame_series_progress(self, values):
+        done, total = values
+        self.lbl_video.setText(f"Обработано кадров: {done}" + (f" из {total}" if total else ""))
+
+    def on_frame_series(self, result):
+        self.series_worker = None
+        self.series_cancel = None
+        self.btn_frame_series.setEnabled(True)
+        if not result:
+            self.lbl_video.setText("Не удалось обработать кадры.")
+            return
+        if len(result['frames']) == 0:
+            self.lbl_video.setText("Остановлено, кадры не обработаны.")
+            return
+
+        self.frame_series = result
+        source = result['source']
+        name = os.path.basename(source) if isinstance(source, str) else f"{os.path.basename(source[0])} ... ({len(source)} файлов)"
+        text = f"<b>Источник:</b> {name}<br><b>Кадров:</b> {len(result['frames'])}"
+        if result['fps']:
+            text += f", {result['fps']:.2f} кадр/с, {result['times'][-1]:.2f} с"
+        if result['grid'] is not None:
+            rows, cols = result['grid'].shape[1:3]
+            text += f"<br><b>Сетка:</b> {cols} x {rows} ячеек по {result['cell_size']} px"
+        for roi in result['rois']:
+            series = roi['series']
+            text += (
+                f"<br><b>{roi['name']}:</b> R={series['avg_r'].mean():.1f}±{series['avg_r'].std():.2f}, "
+                f"G={series['avg_g'].mean():.1f}±{series['avg_g'].std():.2f}, "
+                f"B={series['avg_b'].mean():.1f}±{series['avg_b'].std():.2f} (среднее ± разброс по кадрам)"
+            )
+        self.lbl_video.setText(text)
+
+        self.cb_series_roi.blockSignals(True)
+        self.cb_series_roi.clear()
+        for roi in result['rois']:
+            self.cb_series_roi.addItem(roi['name'])
+        self.cb_series_roi.blockSignals(False)
+        self.update_series_plot()
+        self.viz_tabs.setCurrentWidget(self.time_series)
+
+    def update_series_plot(self):
+        result = self.frame_series
+        index = self.cb_series_roi.currentIndex()
+        if not result or not (0 <= index < len(result['rois'])):
+            self.time_series.set_data(None, [])
+            return
+
+        series = result['rois'][index]['series']
+        colors = {'r': QColor(255, 50, 50), 'g': QColor(50, 255, 50), 'b': QColor(50, 50, 255)}
+        curves = [(series[key], colors[key[-1]]) for key in self.cb_series_metric.currentData()]
+        self.time_series.set_data(result['times'], curves, "с" if result['fps'] else "кадр")
+
+    def export_frame_series(self):
+        """ Per-frame region stats (and per-cell grid means) to xlsx / csv """
+        result = self.frame_series
+        if not result:
+            QMessageBox.warning(self, "Ошибка", "Сначала рассчитайте статистику по кадрам.")
+            return
+
+        file_name, _ = QFileDialog.getSaveFileName(self, "Сохранить временной ряд", self.last_dir, "Excel файлы (*.xlsx);;CSV файлы (*.csv)")
+        if not file_name:
+            return
+
+        headers = ["Кадр", "Время", "Область", "Среднее R", "Среднее G", "Среднее B",
+                   "Стд.Откл R", "Стд.Откл G", "Стд.Откл B", "Norm R (G=1)", "Norm B (G=1)"]
+        rows = []
+        for roi in result['rois']:
+            series = roi['series']
+            for i, (frame, t) in enumerate(zip(result['frames'], result['times'])):
+                rows.append([int(frame), float(t), roi['name']] + [float(series[m][i]) for m in video.SERIES_METRICS])
+
+        grid_headers = ["Кадр", "Время", "X", "Y", "Среднее R", "Среднее G", "Среднее B"]
+        grid_rows = []
+        if result['grid'] is not None:
+            cell_size = result['cell_size']
+            for frame, t, means in zip(result['frames'], result['times'], result['grid']):
+                for (row, col), value in np.ndenumerate(means[:, :, 0]):
+                    grid_rows.append([int(frame), float(t), col * cell_size, row * cell_size,
+                                      float(value), float(means[row, col, 1]), float(means[row, col, 2])])
+
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            if file_name.endswith('.xlsx'):
+                import xlsxwriter
+                workbook = xlsxwriter.Workbook(file_name, {'constant_memory': True})
+                header_format = workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1})
+                for title, sheet_headers, sheet_rows in (("Области", headers, rows), ("Сетка", grid_headers, grid_rows)):
+                    if not sheet_rows:
+                        continue
+                    worksheet = workbook.add_worksheet(title)
+                    for col, header in enumerate(sheet_headers):
+                        worksheet.write(0, col, header, header_format)
+                    for r, row in enumerate(sheet_rows, 1):
+                        worksheet.write_row(r, 0, row)
+                workbook.close()
+            else:
+                with open(file_name, 'w', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(headers)
+                    writer.writerows(rows)
+                if grid_rows:
+                    grid_file = os.path.splitext(file_name)[0] + "_grid.csv"
+                    with open(grid_file, 'w', newline='', encoding='utf-8') as f:
+                        writer = csv.writer(f)
+                        writer.writerow(grid_headers)
+                        writer.writerows(grid_rows)
+
+            QMessageBox.information(self, "Успех", f"Временной ряд сохранён в {file_name}")
+        except ImportError:
+            QMessageBox.critical(self, "Ошибка", "Установите xlsxwriter: pip install xlsxwriter")
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить: {e}")
+        finally:
+            QApplication.restoreOverrideCursor()
+
+    def choose_watch_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Папка для наблюдения", self.watch_folder or self.last_dir)
+        if folder:
+            self.watch_folder = folder
+            self.update_watch_status()
+
+    def choose_watch_output(self):
+        start = self.watch_output or os.path.join(self.watch_folder or self.last_dir, "watch_results.csv")
+        file_name, _ = QFileDialog.getSaveFileName(self, "Файл результатов", start, "CSV Files (*.csv)")
+        if file_name:
+            self.watch_output = file_name
+            self.update_watch_status()
+
+    def watch_output_path(self):
+        return self.watch_output or os.path.join(self.watch_folder, "watch_results.csv")
+
+    def save_watch_config(self):
+        rois = self.analysis_rois()
+        if not rois and not self.cb_watch_grid.isChecked():
+            QMessageBox.warning(self, "Ошибка", "Добавьте области, выделите участок или включите сетку.")
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "Сохранить настройку", os.path.join(self.last_dir, "watch.json"),
+                                                   "JSON (*.json)")
+        if not file_name:
+            return
+        try:
+            cell_size, layout = self.watch_grid_layout()
+            watcher.save_watch_config(file_name, rois, cell_size, layout)
+            QMessageBox.information(self, "Успех", f"Настройка сохранена:\n{file_name}")
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить файл:\n{e}")
+
+    def watch_grid_layout(self):
+        """ (cell size, layout) of the watch grid from the 'Сетка' group, (None, {}) if the grid is off """
+        if not self.cb_watch_grid.isChecked():
+            return None, {}
+        layout = self.grid_layout()
+        if layout['region'] is not None:
+            layout['region'] = tuple(layout['region'])
+        return layout.pop('cell_size'), layout
+
+    def start_watch(self):
+        if self.watch_job is not None:
+            return
+        if not self.watch_folder or not os.path.isdir(self.watch_folder):
+            QMessageBox.warning(self, "Ошибка", "Выберите папку для наблюдения.")
+            return
+
+        rois = self.analysis_rois()
+        cell_size, layout = self.watch_grid_layout()
+        if not rois and not cell_size:
+            QMessageBox.warning(self, "Ошибка", "Добавьте области, выделите участок или включите сетку.")
+            return
+
+        # Regions and grid layout are fixed for the whole run, so every row of
+        # the export is computed the same way
+        self.watch_appender = watcher.ResultAppender(self.watch_output_path())
+        try:
+            self.folder_watcher = watcher.FolderWatcher(self.watch_folder, known=self.watch_appender.done_files())
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось открыть папку:\n{e}")
+            return
+        self.watch_job = (rois, cell_size, layout)
+        self.watch_done = 0
+        self.btn_watch_start.setEnabled(False)
+        self.watch_timer.start(int(watcher.POLL_INTERVAL * 1000))
+        self.update_watch_status()
+
+    def stop_watch(self):
+        # Results of files still being analysed are dropped (see on_watch_result)
+        self.watch_timer.stop()
+        self.watch_job = None
+        self.folder_watcher = None
+        self.btn_watch_start.setEnabled(True)
+        self.update_watch_status()
+
+    def poll_watch_folder(self):
+        if self.folder_watcher is None:
+            return
+        try:
+            new_files = self.folder_watcher.poll()
+        except OSError as e:
+            print(f"Error polling folder: {e}")
+            return
+
+        job = self.watch_job
+        rois, cell_size, layout = job
+        for path in new_files:
+            self.watch_workers[path] = start_worker(
+                watcher.analyze_file, path, rois, cell_size, layout,
+                on_finished=lambda result, job=job: self.on_watch_result(job, result),
+                on_error=lambda message, p=path: self.on_watch_error(p, message))
+        if new_files:
+            self.update_watch_status()
+
+    def on_watch_result(self, job, result):
+        self.watch_workers.pop(result['path'], None)
+        # Submitted by a watch that has been stopped: its settings (and maybe
+        # its export) are not those of the current one
+        if job is not self.watch_job:
+            self.update_watch_status()
+            return
+        try:
+            self.watch_appender.append(result)
+        except Exception as e:
+            print(f"Error writing watch results: {e}")
+        self.watch_done += 1
+
+        name = os.path.basename(result['path'])
+        for res in result['rois']:
+            g = res['g']
+            values = [res['r'], res['g'], res['b'], res['r'] / g if g != 0 else 0, res['b'] / g if g != 0 else 0]
+            row = self.watch_table.rowCount()
+            self.watch_table.insertRow(row)
+            self.watch_table.setItem(row, 0, QTableWidgetItem(name))
+            self.watch_table.setItem(row, 1, QTableWidgetItem(res['name']))
+            for col, value in enumerate(values, 2):
+                self.watch_table.setItem(row, col, QTableWidgetItem(("{:.4f}" if col >= 5 else "{:.1f}").format(value)))
+        if not result['rois']:
+            row = self.watch_table.rowCount()
+            self.watch_table.insertRow(row)
+            self.watch_table.setItem(row, 0, QTableWidgetItem(name))
+            self.watch_table.setItem(row, 1, QTableWidgetItem(f"Сетка: {len(result['grid'])} ячеек"))
+        self.watch_table.scrollToBottom()
+
+        self.load_images([result['path']])
+        self.update_watch_status()
+
+    def on_watch_error(self, path, message):
+        self.watch_workers.pop(path, None)
+        print(f"Error analysing {path}: {message}")
+        self.update_watch_status()
+
+    def update_watch_status(self):
+        if not self.watch_folder:
+            self.lbl_watch.setText("Папка не выбрана")
+            return
+        state = "идёт наблюдение" if self.watch_job is not None else "остановлено"
+        text = f"<b>Папка:</b> {self.watch_folder} ({state})<br><b>Результаты:</b> {self.watch_output_path()}"
+        text += f"<br><b>Обработано файлов:</b> {self.watch_done}"
+        if self.watch_workers:
+            text += f", в обработке: {len(self.watch_workers)}"
+        self.lbl_watch.setText(text)
+
+    def update_lab_text(self):
+        """ CIELAB stats of the selection and Delta E to the reference colour / overlay """
+        stats = self.current_stats
+        if not stats:
+            self.lbl_lab.setText("")
+            return
+
+        method = self.cb_de_method.currentData()
+        name = self.cb_de_method.currentText()
+        lab = stats.get('lab', {})
+        text = (
+            f"<b>L*:</b> {lab.get('avg_l', 0):.2f} (Сред.), {lab.get('median_l', 0):.2f} (Мед.), ст.откл {lab.get('std_l', 0):.2f}<br>"
+            f"<b>a*:</b> {lab.get('avg_a', 0):+.2f} (Сред.), {lab.get('median_a', 0):+.2f} (Мед.), ст.откл {lab.get('std_a', 0):.2f}<br>"
+            f"<b>b*:</b> {lab.get('avg_b', 0):+.2f} (Сред.), {lab.get('median_b', 0):+.2f} (Мед.), ст.откл {lab.get('std_b', 0):.2f}"
+        )
+
+        if self.reference_color is not None:
+            ref = self.reference_color
+            ref_rgb = (ref.red(), ref.green(), ref.blue())
+            # Per pixel, through the unique colours of the selection
+            max_value = stats.get('max_value', 255)
+            _, sm = colorimetry.delta_e_to_reference(stats['unique_colors'], ref_rgb, method, stats['counts'], max_value)
+            _, mean_sm = colorimetry.delta_e_to_reference(np.array([[stats['r'], stats['g'], stats['b']]]), ref_rgb, method,
+                                              max_value=max_value)
+            text += (
+                f"<br><hr><br>"
+                f"<b>Эталон:</b> <span style='color: {ref.name()}'>■</span> RGB({ref_rgb[0]}, {ref_rgb[1]}, {ref_rgb[2]})<br>"
+                f"<b>{name} по пикселям:</b> сред. {sm['mean']:.2f}, мед. {sm['median']:.2f}, "
+                f"ст.откл {sm['std']:.2f}, 95% {sm['p95']:.2f}, макс. {sm['max']:.2f}<br>"
+                f"<b>{name} среднего цвета:</b> {mean_sm['mean']:.2f}"
+            )
+
+        overlay_stats = self.current_overlay_stats
+        if overlay_stats:
+            base_mean = np.array([[stats['r'], stats['g'], stats['b']]], dtype=np.float32)
+            overlay_mean = np.array([[overlay_stats['r'], overlay_stats['g'], overlay_stats['b']]], dtype=np.float32)
+            base_lab = colorimetry.rgb_to_lab(base_mean, stats.get('max_value', 255))
+            overlay_lab = colorimetry.rgb_to_lab(overlay_mean, overlay_stats.get('max_value', 255))
+            de = float(colorimetry.delta_e(base_lab, overlay_lab, method)[0])
+            text += f"<br><hr><br><b>{name} средних цветов (База - Наложение):</b> {de:.2f}"
+
+        self.lbl_lab.setText(text)
+
+    def choose_reference_color(self):
+        initial = self.reference_color or QColor(128, 128, 128)
+        color = QColorDialog.getColor(initial, self, "Эталонный цвет")
+        if not color.isValid():
+            return
+        self.reference_color = color
+        self.settings.setValue("reference_color", color.name())
+        self.update_lab_text()
+
+
+    def add_roi(self):
+        # Mask tools add their current shape, otherwise the rectangle selection
+        shape = self.viewer.get_selection_shape() if self.viewer.current_tool in MASK_TOOLS else None
+        rect = None if shape else self.viewer.get_selection_rect()
+        if not rect and not shape:
+            QMessageBox.warning(self, "Ошибка", "Сначала загрузите изображение и выделите область.")
+            return
+
+        self.roi_counter += 1
+        self.viewer.add_roi(f"ROI {self.roi_counter}", rect, shape)
+
+    def remove_rois(self):
+        if not self.viewer.remove_selected_rois():
+            QMessageBox.information(self, "Области", "Выберите области на изображении щелчком мыши.")
+
+    def clear_rois(self):
+        self.viewer.clear_rois()
+        self.roi_table.setRowCount(0)
+        self.roi_counter = 0
+
+    def get_roi_results(self, image_path, rois):
+        # ROI list is part of the cache key, so moving a region recomputes only that image
+        key = tuple((roi['name'], roi.get('rect'), roi.get('shape')) for roi in rois)
+        return self.result_cache.get_or_compute(
+            'roi_stats', image_path, key,
+            lambda: processor.calculate_roi_stats(image_path, rois))
+
+    def calculate_rois(self):
+        rois = self.viewer.get_rois()
+        if not rois or not self.viewer.image_path:
+            self.roi_table.setRowCount(0)
+            return
+
+        results = self.get_roi_results(self.viewer.image_path, rois)
+        roi_by_name = {roi['name']: roi for roi in rois}
+
+        self.roi_table.setRowCount(len(results))
+        for i, res in enumerate(results):
+            g = res['g']
+            norm_r = res['r'] / g if g != 0 else 0
+            norm_b = res['b'] / g if g != 0 else 0
+
+            self.roi_table.setItem(i, 0, QTableWidgetItem(res['name']))
+            values = [res['r'], res['g'], res['b'], norm_r, norm_b, res['std_r'], res['std_g'], res['std_b']]
+            for col, value in enumerate(values, 1):
+                fmt = "{:.4f}" if col in (4, 5) else "{:.1f}" if col <= 3 else "{:.2f}"
+                self.roi_table.setItem(i, col, QTableWidgetItem(fmt.format(value)))
+
+            # Mean of the local statistics map inside the region
+            local = ""
+            roi = roi_by_name.get(res['name'])
+            if self.local_map and roi:
+                shape = roi.get('shape') or {'type': 'rect', 'rect': roi['rect']}
+                sample = local_stats.map_region_stats(self.local_map['values'], shape)
+                if sample:
+                    local = f"{sample['mean']:.4f}"
+            self.roi_table.setItem(i, 9, QTableWidgetItem(local))
+
+    def roi_row_values(self, image_path, res):
+        g = res['g']
+        norm_r = res['r'] / g if g != 0 else 0
+        norm_b = res['b'] / g if g != 0 else 0
+        x, y, w, h = res['rect']
+        return [
+            os.path.basename(image_path), res['name'], x, y, w, h,
+            res['r'], res['g'], res['b'], norm_r, norm_b,
+            res['median_r'], res['median_g'], res['median_b'],
+            res['std_r'], res['std_g'], res['std_b']
+        ]
+
+    def export_rois(self):
+        """ Exports every ROI of the layer for every loaded image """
+        rois = self.viewer.get_rois()
+        if not rois or not self.image_paths:
+            QMessageBox.warning(self, "Ошибка", "Добавьте хотя бы одну область и загрузите изображения.")
+            return
+
+        file_name, _ = QFileDialog.getSaveFileName(self, "Сохранить области", self.last_dir, "Excel файлы (*.xlsx);;CSV файлы (*.csv)")
+        if not file_name:
+            return
+
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            rows = []
+            for image_path in self.image_paths:
+                for res in self.get_roi_results(image_path, rois):
+                    rows.append(self.roi_row_values(image_path, res))
+
+            if file_name.endswith('.xlsx'):
+                import xlsxwriter
+
+                workbook = xlsxwriter.Workbook(file_name)
+                worksheet = workbook.add_worksheet()
+                header_format = workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1})
+                num_format = workbook.add_format({'num_format': '0.00'})
+
+                for col_num, header in enumerate(ROI_HEADERS):
+                    worksheet.write(0, col_num, header, header_format)
+
+                for row_num, row in enumerate(rows, 1):
+                    for col_num, data in enumerate(row):
+                        # Apply number format to stats (columns after X, Y, W, H)
+                        if col_num >= 6:
+                            worksheet.write_number(row_num, col_num, data, num_format)
+                        else:
+                            worksheet.write(row_num, col_num, data)
+
+                for i, header in enumerate(ROI_HEADERS):
+                    worksheet.set_column(i, i, max(len(header) + 2, 10))
+                workbook.close()
+            else:
+                with open(file_name, 'w', newline='', encoding='utf-8-sig') as f:
+                    writer = csv.writer(f, delimiter=';')
+                    writer.writerow(ROI_HEADERS)
+                    for row in rows:
+                        writer.writerow(row[:6] + [f"{v:.2f}".replace('.', ',') for v in row[6:]])
+
+            QApplication.restoreOverrideCursor()
+            QMessageBox.information(self, "Успех", f"Данные {len(rows)} областей сохранены в {file_name}")
+
+        except ImportError:
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(self, "Ошибка", "Для сохранения в Excel требуется библиотека xlsxwriter.\nУстановите её командой: pip install xlsxwriter")
+        except Exception as e:
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(self, "Ошибка", f"Ошибка при экспорте:\n{e}")
 
     def copy_command(self):
         if self.last_command:
@@ -585,7 +2620,14 @@ class MainWindow(QMainWindow):
             # Ask if user wants to enable grid or proceed with current settings?
             pass
 
-        cell_size = self.sb_cell_size.value()
+        layout = self.grid_layout()
+        cell_size = layout['cell_size']
+        try:
+            quantiles = self.grid_quantile_options()
+        except ValueError:
+            QMessageBox.warning(self, "Ошибка", "Укажите перцентили от 0 до 100 через запятую, например: 5, 50, 95.")
+            return
+        palette_options = self.grid_palette_options()
         
         file_name, _ = QFileDialog.getSaveFileName(self, "Сохранить Сетку", self.last_dir, "Excel файлы (*.xlsx);;CSV файлы (*.csv)")
         if not file_name:
@@ -594,7 +2636,10 @@ class MainWindow(QMainWindow):
         # Show wait cursor
         QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
         try:
-            results = calculate_grid_stats(self.viewer.image_path, cell_size)
+            image_path = self.viewer.image_path
+            results = self.result_cache.get_or_compute(
+                'grid_cells', image_path, self.grid_layout_key(layout) + (quantiles, palette_options),
+                lambda: self.compute_grid_results(layout, quantiles, palette_options))
             
             if not results:
                 QApplication.restoreOverrideCursor()
@@ -606,40 +2651,7 @@ class MainWindow(QMainWindow):
                 
                 workbook = xlsxwriter.Workbook(file_name)
                 worksheet = workbook.add_worksheet()
-                
-                # Formats
-                header_format = workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1})
-                num_format = workbook.add_format({'num_format': '0.00'})
-                
-                headers = ["X", "Y", "Среднее R", "Среднее G", "Среднее B", "Norm R (G=1)", "Norm B (G=1)", "Стд.Откл R", "Стд.Откл G", "Стд.Откл B"]
-                
-                # Write Headers
-                for col_num, header in enumerate(headers):
-                    worksheet.write(0, col_num, header, header_format)
-                
-                # Write Data
-                for row_num, r in enumerate(results, 1):
-                    avg_g = r['avg_g']
-                    norm_r = r['avg_r'] / avg_g if avg_g != 0 else 0
-                    norm_b = r['avg_b'] / avg_g if avg_g != 0 else 0
-                    
-                    data_row = [
-                        r['x'], r['y'],
-                        r['avg_r'], r['avg_g'], r['avg_b'],
-                        norm_r, norm_b,
-                        r['std_r'], r['std_g'], r['std_b']
-                    ]
-                    
-                    for col_num, data in enumerate(data_row):
-                        # Apply number format to floats (columns 2 to 9)
-                        if 2 <= col_num <= 9:
-                            worksheet.write_number(row_num, col_num, data, num_format)
-                        else:
-                            worksheet.write(row_num, col_num, data)
-
-                # Auto-fit columns
-                for i, header in enumerate(headers):
-                    worksheet.set_column(i, i, max(len(header) + 2, 10)) # Simple auto-width based on header + padding
+                self.write_grid_worksheet(workbook, worksheet, results)
                 
                 # Create and insert annotated image
                 try:
@@ -647,7 +2659,7 @@ class MainWindow(QMainWindow):
                      temp_dir = tempfile.gettempdir()
                      temp_img_path = os.path.join(temp_dir, "grid_map_temp.png")
                      
-                     if create_annotated_image(self.viewer.image_path, results, cell_size, temp_img_path):
+                     if processor.create_annotated_image(self.viewer.image_path, results, cell_size, temp_img_path):
                          map_sheet = workbook.add_worksheet("Карта")
                          map_sheet.insert_image('A1', temp_img_path)
                 except Exception as img_err:
@@ -667,25 +2679,11 @@ class MainWindow(QMainWindow):
                     writer = csv.writer(f, delimiter=';') # Use semicolon for Excel in many regions
                     
                     # Headers
-                    writer.writerow(["X", "Y", "Среднее R", "Среднее G", "Среднее B", "Norm R (G=1)", "Norm B (G=1)", "Стд.Откл R", "Стд.Откл G", "Стд.Откл B"])
+                    writer.writerow(self.grid_headers(results))
                     
+                    extra_keys = self.grid_extra_keys(results)
                     for r in results:
-                        # Calculate normalized values
-                        avg_g = r['avg_g']
-                        norm_r = r['avg_r'] / avg_g if avg_g != 0 else 0
-                        norm_b = r['avg_b'] / avg_g if avg_g != 0 else 0
-
-                        writer.writerow([
-                            r['x'], r['y'],
-                            f"{r['avg_r']:.2f}".replace('.', ','), 
-                            f"{r['avg_g']:.2f}".replace('.', ','), 
-                            f"{r['avg_b']:.2f}".replace('.', ','),
-                            f"{norm_r:.2f}".replace('.', ','),
-                            f"{norm_b:.2f}".replace('.', ','),
-                            f"{r['std_r']:.2f}".replace('.', ','), 
-                            f"{r['std_g']:.2f}".replace('.', ','), 
-                            f"{r['std_b']:.2f}".replace('.', ',')
-                        ])
+                        writer.writerow(self.grid_csv_row(r, extra_keys))
             
             QApplication.restoreOverrideCursor()
             QMessageBox.information(self, "Успех", f"Данные сетки ({len(results)} ячеек) сохранены в {file_name}")
@@ -696,3 +2694,134 @@ class MainWindow(QMainWindow):
         except Exception as e:
             QApplication.restoreOverrideCursor()
             QMessageBox.critical(self, "Ошибка", f"Ошибка при экспорте:\n{e}")
+
+    def grid_extra_keys(self, results):
+        """ Percentile / HSV / LAB / palette columns of the grid results, in their order """
+        return [k for k in results[0] if k not in GRID_BASE_KEYS] if results else []
+
+    def grid_headers(self, results):
+        headers = list(GRID_HEADERS)
+        for key in self.grid_extra_keys(results):
+            stat, channel = key.split('_', 1)
+            if stat == 'palette':
+                headers.append(f"Палитра {channel}, %")
+                continue
+            label = {'avg': "Среднее", 'std': "Стд.Откл", 'median': "Медиана"}.get(stat, stat.upper())
+            headers.append(f"{label} {GRID_CHANNEL_LABELS.get(channel, channel)}")
+        return headers
+
+    def grid_row_values(self, r, extra_keys=()):
+        """ Row of the grid export for one cell (coordinates first, then numbers) """
+        # Calculate normalized values
+        avg_g = r['avg_g']
+        norm_r = r['avg_r'] / avg_g if avg_g != 0 else 0
+        norm_b = r['avg_b'] / avg_g if avg_g != 0 else 0
+
+        return [
+            r['x'], r['y'], r['w'], r['h'],
+            r['avg_r'], r['avg_g'], r['avg_b'],
+            norm_r, norm_b,
+            r['std_r'], r['std_g'], r['std_b']
+        ] + [r[k] for k in extra_keys]
+
+    def grid_csv_row(self, r, extra_keys=()):
+        values = self.grid_row_values(r, extra_keys)
+        return values[:4] + [f"{v:.2f}".replace('.', ',') for v in values[4:]]
+
+    def write_grid_worksheet(self, workbook, worksheet, results):
+        # Formats
+        header_format = workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1})
+        num_format = workbook.add_format({'num_format': '0.00'})
+
+        # Write Headers
+        headers = self.grid_headers(results)
+        for col_num, header in enumerate(headers):
+            worksheet.write(0, col_num, header, header_format)
+
+        # Write Data
+        extra_keys = self.grid_extra_keys(results)
+        for row_num, r in enumerate(results, 1):
+            for col_num, data in enumerate(self.grid_row_values(r, extra_keys)):
+                # Apply number format to floats (all columns after X, Y, W, H)
+                if col_num >= 4:
+                    worksheet.write_number(row_num, col_num, data, num_format)
+                else:
+                    worksheet.write(row_num, col_num, data)
+
+        # Auto-fit columns
+        for i, header in enumerate(headers):
+            worksheet.set_column(i, i, max(len(header) + 2, 10)) # Simple auto-width based on header + padding
+
+    def export_grid_sweep(self):
+        """ Exports grid stats for a series of cell sizes, the pixels are read only once """
+        if not self.viewer.image_path:
+            QMessageBox.warning(self, "Ошибка", "Изображение не загружено.")
+            return
+
+        try:
+            sizes = sorted({int(v) for v in self.le_sweep_sizes.text().replace(';', ',').split(',') if v.strip()})
+        except ValueError:
+            sizes = []
+        sizes = [c for c in sizes if c > 0]
+        if not sizes:
+            QMessageBox.warning(self, "Ошибка", "Укажите размеры ячеек через запятую, например: 10, 20, 40.")
+            return
+        self.settings.setValue("sweep_sizes", self.le_sweep_sizes.text())
+        try:
+            quantiles = self.grid_quantile_options()
+        except ValueError:
+            QMessageBox.warning(self, "Ошибка", "Укажите перцентили от 0 до 100 через запятую, например: 5, 50, 95.")
+            return
+        palette_options = self.grid_palette_options()
+
+        file_name, _ = QFileDialog.getSaveFileName(self, "Сохранить серию сеток", self.last_dir, "Excel файлы (*.xlsx);;CSV файлы (*.csv)")
+        if not file_name:
+            return
+
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            image_path = self.viewer.image_path
+
+            # One pyramid per group of sizes with a large enough common divisor
+            # (a rectangular / overlapping grid scales its height and stride
+            # with the size and goes through WindowGrid instead)
+            window_layout = processor.is_window_layout(**self.grid_layout())
+            all_results = {}
+            for base, group in grid_engine.pyramid_groups(sizes):
+                if not window_layout:
+                    self.get_grid_pyramid(base)
+                for cell_size in group:
+                    layout = self.grid_layout(cell_size)
+                    all_results[cell_size] = self.result_cache.get_or_compute(
+                        'grid_cells', image_path, self.grid_layout_key(layout) + (quantiles, palette_options),
+                        lambda: self.compute_grid_results(layout, quantiles, palette_options))
+            all_results = {c: all_results[c] for c in sizes}
+
+            if file_name.endswith('.xlsx'):
+                import xlsxwriter
+
+                workbook = xlsxwriter.Workbook(file_name)
+                for cell_size, results in all_results.items():
+                    worksheet = workbook.add_worksheet(f"Сетка {cell_size}")
+                    self.write_grid_worksheet(workbook, worksheet, results)
+                workbook.close()
+            else:
+                with open(file_name, 'w', newline='', encoding='utf-8-sig') as f:
+                    writer = csv.writer(f, delimiter=';')
+                    first = next((r for r in all_results.values() if r), [])
+                    writer.writerow(["Размер"] + self.grid_headers(first))
+                    extra_keys = self.grid_extra_keys(first)
+                    for cell_size, results in all_results.items():
+                        for r in results:
+                            writer.writerow([cell_size] + self.grid_csv_row(r, extra_keys))
+
+            QApplication.restoreOverrideCursor()
+            total = sum(len(r) for r in all_results.values())
+            QMessageBox.information(self, "Успех", f"Серия из {len(sizes)} сеток ({total} ячеек) сохранена в {file_name}")
+
+        except ImportError:
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(self, "Ошибка", "Для сохранения в Excel требуется библиотека xlsxwriter.\nУстановите её командой: pip install xlsxwriter")
+        except Exception as e:
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(self, "Ошибка", f"Ошибка при экспорте:\n{e}")
@@ -1,7 +1,40 @@
-from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsRectItem, QGraphicsPixmapItem, QGraphicsOpacityEffect, QGraphicsItem, QGraphicsLineItem
-from PyQt6.QtGui import QPixmap, QColor, QPen, QBrush, QCursor, QPainter
+import math
+from collections import OrderedDict
+from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsRectItem, QGraphicsPixmapItem, QGraphicsOpacityEffect, QGraphicsItem, QGraphicsLineItem, QGraphicsSimpleTextItem, QGraphicsPathItem
+from PyQt6.QtGui import QPixmap, QColor, QPen, QBrush, QCursor, QPainter, QImage, QPainterPath, QPainterPathStroker, QPolygonF
 from PyQt6.QtCore import Qt, QRectF, QPointF, pyqtSignal, QObject, QLineF
 
+from app.core.store_config import is_store_enabled
+from app.startup import LazyModule
+from app.ui.workers import start_worker
+
+# Loaded on first use, see app.startup
+np = LazyModule('numpy')
+image_store = LazyModule('app.core.image_store')
+colormap = LazyModule('app.core.colormap')
+masks = LazyModule('app.core.masks')
+processor = LazyModule('app.core.processor')
+display_modes = LazyModule('app.core.display_modes')
+
+# Tools that produce a mask selection (see app.core.masks for the shape format)
+MASK_TOOLS = ('polygon', 'ellipse', 'brush')
+
+
+def array_to_pixmap(img_arr):
+    """Converts an (H, W, 3) RGB array to QPixmap (high bit depths are reduced to 8 bits)"""
+    img_arr = np.ascontiguousarray(image_store.to_display_uint8(img_arr))
+    h, w, _ = img_arr.shape
+    # QImage only wraps the buffer, fromImage makes the copy we keep
+    qimage = QImage(img_arr.data, w, h, img_arr.strides[0], QImage.Format.Format_RGB888)
+    return QPixmap.fromImage(qimage)
+
+
+def rgba_to_qimage(rgba):
+    """Converts an (H, W, 4) uint8 RGBA array to a QImage that owns its data"""
+    h, w, _ = rgba.shape
+    rgba = np.ascontiguousarray(rgba)
+    return QImage(rgba.data, w, h, rgba.strides[0], QImage.Format.Format_RGBA8888).copy()
+
 
 class ResizableRectItem(QGraphicsRectItem):
     # Target size in screen pixels
@@ -169,6 +202,104 @@ class ResizableRectItem(QGraphicsRectItem):
         for hx, hy in handles:
             painter.drawRect(QRectF(hx, hy, s, s))
 
+class RoiRectItem(ResizableRectItem):
+    """Named region of the multi-ROI layer"""
+
+    def __init__(self, name, rect, parent=None):
+        super().__init__(rect, parent)
+        self.name = name
+
+        pen = QPen(QColor(255, 215, 0), 2)
+        pen.setCosmetic(True)
+        self.setPen(pen)
+        self.setBrush(QBrush(QColor(255, 215, 0, 40)))
+
+        # Label keeps its screen size at any zoom
+        self.label = QGraphicsSimpleTextItem(name, self)
+        self.label.setBrush(QBrush(QColor(255, 215, 0)))
+        self.label.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIgnoresTransformations)
+        self.label.setPos(self.rect().topLeft())
+
+    def setRect(self, *args):
+        super().setRect(*args)
+        self.label.setPos(self.rect().topLeft())
+
+    def get_image_rect(self):
+        """(x, y, w, h) in image coordinates"""
+        pos = self.scenePos()
+        r = self.rect()
+        return (int(pos.x() + r.x()), int(pos.y() + r.y()), int(r.width()), int(r.height()))
+
+def shape_to_path(shape):
+    """QPainterPath outline of a selection shape"""
+    path = QPainterPath()
+    kind = shape['type']
+
+    if kind == 'rect':
+        path.addRect(QRectF(*shape['rect']))
+    elif kind == 'ellipse':
+        path.addEllipse(QRectF(*shape['rect']))
+    elif kind == 'polygon':
+        path.addPolygon(QPolygonF([QPointF(x, y) for x, y in shape['points']]))
+        path.closeSubpath()
+    elif kind == 'brush':
+        r = shape['radius']
+        strokes = QPainterPath()
+        for stroke in shape['strokes']:
+            if len(stroke) == 1:
+                path.addEllipse(QPointF(*stroke[0]), r, r)
+                continue
+            strokes.moveTo(*stroke[0])
+            for x, y in stroke[1:]:
+                strokes.lineTo(x, y)
+
+        # Outline of the strokes painted with a round brush of the given radius
+        stroker = QPainterPathStroker()
+        stroker.setWidth(2 * r)
+        stroker.setCapStyle(Qt.PenCapStyle.RoundCap)
+        stroker.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
+        path.addPath(stroker.createStroke(strokes))
+        path = path.simplified()
+
+    return path
+
+class ShapeItem(QGraphicsPathItem):
+    """Mask selection (polygon, ellipse or brush) stored in image coordinates"""
+
+    def __init__(self, shape, color=QColor(255, 0, 0), parent=None):
+        super().__init__(parent)
+        pen = QPen(color, 2)
+        pen.setCosmetic(True)
+        self.setPen(pen)
+        self.setBrush(QBrush(QColor(color.red(), color.green(), color.blue(), 50)))
+        self.shape_data = None
+        self.set_shape(shape)
+
+    def set_shape(self, shape):
+        self.shape_data = shape
+        self.setPath(shape_to_path(shape))
+
+    def get_image_shape(self):
+        """Shape moved by the item position"""
+        pos = self.scenePos()
+        if pos.x() == 0 and pos.y() == 0:
+            return self.shape_data
+        return masks.translate_shape(self.shape_data, pos.x(), pos.y())
+
+class RoiShapeItem(ShapeItem):
+    """Named mask region of the multi-ROI layer"""
+
+    def __init__(self, name, shape, parent=None):
+        super().__init__(shape, QColor(255, 215, 0), parent)
+        self.name = name
+        self.setFlags(QGraphicsItem.GraphicsItemFlag.ItemIsMovable |
+                      QGraphicsItem.GraphicsItemFlag.ItemIsSelectable)
+
+        self.label = QGraphicsSimpleTextItem(name, self)
+        self.label.setBrush(QBrush(QColor(255, 215, 0)))
+        self.label.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIgnoresTransformations)
+        self.label.setPos(self.path().boundingRect().topLeft())
+
 class LineItem(QGraphicsLineItem):
     screen_handle_size = 14
 
@@ -274,36 +405,99 @@ class LineItem(QGraphicsLineItem):
         painter.drawEllipse(p2, s/2, s/2)
 
 class GridOverlayItem(QGraphicsItem):
-    def __init__(self, rect, cell_size, callback, parent=None):
+    # Grid lines closer than this on screen are not drawn
+    min_screen_spacing = 4
+    heatmap_opacity = 0.6
+
+    def __init__(self, rect, cell_size, callback, cell_h=None, stride_x=None, stride_y=None, parent=None):
         super().__init__(parent)
         self.rect_area = rect
         self.cell_size = cell_size
+        self.cell_h = cell_h or cell_size
+        # Lines and heatmap cells follow the stride, a cell is cell_size x cell_h from there
+        self.step_x = stride_x or cell_size
+        self.step_y = stride_y or self.cell_h
         self.callback = callback
+        self.heatmap_image = None # Small QImage, one pixel per cell
         self.setZValue(80) # Grid below selection (100) but above overlay (50)
+        # Needed for option.exposedRect to be filled in paint()
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
         # Accept hover events to show highlight? Maybe later.
         
     def boundingRect(self):
         return self.rect_area
+
+    def set_heatmap(self, values):
+        """
+        values: (rows, cols) array with one value per cell, or None.
+        The colour image is built once here and scaled up when painting.
+        """
+        if values is None or np.size(values) == 0:
+            self.heatmap_image = None
+        else:
+            self.heatmap_image = rgba_to_qimage(colormap.apply_colormap(values))
+        self.update()
     
     def paint(self, painter, option, widget=None):
+        exposed = option.exposedRect.intersected(self.rect_area)
+        if exposed.isEmpty():
+            return
+
+        l, t = self.rect_area.x(), self.rect_area.y()
+        sx, sy = self.step_x, self.step_y
+
+        if self.heatmap_image is not None:
+            self.paint_heatmap(painter, exposed, l, t, sx, sy)
+
+        # Skip the lines when they would be denser than a few screen pixels
+        scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        if min(sx, sy) * scale < self.min_screen_spacing:
+            return
+
         # Draw grid lines
         pen = QPen(QColor(0, 255, 255, 100), 1, Qt.PenStyle.DashLine)
         pen.setCosmetic(True)
         painter.setPen(pen)
-        
-        l, t, w, h = self.rect_area.x(), self.rect_area.y(), self.rect_area.width(), self.rect_area.height()
-        
-        # Vertical lines
-        x = l
-        while x <= l + w:
-            painter.drawLine(QPointF(x, t), QPointF(x, t + h))
-            x += self.cell_size
-            
-        # Horizontal lines
-        y = t
-        while y <= t + h:
-            painter.drawLine(QPointF(l, y), QPointF(l + w, y))
-            y += self.cell_size
+
+        right = l + self.rect_area.width()
+        bottom = t + self.rect_area.height()
+
+        # Only the lines crossing the exposed rect, clipped to it
+        first_col = max(0, math.ceil((exposed.left() - l) / sx))
+        last_col = math.floor((min(exposed.right(), right) - l) / sx)
+        first_row = max(0, math.ceil((exposed.top() - t) / sy))
+        last_row = math.floor((min(exposed.bottom(), bottom) - t) / sy)
+
+        lines = [QLineF(l + c * sx, exposed.top(), l + c * sx, exposed.bottom())
+                 for c in range(first_col, last_col + 1)]
+        lines += [QLineF(exposed.left(), t + r * sy, exposed.right(), t + r * sy)
+                  for r in range(first_row, last_row + 1)]
+        if lines:
+            painter.drawLines(lines)
+
+    def paint_heatmap(self, painter, exposed, l, t, sx, sy):
+        cols = self.heatmap_image.width()
+        rows = self.heatmap_image.height()
+
+        # Exposed part in cell units; overlapping cells are shown one stride wide
+        c0 = max(0, math.floor((exposed.left() - l) / sx))
+        r0 = max(0, math.floor((exposed.top() - t) / sy))
+        c1 = min(cols, math.ceil((exposed.right() - l) / sx))
+        r1 = min(rows, math.ceil((exposed.bottom() - t) / sy))
+        if c0 >= c1 or r0 >= r1:
+            return
+
+        target = QRectF(l + c0 * sx, t + r0 * sy, (c1 - c0) * sx, (r1 - r0) * sy)
+        # The last (clipped) cells end at the grid area
+        target = target.intersected(self.rect_area)
+        source = QRectF(c0, r0, target.width() / sx, target.height() / sy)
+
+        painter.save()
+        painter.setOpacity(self.heatmap_opacity)
+        # Nearest neighbour scaling keeps cell borders sharp
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, False)
+        painter.drawImage(target, self.heatmap_image, source)
+        painter.restore()
 
     def mousePressEvent(self, event):
         pos = event.pos()
@@ -312,16 +506,16 @@ class GridOverlayItem(QGraphicsItem):
             rel_x = pos.x() - self.rect_area.x()
             rel_y = pos.y() - self.rect_area.y()
             
-            col = int(rel_x // self.cell_size)
-            row = int(rel_y // self.cell_size)
+            col = int(rel_x // self.step_x)
+            row = int(rel_y // self.step_y)
             
-            cell_x = self.rect_area.x() + col * self.cell_size
-            cell_y = self.rect_area.y() + row * self.cell_size
+            cell_x = self.rect_area.x() + col * self.step_x
+            cell_y = self.rect_area.y() + row * self.step_y
             
             # Ensure we don't go out of bounds (shouldn't happen with contains check but good to clamp)
             # Actually, standard grid logic is fine.
             
-            cell_rect = QRectF(cell_x, cell_y, self.cell_size, self.cell_size)
+            cell_rect = QRectF(cell_x, cell_y, self.cell_size, self.cell_h)
             
             # intersect with image rect to handle edges? 
             # self.rect_area IS the image rect usually.
@@ -333,10 +527,112 @@ class GridOverlayItem(QGraphicsItem):
             event.accept()
 
 
+class MapLayerItem(QGraphicsPixmapItem):
+    """
+    Colour-mapped value layer over the image (delta maps, local statistics...).
+    The map is rendered once to a pixmap with one pixel per map cell and
+    scaled up by the item transform.
+    """
+    def __init__(self, values, origin=(0, 0), cell_size=1, vmin=None, vmax=None, parent=None):
+        super().__init__(parent)
+        self.setPixmap(QPixmap.fromImage(rgba_to_qimage(colormap.apply_colormap(values, vmin, vmax))))
+        self.setTransformationMode(Qt.TransformationMode.FastTransformation)
+        self.setPos(origin[0], origin[1])
+        self.setScale(cell_size)
+        self.setOpacity(0.7)
+        self.setZValue(85) # Above grid (80), below selections (90+)
+
+
+class DisplayLayerItem(QGraphicsItem):
+    """
+    The image in a display mode (single channel, HSV / LAB channel, R/G
+    ratio in false colour, see app.core.display_modes), drawn over the
+    original pixmap. Only the visible tiles are rendered, from every
+    2^level-th pixel of the decoded array when zoomed out, so a tile never
+    costs more than tile_size^2 pixels. Rendered tiles are kept per mode,
+    switching back to a mode redraws from the cache.
+    """
+    tile_size = 512
+    cache_bytes = 256 * 1024 * 1024
+
+    def __init__(self, width, height, parent=None):
+        super().__init__(parent)
+        self.rect_area = QRectF(0, 0, width, height)
+        self.img_arr = None
+        self.mode = 'rgb'
+        self.tiles = OrderedDict() # (mode, level, tx, ty) -> QPixmap
+        self.tiles_size = 0
+        self.ranges = {} # mode -> (vmin, vmax), the same for every tile
+        self.max_value = None # Full scale of the image (image_store.display_max)
+        self.setZValue(1) # Over the image (0), below the overlay (50)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+    def boundingRect(self):
+        return self.rect_area
+
+    def set_array(self, img_arr):
+        self.img_arr = img_arr
+        self.tiles.clear()
+        self.tiles_size = 0
+        self.ranges = {}
+        self.max_value = None
+        self.update()
+
+    def set_mode(self, mode):
+        self.mode = mode
+        self.setVisible(mode != 'rgb')
+        self.update()
+
+    def tile(self, level, tx, ty):
+        key = (self.mode, level, tx, ty)
+        pixmap = self.tiles.get(key)
+        if pixmap is not None:
+            self.tiles.move_to_end(key)
+            return pixmap
+
+        if self.max_value is None:
+            self.max_value = image_store.display_max(self.img_arr)
+        if self.mode not in self.ranges:
+            self.ranges[self.mode] = display_modes.mode_range(self.img_arr, self.mode, self.max_value)
+        step = 1 << level
+        span = self.tile_size * step
+        block = self.img_arr[ty * span:(ty + 1) * span:step, tx * span:(tx + 1) * span:step]
+        pixmap = array_to_pixmap(display_modes.render_block(block, self.mode, *self.ranges[self.mode], self.max_value))
+
+        self.tiles[key] = pixmap
+        self.tiles_size += pixmap.width() * pixmap.height() * 4
+        while self.tiles_size > self.cache_bytes and len(self.tiles) > 1:
+            _, old = self.tiles.popitem(last=False)
+            self.tiles_size -= old.width() * old.height() * 4
+        return pixmap
+
+    def paint(self, painter, option, widget=None):
+        if self.img_arr is None or self.mode == 'rgb':
+            return
+        exposed = option.exposedRect.intersected(self.rect_area)
+        if exposed.isEmpty():
+            return
+
+        # Coarsest level whose pixels are still no larger than a screen pixel
+        scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        level = max(0, int(math.floor(math.log2(1.0 / scale)))) if scale > 0 else 0
+        span = self.tile_size << level
+        img_h, img_w = self.img_arr.shape[:2]
+
+        for ty in range(int(exposed.top()) // span, min(math.ceil(exposed.bottom() / span), -(-img_h // span))):
+            for tx in range(int(exposed.left()) // span, min(math.ceil(exposed.right() / span), -(-img_w // span))):
+                pixmap = self.tile(level, tx, ty)
+                x0, y0 = tx * span, ty * span
+                target = QRectF(x0, y0, min(span, img_w - x0), min(span, img_h - y0))
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+
+
 class ImageViewer(QGraphicsView):
     grid_clicked = pyqtSignal(QRectF) 
     item_changed = pyqtSignal() # Signal when roi changes (release)
     files_dropped = pyqtSignal(list)
+    pixel_hovered = pyqtSignal(object) # processor.pixel_values dict, None off the image
+    pixels_loaded = pyqtSignal(str) # pixel_array of this image path is ready (decoded on a worker)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -354,10 +650,31 @@ class ImageViewer(QGraphicsView):
         
         self.grid_item = None
         self.grid_cell_size = 50
+        self.grid_layout = {} # cell_h, stride_x, stride_y, region (x, y, w, h) of a window grid
         self.is_grid_enabled = False
+        self.grid_heatmap = None
+
+        self.roi_items = [] # Multi-ROI layer (RoiRectItem / RoiShapeItem)
+        self.map_item = None # MapLayerItem
+
+        self.mask_item = None # Current polygon / ellipse / brush selection
+        self.drawing_shape = None # Mask tool being drawn right now
+        self.polygon_points = []
+        self.draw_start = None
+        self.brush_radius = 10
         
         self.current_tool = 'rect' # 'rect' or 'line'
         self.is_drawing_line = False
+
+        # Decoded array of the current image for the pixel inspector, loaded
+        # once per image in the background; hover events only index into it
+        self.pixel_array = None
+        self.pixel_worker = None
+        self.inspector_size = 1
+        self.last_hover_pixel = None
+
+        self.display_mode = 'rgb'
+        self.display_item = None # DisplayLayerItem, only while a mode other than 'rgb' is used
         
         # Enable mouse tracking
         self.setDragMode(QGraphicsView.DragMode.ScrollHandDrag)
@@ -368,12 +685,15 @@ class ImageViewer(QGraphicsView):
         self.setBackgroundBrush(QBrush(QColor("#222")))
         
         self.setAcceptDrops(True)
+        self.setMouseTracking(True)
 
     def set_tool(self, tool_mode):
         self.current_tool = tool_mode
         self.update_tool_visibility()
         
-        if tool_mode == 'line':
+        self.cancel_polygon()
+
+        if tool_mode == 'line' or tool_mode in MASK_TOOLS:
             self.setDragMode(QGraphicsView.DragMode.NoDrag)
             self.viewport().setCursor(Qt.CursorShape.CrossCursor)
         else:
@@ -390,6 +710,8 @@ class ImageViewer(QGraphicsView):
         # Yes, standard behavior:
         if self.line_item:
             self.line_item.setVisible(self.current_tool == 'line')
+        if self.mask_item:
+            self.mask_item.setVisible(self.mask_item.shape_data['type'] == self.current_tool)
 
     def mousePressEvent(self, event):
         # Allow items to handle event first (e.g. handles)
@@ -416,6 +738,112 @@ class ImageViewer(QGraphicsView):
             self.is_drawing_line = True
             event.accept()
 
+        elif self.current_tool in MASK_TOOLS and self.image_item:
+            self.mask_press(event)
+            event.accept()
+
+    def mask_press(self, event):
+        sp = self.mapToScene(event.pos())
+        point = (sp.x(), sp.y())
+
+        # Right button: finish the polygon or clear the mask
+        if event.button() == Qt.MouseButton.RightButton:
+            if self.drawing_shape == 'polygon':
+                self.finish_polygon()
+            else:
+                self.set_mask_shape(None)
+                self.item_changed.emit()
+            return
+
+        if self.current_tool == 'polygon':
+            if self.drawing_shape != 'polygon':
+                self.drawing_shape = 'polygon'
+                self.polygon_points = []
+            self.polygon_points.append(point)
+            self.set_mask_shape({'type': 'polygon', 'points': list(self.polygon_points)})
+
+        elif self.current_tool == 'ellipse':
+            self.drawing_shape = 'ellipse'
+            self.draw_start = point
+            self.set_mask_shape({'type': 'ellipse', 'rect': (point[0], point[1], 0, 0)})
+
+        elif self.current_tool == 'brush':
+            # Brush strokes add up until the mask is cleared with the right button
+            self.drawing_shape = 'brush'
+            strokes = []
+            if self.mask_item and self.mask_item.shape_data['type'] == 'brush':
+                strokes = [list(stroke) for stroke in self.mask_item.shape_data['strokes']]
+            strokes.append([point])
+            self.set_mask_shape({'type': 'brush', 'strokes': strokes, 'radius': self.brush_radius})
+
+    def mask_move(self, event):
+        sp = self.mapToScene(event.pos())
+        x, y = sp.x(), sp.y()
+
+        if self.drawing_shape == 'polygon':
+            # Preview with the cursor as the next vertex
+            self.set_mask_shape({'type': 'polygon', 'points': self.polygon_points + [(x, y)]})
+
+        elif self.drawing_shape == 'ellipse':
+            x0, y0 = self.draw_start
+            rect = (min(x0, x), min(y0, y), abs(x - x0), abs(y - y0))
+            self.set_mask_shape({'type': 'ellipse', 'rect': rect})
+
+        elif self.drawing_shape == 'brush':
+            shape = self.mask_item.shape_data
+            last_x, last_y = shape['strokes'][-1][-1]
+            if abs(x - last_x) >= 1 or abs(y - last_y) >= 1:
+                shape['strokes'][-1].append((x, y))
+                self.mask_item.set_shape(shape)
+
+    def finish_polygon(self):
+        points = self.polygon_points
+        # Double click also produced a press at the last vertex
+        if len(points) >= 2 and points[-1] == points[-2]:
+            points = points[:-1]
+
+        self.drawing_shape = None
+        self.polygon_points = []
+        self.set_mask_shape({'type': 'polygon', 'points': points} if len(points) >= 3 else None)
+        self.item_changed.emit()
+
+    def cancel_polygon(self):
+        if self.drawing_shape == 'polygon':
+            self.drawing_shape = None
+            self.polygon_points = []
+            self.set_mask_shape(None)
+
+    def set_mask_shape(self, shape):
+        if shape is None:
+            if self.mask_item:
+                self.scene.removeItem(self.mask_item)
+                self.mask_item = None
+            return
+
+        if self.mask_item:
+            self.mask_item.set_shape(shape)
+        else:
+            self.mask_item = ShapeItem(shape)
+            self.mask_item.setZValue(100)
+            self.scene.addItem(self.mask_item)
+        self.mask_item.setVisible(True)
+
+    def get_selection_shape(self):
+        """Mask shape of the current tool in image coordinates, or None"""
+        if not self.image_path or not self.mask_item or self.drawing_shape:
+            return None
+        shape = self.mask_item.get_image_shape()
+        if shape['type'] != self.current_tool:
+            return None
+        return shape
+
+    def mouseDoubleClickEvent(self, event):
+        if self.drawing_shape == 'polygon':
+            self.finish_polygon()
+            event.accept()
+            return
+        super().mouseDoubleClickEvent(event)
+
     def mouseMoveEvent(self, event):
         super().mouseMoveEvent(event)
         
@@ -428,6 +856,63 @@ class ImageViewer(QGraphicsView):
             # Might be heavy, let's wait for release or timer.
             # self.item_changed.emit() 
 
+        if self.drawing_shape and self.mask_item:
+            self.mask_move(event)
+
+        self.inspect_pixel(self.mapToScene(event.pos()))
+
+    def leaveEvent(self, event):
+        super().leaveEvent(event)
+        self.last_hover_pixel = None
+        self.pixel_hovered.emit(None)
+
+    def load_pixel_array(self, path):
+        """ Decodes the image for the inspector on a worker (the store's memory map is used directly) """
+        self.pixel_array = None
+        self.last_hover_pixel = None
+        if is_store_enabled():
+            try:
+                self.pixel_array = image_store.load_image_array(path)
+                return
+            except Exception as e:
+                print(f"Error loading stored image: {e}")
+        self.pixel_worker = start_worker(image_store.load_image_array, path,
+                                         on_finished=lambda arr, p=path: self.on_pixel_array(p, arr))
+
+    def on_pixel_array(self, path, img_arr):
+        # Ignore arrays of images that are no longer shown
+        if path == self.image_path:
+            self.pixel_array = img_arr
+            self.pixel_worker = None
+            if self.display_item:
+                self.display_item.set_array(img_arr)
+            self.pixels_loaded.emit(path)
+
+    def set_display_mode(self, mode):
+        """ Shows the image as one channel or a false-colour map (see DisplayLayerItem), 'rgb' for the original """
+        self.display_mode = mode
+        if self.display_item is None and mode != 'rgb' and self.image_item is not None:
+            self.display_item = DisplayLayerItem(self.pixmap.width(), self.pixmap.height())
+            self.scene.addItem(self.display_item)
+            if self.pixel_array is not None:
+                self.display_item.set_array(self.pixel_array)
+        if self.display_item:
+            self.display_item.set_mode(mode)
+
+    def set_inspector_size(self, size):
+        self.inspector_size = max(1, int(size))
+        self.last_hover_pixel = None
+
+    def inspect_pixel(self, scene_pos):
+        """ Emits pixel_hovered for the image pixel under scene_pos, only when the pixel changes """
+        if self.pixel_array is None:
+            return
+        pixel = (math.floor(scene_pos.x()), math.floor(scene_pos.y()))
+        if pixel == self.last_hover_pixel:
+            return
+        self.last_hover_pixel = pixel
+        self.pixel_hovered.emit(processor.pixel_values(self.pixel_array, pixel[0], pixel[1], self.inspector_size))
+
     def mouseReleaseEvent(self, event):
         super().mouseReleaseEvent(event)
         
@@ -435,6 +920,11 @@ class ImageViewer(QGraphicsView):
             self.is_drawing_line = False
             self.item_changed.emit()
 
+        if self.drawing_shape in ('ellipse', 'brush'):
+            self.mask_move(event)
+            self.drawing_shape = None
+            self.item_changed.emit()
+
     def get_line_coords(self):
         if not self.line_item or not self.image_path: return None
         
@@ -447,14 +937,71 @@ class ImageViewer(QGraphicsView):
         
         return (int(p1.x()), int(p1.y()), int(p2.x()), int(p2.y()))
 
+    def add_roi(self, name, rect=None, shape=None):
+        """
+        Adds a named region in image coordinates:
+        rect (x, y, w, h) or a mask shape (see app.core.masks).
+        """
+        if shape is not None:
+            item = RoiShapeItem(name, shape)
+        else:
+            x, y, w, h = rect
+            item = RoiRectItem(name, QRectF(0, 0, w, h))
+            item.setPos(x, y)
+        item.setZValue(90) # Below the main selection (100)
+        self.scene.addItem(item)
+        self.roi_items.append(item)
+        return item
+
+    def remove_selected_rois(self):
+        selected = [item for item in self.roi_items if item.isSelected()]
+        for item in selected:
+            self.scene.removeItem(item)
+            self.roi_items.remove(item)
+        return len(selected)
+
+    def clear_rois(self):
+        for item in self.roi_items:
+            self.scene.removeItem(item)
+        self.roi_items = []
+
+    def get_rois(self):
+        """List of {'name', 'rect'} or {'name', 'shape'} for the multi-ROI layer"""
+        rois = []
+        for item in self.roi_items:
+            if isinstance(item, RoiShapeItem):
+                rois.append({'name': item.name, 'shape': item.get_image_shape()})
+            else:
+                rois.append({'name': item.name, 'rect': item.get_image_rect()})
+        return rois
+
     def get_overlay_info(self):
         if self.overlay_item and self.overlay_path:
             return self.overlay_path, self.overlay_item.pos()
         return None
 
+    def load_pixmap(self, path):
+        # With the decoded store enabled build the pixmap from the memory-mapped
+        # array instead of decoding the file once more
+        if is_store_enabled():
+            try:
+                return array_to_pixmap(image_store.load_image_array(path))
+            except Exception as e:
+                print(f"Error loading stored image: {e}")
+
+        pixmap = QPixmap(path)
+        if pixmap.isNull():
+            # Formats Qt can't read (e.g. float TIFF) go through the decoder
+            try:
+                return array_to_pixmap(image_store.load_image_array(path))
+            except Exception as e:
+                print(f"Error decoding image: {e}")
+        return pixmap
+
     def load_image(self, path):
         self.image_path = path
-        self.pixmap = QPixmap(path)
+        self.pixmap = self.load_pixmap(path)
+        self.load_pixel_array(path)
         
         # Save current overlay settings
         current_overlay_pixmap = self.overlay_pixmap
@@ -474,9 +1021,25 @@ class ImageViewer(QGraphicsView):
             current_line = self.line_item.line()
             current_line_pos = self.line_item.pos()
 
+        # Save multi-ROI layer and mask selection
+        self.cancel_polygon()
+        current_rois = self.get_rois()
+        current_mask = self.mask_item.get_image_shape() if self.mask_item else None
+
         self.scene.clear()
+        self.roi_items = []
+        for roi in current_rois:
+            self.add_roi(roi['name'], roi.get('rect'), roi.get('shape'))
+        self.mask_item = None
+        if current_mask:
+            self.set_mask_shape(current_mask)
+        self.grid_item = None # Deleted together with the scene items
+        self.map_item = None # Maps belong to the previous image
+        self.grid_heatmap = None # Belongs to the previous image
         self.image_item = self.scene.addPixmap(self.pixmap)
         self.image_item.setZValue(0)
+        self.display_item = None # Tiles belong to the previous image
+        self.set_display_mode(self.display_mode)
         
         self.setSceneRect(QRectF(self.pixmap.rect()))
         
@@ -532,10 +1095,14 @@ class ImageViewer(QGraphicsView):
         if self.is_grid_enabled:
             self.refresh_grid()
 
-    def set_grid(self, enabled, cell_size=None):
+    def set_grid(self, enabled, cell_size=None, layout=None):
         self.is_grid_enabled = enabled
         if cell_size:
+            if cell_size != self.grid_cell_size or (layout is not None and layout != self.grid_layout):
+                self.grid_heatmap = None # Computed for the old cell size
             self.grid_cell_size = cell_size
+        if layout is not None:
+            self.grid_layout = dict(layout)
         self.refresh_grid()
         
         # Toggle interactive mode for rect item
@@ -554,8 +1121,32 @@ class ImageViewer(QGraphicsView):
             
         if self.is_grid_enabled and self.pixmap:
             rect = QRectF(self.pixmap.rect())
-            self.grid_item = GridOverlayItem(rect, self.grid_cell_size, self.on_grid_click)
+            region = self.grid_layout.get('region')
+            if region is not None:
+                rect = rect.intersected(QRectF(*region))
+            self.grid_item = GridOverlayItem(rect, self.grid_cell_size, self.on_grid_click,
+                                             self.grid_layout.get('cell_h'), self.grid_layout.get('stride_x'),
+                                             self.grid_layout.get('stride_y'))
+            self.grid_item.set_heatmap(self.grid_heatmap)
             self.scene.addItem(self.grid_item)
+
+    def set_map_layer(self, values, origin=(0, 0), cell_size=1, vmin=None, vmax=None):
+        """ Shows a value map as a colour layer, values=None removes it """
+        if self.map_item:
+            self.scene.removeItem(self.map_item)
+            self.map_item = None
+
+        if values is None or np.size(values) == 0:
+            return
+
+        self.map_item = MapLayerItem(values, origin, cell_size, vmin, vmax)
+        self.scene.addItem(self.map_item)
+
+    def set_grid_heatmap(self, values):
+        """ Per-cell values for the grid heatmap layer (None to hide) """
+        self.grid_heatmap = values
+        if self.grid_item:
+            self.grid_item.set_heatmap(values)
             
     def on_grid_click(self, cell_rect):
         # We also want to update the red selection rect to match the cell
@@ -583,7 +1174,7 @@ class ImageViewer(QGraphicsView):
             return
 
         self.overlay_path = path
-        self.overlay_pixmap = QPixmap(path)
+        self.overlay_pixmap = self.load_pixmap(path)
         if self.overlay_item:
             self.overlay_item.setPixmap(self.overlay_pixmap)
         else:
@@ -607,6 +1198,11 @@ class ImageViewer(QGraphicsView):
             
             self.overlay_item.setPos(x, y)
 
+    def set_overlay_pos(self, x, y):
+        """ Moves the overlay's top-left corner to (x, y) in base image coordinates """
+        if self.overlay_item:
+            self.overlay_item.setPos(x, y)
+
     def set_overlay_opacity(self, opacity):
         if self.overlay_item:
             self.overlay_item.setOpacity(opacity)
@@ -1,16 +1,61 @@
 from PyQt6.QtWidgets import QWidget
-from PyQt6.QtGui import QPainter, QColor, QPen, QBrush, QPainterPath
+from PyQt6.QtGui import QPainter, QColor, QPen, QBrush, QPolygonF
 from PyQt6.QtCore import Qt
-import numpy as np
+
+from app.startup import LazyModule
+
+# Loaded on first use, see app.startup
+np = LazyModule('numpy')
+
+
+def array_to_polygon(xs, ys):
+    """Builds a QPolygonF from coordinate arrays by writing into its buffer"""
+    n = len(xs)
+    polygon = QPolygonF()
+    polygon.resize(n)
+    if n == 0:
+        return polygon
+
+    # QPointF is two doubles, so the polygon memory is an (n, 2) float64 array
+    ptr = polygon.data()
+    ptr.setsize(n * 2 * 8)
+    buf = np.frombuffer(ptr, dtype=np.float64).reshape(n, 2)
+    buf[:, 0] = xs
+    buf[:, 1] = ys
+    return polygon
+
+
+def decimate_min_max(values, columns):
+    """
+    Reduces a long series to min and max per output column.
+    Returns (positions, values) where positions are in source index units.
+    """
+    values = np.asarray(values)
+    n = len(values)
+    if n <= 2 * columns:
+        return np.arange(n, dtype=np.float64), values.astype(np.float64)
+
+    starts = (np.arange(columns) * n) // columns
+    mins = np.minimum.reduceat(values, starts).astype(np.float64)
+    maxs = np.maximum.reduceat(values, starts).astype(np.float64)
+
+    positions = np.repeat(starts.astype(np.float64), 2)
+    out = np.empty(2 * columns, dtype=np.float64)
+    out[0::2] = mins
+    out[1::2] = maxs
+    return positions, out
 
 class HistogramWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setMinimumHeight(150)
         self.hist_data = None # {'r': [], 'g': [], 'b': []}
+        self.polygons = None # Cached channel polygons for polygons_size
+        self.polygons_size = None
 
     def set_data(self, r_hist, g_hist, b_hist):
         self.hist_data = {'r': r_hist, 'g': g_hist, 'b': b_hist}
+        self.polygons = None
         self.update()
 
     def paintEvent(self, event):
@@ -30,7 +75,20 @@ class HistogramWidget(QWidget):
             painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, "Нет данных для гистограммы")
             return
 
-        # Draw histograms
+        # Polygons are rebuilt only when the data or the widget size changes
+        if self.polygons is None or self.polygons_size != (w, h):
+            self.polygons = self.build_polygons(w, h)
+            self.polygons_size = (w, h)
+
+        if not self.polygons: return
+
+        colors = [QColor(255, 50, 50, 150), QColor(50, 255, 50, 150), QColor(50, 50, 255, 150)]
+        painter.setPen(Qt.PenStyle.NoPen)
+        for polygon, color in zip(self.polygons, colors):
+            painter.setBrush(QBrush(color))
+            painter.drawPolygon(polygon)
+
+    def build_polygons(self, w, h):
         # Max value for normalization
         max_val = max(
             np.max(self.hist_data['r']), 
@@ -38,40 +96,36 @@ class HistogramWidget(QWidget):
             np.max(self.hist_data['b'])
         )
         
-        if max_val == 0: return
+        if max_val == 0: return []
 
-        self.draw_channel(painter, self.hist_data['r'], QColor(255, 50, 50, 150), w, h, max_val)
-        self.draw_channel(painter, self.hist_data['g'], QColor(50, 255, 50, 150), w, h, max_val)
-        self.draw_channel(painter, self.hist_data['b'], QColor(50, 50, 255, 150), w, h, max_val)
+        return [self.channel_polygon(self.hist_data[c], w, h, max_val) for c in ('r', 'g', 'b')]
 
-    def draw_channel(self, painter, data, color, w, h, max_val):
-        path = QPainterPath()
-        path.moveTo(0, h)
-        
-        bin_w = w / 256
-        
-        for i, val in enumerate(data):
-            bar_h = (val / max_val) * (h - 10) # 10px padding top
-            x = i * bin_w
-            y = h - bar_h
-            path.lineTo(x, y)
-            path.lineTo(x + bin_w, y)
-            
-        path.lineTo(w, h)
-        path.closeSubpath()
-        
-        painter.setBrush(QBrush(color))
-        painter.setPen(Qt.PenStyle.NoPen)
-        painter.drawPath(path)
+    def channel_polygon(self, data, w, h, max_val):
+        data = np.asarray(data, dtype=np.float64)
+        n = len(data)
+        bin_w = w / n
+
+        # Step outline: every bin contributes its left and right top corners
+        edges = np.arange(n + 1) * bin_w
+        xs = np.concatenate(([0.0], np.repeat(edges, 2)[1:-1], [w]))
+        bar_y = h - (data / max_val) * (h - 10) # 10px padding top
+        ys = np.concatenate(([h], np.repeat(bar_y, 2), [h]))
+
+        return array_to_polygon(xs, ys)
 
 class LineProfileWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setMinimumHeight(150)
         self.profile_data = None # {'r': [], 'g': [], 'b': []}
+        self.max_value = 255 # Full scale of the data (65535 for 16-bit images)
+        self.polylines = None # Cached decimated polylines for polylines_size
+        self.polylines_size = None
 
-    def set_data(self, r, g, b):
+    def set_data(self, r, g, b, max_value=255):
         self.profile_data = {'r': r, 'g': g, 'b': b}
+        self.max_value = max_value
+        self.polylines = None
         self.update()
 
     def paintEvent(self, event):
@@ -91,35 +145,103 @@ class LineProfileWidget(QWidget):
             painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, "Нарисуйте линию для профиля")
             return
 
-        # Max value is usually 255 for images
-        max_val = 255
+        max_val = self.max_value
         
-        # Draw grid lines for 0, 128, 255
+        # Draw grid line at half scale
         painter.setPen(QPen(QColor("#333"), 1, Qt.PenStyle.DashLine))
         painter.drawLine(0, h//2, w, h//2)
         
-        num_points = len(self.profile_data['r'])
-        step_x = w / (num_points - 1) if num_points > 1 else w
+        # Polylines are rebuilt only when the data or the widget size changes
+        if self.polylines is None or self.polylines_size != (w, h):
+            num_points = len(self.profile_data['r'])
+            step_x = w / (num_points - 1) if num_points > 1 else w
+            self.polylines = [self.build_polyline(self.profile_data[c], w, h, max_val, step_x) for c in ('r', 'g', 'b')]
+            self.polylines_size = (w, h)
 
-        self.draw_line(painter, self.profile_data['r'], QColor(255, 50, 50), w, h, max_val, step_x)
-        self.draw_line(painter, self.profile_data['g'], QColor(50, 255, 50), w, h, max_val, step_x)
-        self.draw_line(painter, self.profile_data['b'], QColor(50, 50, 255), w, h, max_val, step_x)
+        colors = [QColor(255, 50, 50), QColor(50, 255, 50), QColor(50, 50, 255)]
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+        for polyline, color in zip(self.polylines, colors):
+            pen = QPen(color, 2)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.drawPolyline(polyline)
+
+    def build_polyline(self, data, w, h, max_val, step_x):
+        # Long profiles are reduced to min/max per pixel column,
+        # so the drawing cost depends on the widget width only
+        positions, values = decimate_min_max(data, max(1, w))
+        xs = positions * step_x
+        ys = h - (values / max_val) * (h - 10)
+        return array_to_polygon(xs, ys)
+
+class TimeSeriesWidget(QWidget):
+    """ Curves of per-frame values (video / frame sequence statistics) over time """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(150)
+        self.times = None
+        self.curves = [] # [(values, QColor)]
+        self.unit = "с"
+        self.polylines = None # Cached decimated polylines for polylines_size
+        self.polylines_size = None
+
+    def set_data(self, times, curves, unit="с"):
+        self.times = None if times is None else np.asarray(times, dtype=np.float64)
+        self.curves = [(np.asarray(values, dtype=np.float64), color) for values, color in curves]
+        self.unit = unit
+        self.polylines = None
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+        w = self.width()
+        h = self.height()
+
+        # Background
+        painter.fillRect(0, 0, w, h, QColor("#1e1e1e"))
+        painter.setPen(QPen(QColor("#444"), 1))
+        painter.drawRect(0, 0, w-1, h-1)
+
+        if self.times is None or len(self.times) == 0 or not self.curves:
+            painter.setPen(QColor("#777"))
+            painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, "Нет временного ряда")
+            return
+
+        values = np.concatenate([v for v, _ in self.curves])
+        values = values[np.isfinite(values)]
+        vmin, vmax = (float(values.min()), float(values.max())) if values.size else (0.0, 1.0)
+        if vmax - vmin < 1e-9:
+            vmin, vmax = vmin - 0.5, vmax + 0.5
+
+        painter.setPen(QPen(QColor("#333"), 1, Qt.PenStyle.DashLine))
+        painter.drawLine(0, h//2, w, h//2)
+
+        # Polylines are rebuilt only when the data or the widget size changes
+        if self.polylines is None or self.polylines_size != (w, h):
+            self.polylines = [self.build_polyline(v, w, h, vmin, vmax) for v, _ in self.curves]
+            self.polylines_size = (w, h)
 
-    def draw_line(self, painter, data, color, w, h, max_val, step_x):
-        path = QPainterPath()
-        
-        # Start point
-        y_start = h - (data[0] / max_val) * (h - 10)
-        path.moveTo(0, y_start)
-        
-        for i, val in enumerate(data):
-            if i == 0: continue
-            y = h - (val / max_val) * (h - 10)
-            x = i * step_x
-            path.lineTo(x, y)
-            
-        pen = QPen(color, 2)
-        pen.setCosmetic(True)
-        painter.setPen(pen)
         painter.setBrush(Qt.BrushStyle.NoBrush)
-        painter.drawPath(path)
+        for polyline, (_, color) in zip(self.polylines, self.curves):
+            pen = QPen(color, 2)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.drawPolyline(polyline)
+
+        painter.setPen(QColor("#aaa"))
+        painter.drawText(4, 14, f"{vmax:.4g}")
+        painter.drawText(4, h - 4, f"{vmin:.4g}")
+        end = f"{self.times[-1]:.4g} {self.unit}"
+        painter.drawText(w - 6 - painter.fontMetrics().horizontalAdvance(end), h - 4, end)
+
+    def build_polyline(self, data, w, h, vmin, vmax):
+        # Long series are reduced to min/max per pixel column
+        positions, values = decimate_min_max(data, max(1, w))
+        t = self.times[positions.astype(np.int64)]
+        t0, t1 = self.times[0], self.times[-1]
+        xs = (t - t0) / (t1 - t0) * (w - 1) if t1 > t0 else np.zeros(len(t))
+        ys = h - 5 - (values - vmin) / (vmax - vmin) * (h - 25)
+        return array_to_polygon(xs, ys)
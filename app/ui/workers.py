@@ -0,0 +1,47 @@
+import traceback
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class WorkerSignals(QObject):
+    """ Signals of a Worker, delivered to the GUI thread """
+    finished = pyqtSignal(object)
+    error = pyqtSignal(str)
+    progress = pyqtSignal(object)
+
+
+class Worker(QRunnable):
+    """ Runs fn(*args, **kwargs) on the global thread pool """
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            self.signals.error.emit(str(e))
+            return
+        self.signals.finished.emit(result)
+
+
+def start_worker(fn, *args, on_finished=None, on_error=None, on_progress=None, **kwargs):
+    """
+    Creates a Worker, connects its signals and starts it. Returns the worker.
+    With on_progress, fn gets a progress(*values) keyword argument whose
+    calls are delivered to on_progress(values) on the GUI thread.
+    """
+    worker = Worker(fn, *args, **kwargs)
+    if on_progress:
+        worker.kwargs['progress'] = lambda *values: worker.signals.progress.emit(values)
+        worker.signals.progress.connect(on_progress)
+    if on_finished:
+        worker.signals.finished.connect(on_finished)
+    if on_error:
+        worker.signals.error.connect(on_error)
+    QThreadPool.globalInstance().start(worker)
+    return worker
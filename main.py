@@ -1,9 +1,118 @@
 import sys
+import time
+
+START_TIME = time.perf_counter()
+
+
+def run_headless_watch(argv):
+    """ main.py --watch DIR [--config FILE] ...: watch mode without the window (and without Qt) """
+    import argparse
+    import os
+    from app.core import watcher
+
+    parser = argparse.ArgumentParser(description="Анализ новых изображений папки без окна")
+    parser.add_argument('--watch', required=True, metavar='DIR', help="папка для наблюдения")
+    parser.add_argument('--config', help="JSON с областями и сеткой (кнопка 'Сохранить настройку')")
+    parser.add_argument('--output', help="CSV для результатов (по умолчанию DIR/watch_results.csv)")
+    parser.add_argument('--cell-size', type=int, help="размер ячейки сетки, px")
+    parser.add_argument('--cell-h', type=int, help="высота ячейки, px (по умолчанию квадрат)")
+    parser.add_argument('--stride-x', type=int, help="шаг сетки по X, px (по умолчанию = ячейке)")
+    parser.add_argument('--stride-y', type=int, help="шаг сетки по Y, px (по умолчанию = ячейке)")
+    parser.add_argument('--region', type=int, nargs=4, metavar=('X', 'Y', 'W', 'H'), help="сетка только в этой области")
+    parser.add_argument('--partial', action='store_true', help="учитывать обрезанные ячейки у краёв")
+    parser.add_argument('--interval', type=float, default=watcher.POLL_INTERVAL, help="период опроса, с")
+    parser.add_argument('--settle', type=float, default=watcher.SETTLE_SECONDS,
+                        help="сколько файл должен не меняться перед анализом, с")
+    parser.add_argument('--workers', type=int, help="число потоков анализа")
+    parser.add_argument('--existing', action='store_true', help="также обработать уже лежащие в папке файлы")
+    args = parser.parse_args(argv)
+
+    config = watcher.load_watch_config(args.config) if args.config else {'rois': [], 'cell_size': None, 'layout': {}}
+    cell_size = args.cell_size or config['cell_size']
+    # Grid options given on the command line replace those of the config
+    layout = dict(config['layout'])
+    for key in ('cell_h', 'stride_x', 'stride_y'):
+        if getattr(args, key):
+            layout[key] = getattr(args, key)
+    if args.region:
+        layout['region'] = tuple(args.region)
+    if args.partial:
+        layout['partial'] = True
+    if not config['rois'] and not cell_size:
+        parser.error("нужны области (--config) или размер ячейки (--cell-size)")
+    if not os.path.isdir(args.watch):
+        parser.error(f"нет такой папки: {args.watch}")
+
+    def on_result(result):
+        print(f"{os.path.basename(result['path'])}: {len(result['rois'])} областей, {len(result['grid'])} ячеек", flush=True)
+
+    output = args.output or os.path.join(args.watch, "watch_results.csv")
+    print(f"Watching {os.path.abspath(args.watch)}, results in {output} (Ctrl+C to stop)", flush=True)
+    watcher.run_watch(args.watch, config['rois'], cell_size, output, args.interval, args.workers,
+                      args.settle, args.existing, on_result, layout=layout)
+
+
+def run_headless_service(argv):
+    """ main.py --serve [--port N]: local analysis service (HTTP or Unix socket) without the window """
+    import argparse
+    from app.core import service
+
+    parser = argparse.ArgumentParser(description="Локальный сервис анализа (JSON по HTTP)")
+    parser.add_argument('--serve', action='store_true', required=True)
+    parser.add_argument('--host', default=service.DEFAULT_HOST, help="адрес (по умолчанию только локальный)")
+    parser.add_argument('--port', type=int, default=service.DEFAULT_PORT)
+    parser.add_argument('--socket', help="Unix-сокет вместо TCP")
+    parser.add_argument('--workers', type=int, help="число потоков анализа")
+    parser.add_argument('--cache-mb', type=int, default=service.WARM_CACHE_BYTES // (1024 * 1024),
+                        help="память под декодированные изображения, МБ")
+    parser.add_argument('--self-check', action='store_true',
+                        help="проверить сервис запросами на свободный локальный порт и выйти")
+    args = parser.parse_args(argv)
+
+    if args.self_check:
+        failures = service.self_check()
+        print("Self-check OK" if not failures else "Self-check failed: " + "; ".join(failures), flush=True)
+        sys.exit(1 if failures else 0)
+
+    service.run_service(args.host, args.port, args.workers, args.cache_mb * 1024 * 1024, args.socket)
+
+
+if __name__ == "__main__" and '--watch' in sys.argv:
+    run_headless_watch(sys.argv[1:])
+    sys.exit(0)
+
+if __name__ == "__main__" and '--serve' in sys.argv:
+    run_headless_service(sys.argv[1:])
+    sys.exit(0)
+
+from app.startup import ImportTimer, warm_up, check_startup_budget
+
+# --import-report: print the slowest imports once the warm-up is done
+import_timer = ImportTimer()
+if '--import-report' in sys.argv:
+    import_timer.install()
+
+from PyQt6.QtCore import QTimer
 from PyQt6.QtWidgets import QApplication
 from app.ui.main_window import MainWindow
 
+
+def on_window_shown():
+    """ First event loop iteration: check the startup budget, then warm up the heavy imports """
+    startup_ms = check_startup_budget(START_TIME)
+
+    def on_warmed_up(seconds):
+        if import_timer.original_import is not None:
+            import_timer.uninstall()
+            print(f"Window shown after {startup_ms:.0f} ms, warm-up took {seconds * 1000:.0f} ms")
+            print(import_timer.report())
+
+    warm_up(on_done=on_warmed_up)
+
+
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    qt_app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
-    sys.exit(app.exec())
+    QTimer.singleShot(0, on_window_shown)
+    sys.exit(qt_app.exec())